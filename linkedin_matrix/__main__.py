@@ -1,23 +1,48 @@
 from __future__ import annotations
 
 from typing import Any
+import asyncio
+import time
 
 from mautrix.bridge import Bridge
 from mautrix.bridge.state_store.asyncpg import PgBridgeStateStore
 from mautrix.types import RoomID, UserID
+from mautrix.util import background_task
 from mautrix.util.async_db import Database
+from mautrix.util.opt_prometheus import Counter, Gauge
 
 from . import commands as _  # noqa: F401
-from .analytics import init as init_analytics
+from .analytics import init as init_analytics, stop as stop_analytics
 from .config import Config
-from .db import init as init_db, upgrade_table
+from .db import UrnMap, init as init_db, upgrade_table, write_queue
 from .matrix import MatrixHandler
 from .portal import Portal  # noqa: I100 (needs to be after because it relies on Puppet)
 from .puppet import Puppet
 from .user import User
+from .util import (
+    LoopWatchdog,
+    approximate_size,
+    get_rss,
+    monitor_loop_lag,
+    offloader,
+    task_registry,
+    thumbnailer,
+)
 from .version import linkified_version, version
 from .web import ProvisioningAPI
 
+METRIC_CACHED_OBJECTS = Gauge(
+    "bridge_cached_objects", "Number of objects in the in-memory caches", ["type"]
+)
+METRIC_CACHED_BYTES = Gauge(
+    "bridge_cached_objects_bytes",
+    "Approximate memory used by the objects in the in-memory caches",
+    ["type"],
+)
+METRIC_CACHE_EVICTIONS = Counter(
+    "bridge_cache_evictions", "Number of objects evicted from the in-memory caches", ["type"]
+)
+
 
 class LinkedInBridge(Bridge):
     name = "linkedin-matrix"
@@ -37,6 +62,10 @@ class LinkedInBridge(Bridge):
     matrix: MatrixHandler
     provisioning_api: ProvisioningAPI
     state_store: PgBridgeStateStore
+    cache_sweep_task: asyncio.Task | None = None
+    urn_backfill_task: asyncio.Task | None = None
+    loop_lag_task: asyncio.Task | None = None
+    loop_watchdog: LoopWatchdog | None = None
 
     def make_state_store(self):
         self.state_store = PgBridgeStateStore(
@@ -52,9 +81,22 @@ class LinkedInBridge(Bridge):
             db_args=self.config["appservice.database_opts"],
         )
         init_db(self.db)
+        write_queue.configure(
+            enabled=self.config["bridge.write_behind.enabled"],
+            max_batch_size=self.config["bridge.write_behind.max_batch_size"],
+            flush_interval_ms=self.config["bridge.write_behind.flush_interval_ms"],
+        )
 
     def prepare_stop(self):
         # self.periodic_reconnect_task.cancel()
+        if self.cache_sweep_task:
+            self.cache_sweep_task.cancel()
+        if self.urn_backfill_task:
+            self.urn_backfill_task.cancel()
+        if self.loop_lag_task:
+            self.loop_lag_task.cancel()
+        if self.loop_watchdog:
+            self.loop_watchdog.stop()
         self.log.debug("Stopping puppet syncers")
         for puppet in Puppet.by_custom_mxid.values():
             puppet.stop()
@@ -62,9 +104,25 @@ class LinkedInBridge(Bridge):
         User.shutdown = True
         for user in User.by_li_member_urn.values():
             user.stop_listen()
+            user.close_journal()
 
     def prepare_bridge(self):
         super().prepare_bridge()
+        task_registry.configure(self.config["bridge.background_tasks.limits"])
+        offloader.configure(
+            mode=self.config["bridge.media_offload.executor"],
+            max_workers=self.config["bridge.media_offload.max_workers"],
+            inline_threshold=self.config["bridge.media_offload.inline_threshold"],
+        )
+        thumbnailer.configure(
+            enabled=self.config["bridge.thumbnails.enabled"],
+            max_size=self.config["bridge.thumbnails.max_size"],
+            image_format=self.config["bridge.thumbnails.format"],
+            quality=self.config["bridge.thumbnails.quality"],
+            blurhash=self.config["bridge.thumbnails.blurhash"],
+            max_queue=self.config["bridge.thumbnails.max_queue"],
+            workers=self.config["bridge.thumbnails.workers"],
+        )
         if self.config["appservice.provisioning.enabled"]:
             secret = self.config["appservice.provisioning.shared_secret"]
             prefix = self.config["appservice.provisioning.prefix"]
@@ -76,15 +134,34 @@ class LinkedInBridge(Bridge):
             token = self.config["analytics.token"]
             user_id = self.config["analytics.user_id"]
             if token:
-                init_analytics(host, token, user_id)
+                init_analytics(
+                    host,
+                    token,
+                    user_id,
+                    batch_size=self.config["analytics.batch_size"],
+                    flush_interval=self.config["analytics.flush_interval"],
+                    max_queue=self.config["analytics.max_queue"],
+                    max_attempts=self.config["analytics.max_attempts"],
+                )
 
     async def stop(self):
+        self.log.debug("Sending queued analytics events")
+        await stop_analytics()
+        self.log.debug("Waiting for background tasks to finish")
+        await task_registry.drain(self.config["bridge.background_tasks.drain_timeout"])
+        # Matrix receipts go out through puppet intents, which use the session Puppet.close() ends.
+        self.log.debug("Sending pending read receipts")
+        await Portal.flush_read_receipts()
         await Puppet.close()
         self.log.debug("Saving user sessions")
         for user in User.by_mxid.values():
             await user.save()
+        # The base class stops the database, so this has to happen before.
+        self.log.debug("Flushing queued database writes")
+        await write_queue.stop()
         await super().stop()
-        await self.db.stop()
+        thumbnailer.stop()
+        offloader.shutdown()
 
     async def start(self):
         self.add_startup_actions(User.init_cls(self))
@@ -93,6 +170,99 @@ class LinkedInBridge(Bridge):
         if self.config["bridge.resend_bridge_info"]:
             self.add_startup_actions(self.resend_bridge_info())
         await super().start()
+        self.cache_sweep_task = background_task.create(self.sweep_caches_loop())
+        if len(UrnMap.backfilled) < len(UrnMap.backfill_tables):
+            self.urn_backfill_task = background_task.create(self.backfill_urn_ids())
+        if self.config["metrics.enabled"]:
+            self.loop_lag_task = background_task.create(
+                monitor_loop_lag(self.config["bridge.loop_monitor.lag_sample_interval"])
+            )
+        if (threshold := self.config["bridge.loop_monitor.slow_callback_threshold"]) > 0:
+            self.loop_watchdog = LoopWatchdog(threshold)
+            self.loop_watchdog.start()
+
+    async def start_db(self):
+        await super().start_db()
+        if self.config["bridge.startup_urn_cleanup"]:
+            # Nothing is written to the message and reaction tables yet, so this can't race
+            # with rows that are about to refer to a deleted URN.
+            start = time.monotonic()
+            deleted = await UrnMap.delete_unused()
+            self.log.info(
+                f"Deleted {deleted} unused URNs in {time.monotonic() - start:.2f} seconds"
+            )
+        await UrnMap.load_backfill_state()
+        if self.config["bridge.startup_cache_warm_up"]:
+            await self.warm_caches()
+
+    async def warm_caches(self):
+        self.log.info("Warming up user, puppet and portal caches")
+        start = time.monotonic()
+        rss_before = get_rss()
+        users = [user async for user in User.all_logged_in()]
+        li_member_urns = [user.li_member_urn for user in users if user.li_member_urn]
+        puppets = await Puppet.get_many_by_li_member_urn(li_member_urns)
+        portals = await Portal.warm_cache(li_member_urns)
+        rss_after = get_rss()
+        memory = (
+            f", RSS grew by {(rss_after - rss_before) / 2**20:.1f} MiB"
+            if rss_before is not None and rss_after is not None
+            else ""
+        )
+        self.log.info(
+            f"Cached {len(users)} users, {len(puppets)} of their puppets and {portals} portals "
+            f"({len(Puppet.by_li_member_urn)} puppets in total) in "
+            f"{time.monotonic() - start:.2f} seconds{memory}"
+        )
+
+    async def backfill_urn_ids(self):
+        batch_size = self.config["bridge.urn_backfill.batch_size"]
+        delay = self.config["bridge.urn_backfill.delay"]
+        for table in UrnMap.backfill_tables:
+            if table in UrnMap.backfilled:
+                continue
+            self.log.info(f"Filling in URN IDs of existing {table} rows")
+            start = time.monotonic()
+            processed = 0
+            while table not in UrnMap.backfilled:
+                try:
+                    processed += await UrnMap.backfill_batch(table, batch_size)
+                except Exception:
+                    self.log.exception(f"Failed to fill in URN IDs of {table} rows, retrying")
+                    await asyncio.sleep(60)
+                    continue
+                await asyncio.sleep(delay)
+            self.log.info(
+                f"Filled in the URN IDs of {table} rows for {processed} message URNs in "
+                f"{time.monotonic() - start:.2f} seconds, lookups now use the IDs"
+            )
+
+    async def sweep_caches_loop(self):
+        interval = self.config["bridge.cache_limits.sweep_interval"]
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                self.sweep_caches()
+            except Exception:
+                self.log.exception("Failed to sweep in-memory caches")
+
+    def sweep_caches(self):
+        evicted = {"portal": Portal.evict_idle(), "puppet": Puppet.evict_idle()}
+        caches = {
+            "portal": Portal.by_li_thread_urn.values(),
+            "puppet": Puppet.by_li_member_urn.values(),
+            "user": User.by_mxid.values(),
+        }
+        for cache_type, objects in caches.items():
+            METRIC_CACHED_OBJECTS.labels(type=cache_type).set(len(objects))
+            METRIC_CACHED_BYTES.labels(type=cache_type).set(approximate_size(objects))
+            if evicted.get(cache_type):
+                METRIC_CACHE_EVICTIONS.labels(type=cache_type).inc(evicted[cache_type])
+        if any(evicted.values()):
+            self.log.debug(
+                f"Evicted {evicted['portal']} portals and {evicted['puppet']} puppets "
+                "from the in-memory caches"
+            )
 
     async def resend_bridge_info(self):
         self.config["bridge.resend_bridge_info"] = False
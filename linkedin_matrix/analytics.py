@@ -1,48 +1,203 @@
 from __future__ import annotations
 
+from typing import Any
+from datetime import datetime, timezone
+import asyncio
+import base64
 import logging
+import uuid
 
 from yarl import URL
 import aiohttp
 
-from mautrix.util import background_task
+from mautrix.util.opt_prometheus import Counter, Gauge
 
 from . import user as u
+from .util import task_registry
 
 log = logging.getLogger("mau.web.public.analytics")
-http: aiohttp.ClientSession | None = None
-analytics_url: URL | None = None
-analytics_token: str | None = None
-analytics_user_id: str | None = None
 
+METRIC_EVENTS_SENT = Counter("bridge_analytics_events_sent", "Analytics events delivered")
+METRIC_EVENTS_DROPPED = Counter(
+    "bridge_analytics_events_dropped", "Analytics events that were not delivered", ["reason"]
+)
+METRIC_QUEUE_SIZE = Gauge("bridge_analytics_queue_size", "Analytics events waiting to be sent")
 
-async def _track(user: u.User, event: str, properties: dict) -> None:
-    assert analytics_token
-    assert analytics_url
-    assert http
-    await http.post(
-        analytics_url,
-        json={
-            "userId": analytics_user_id or user.mxid,
-            "event": event,
-            "properties": {"bridge": "linkedin", **properties},
-        },
-        auth=aiohttp.BasicAuth(login=analytics_token, encoding="utf-8"),
-    )
-    log.debug(f"Tracked {event}")
+
+class AnalyticsQueue:
+    """
+    Buffers analytics events and sends them to a Segment-compatible ``/v1/batch`` endpoint.
+
+    A batch is sent once ``batch_size`` events are queued, or ``flush_interval`` seconds after
+    the first queued event. Only one batch is sent at a time. Failed batches are retried with
+    exponential backoff, and dropped after ``max_attempts`` attempts or if the server rejects
+    them. Events tracked while ``max_queue`` events are already waiting are dropped too.
+    """
+
+    url: URL | None
+    token: str | None
+    _auth_header: str
+    batch_size: int
+    flush_interval: float
+    max_queue: int
+    max_attempts: int
+    _queue: list[dict[str, Any]]
+    _flush_lock: asyncio.Lock
+    _flush_task: asyncio.Task | None
+    _timer: asyncio.Task | None
+    _http: aiohttp.ClientSession | None
+    _stopping: bool
+
+    def __init__(self):
+        self.url = None
+        self.token = None
+        self.batch_size = 100
+        self.flush_interval = 10
+        self.max_queue = 10000
+        self.max_attempts = 5
+        self._queue = []
+        self._flush_lock = asyncio.Lock()
+        self._flush_task = None
+        self._timer = None
+        self._http = None
+        self._stopping = False
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.url and self.token)
+
+    def configure(
+        self,
+        url: URL,
+        token: str,
+        batch_size: int = 100,
+        flush_interval: float = 10,
+        max_queue: int = 10000,
+        max_attempts: int = 5,
+    ):
+        self.url = url
+        self.token = token
+        self._auth_header = "Basic " + base64.b64encode(f"{token}:".encode()).decode()
+        self.batch_size = min(max(batch_size, 1), max(max_queue, 1))
+        self.flush_interval = max(flush_interval, 0)
+        self.max_queue = max(max_queue, 1)
+        self.max_attempts = max(max_attempts, 1)
+        self._stopping = False
+
+    def track(self, user_id: str, event: str, properties: dict[str, Any]):
+        if not self.enabled or self._stopping:
+            return
+        if len(self._queue) >= self.max_queue:
+            METRIC_EVENTS_DROPPED.labels(reason="overflow").inc()
+            return
+        self._queue.append(
+            {
+                "type": "track",
+                "messageId": str(uuid.uuid4()),
+                "timestamp": datetime.now(timezone.utc).isoformat(),
+                "userId": user_id,
+                "event": event,
+                "properties": properties,
+            }
+        )
+        METRIC_QUEUE_SIZE.set(len(self._queue))
+        if len(self._queue) >= self.batch_size:
+            # A running flush keeps going until the queue is empty, so one is enough.
+            if not self._flush_task or self._flush_task.done():
+                self._flush_task = task_registry.create("analytics", self.flush())
+        elif not self._timer:
+            self._timer = task_registry.create("analytics", self._flush_later())
+
+    async def _flush_later(self):
+        try:
+            await asyncio.sleep(self.flush_interval)
+        finally:
+            self._timer = None
+        await self.flush()
+
+    async def flush(self):
+        """Send batches until the queue is empty."""
+        async with self._flush_lock:
+            while self._queue:
+                batch, self._queue = self._queue[: self.batch_size], self._queue[self.batch_size :]
+                METRIC_QUEUE_SIZE.set(len(self._queue))
+                await self._send(batch)
+
+    async def _send(self, batch: list[dict[str, Any]]):
+        if not self._http:
+            self._http = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=30))
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                async with self._http.post(
+                    self.url,
+                    json={"batch": batch},
+                    headers={"Authorization": self._auth_header},
+                ) as resp:
+                    if resp.status < 300:
+                        METRIC_EVENTS_SENT.inc(len(batch))
+                        log.debug(f"Sent {len(batch)} analytics events")
+                        return
+                    error = f"HTTP {resp.status}: {await resp.text()}"
+                    if 400 <= resp.status < 500 and resp.status != 429:
+                        log.warning(f"Analytics server rejected {len(batch)} events: {error}")
+                        METRIC_EVENTS_DROPPED.labels(reason="rejected").inc(len(batch))
+                        return
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = str(e) or type(e).__name__
+            if attempt == self.max_attempts or self._stopping:
+                break
+            delay = 2 ** (attempt - 1)
+            log.debug(f"Failed to send analytics events ({error}), retrying in {delay} seconds")
+            await asyncio.sleep(delay)
+        log.warning(f"Dropping {len(batch)} analytics events after {attempt} attempts: {error}")
+        METRIC_EVENTS_DROPPED.labels(reason="failed").inc(len(batch))
+
+    async def stop(self):
+        """Send the queued events without retrying, and close the HTTP session."""
+        self._stopping = True
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        if self.enabled:
+            await self.flush()
+        if self._http:
+            await self._http.close()
+            self._http = None
+
+
+queue = AnalyticsQueue()
+analytics_user_id: str | None = None
 
 
 def track(user: u.User, event: str, properties: dict | None = None):
-    if analytics_token:
-        background_task.create(_track(user, event, properties or {}))
+    queue.track(
+        analytics_user_id or user.mxid, event, {"bridge": "linkedin", **(properties or {})}
+    )
 
 
-def init(base_url: str | None, token: str | None, user_id: str | None = None):
+def init(
+    base_url: str | None,
+    token: str | None,
+    user_id: str | None = None,
+    batch_size: int = 100,
+    flush_interval: float = 10,
+    max_queue: int = 10000,
+    max_attempts: int = 5,
+):
     if not base_url or not token:
         return
     log.info("Initialising segment-compatible analytics")
-    global analytics_url, analytics_token, analytics_user_id, http
-    analytics_url = URL.build(scheme="https", host=base_url, path="/v1/track")
-    analytics_token = token
+    global analytics_user_id
     analytics_user_id = user_id
-    http = aiohttp.ClientSession()
+    queue.configure(
+        URL.build(scheme="https", host=base_url, path="/v1/batch"),
+        token,
+        batch_size=batch_size,
+        flush_interval=flush_interval,
+        max_queue=max_queue,
+        max_attempts=max_attempts,
+    )
+
+
+async def stop():
+    await queue.stop()
@@ -0,0 +1,4 @@
+"""
+Benchmarks for the bridge. These aren't run as part of the test suite; run them as modules, for
+example ``python -m linkedin_matrix.bench.db_indexes``.
+"""
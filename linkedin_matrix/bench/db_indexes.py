@@ -0,0 +1,275 @@
+"""
+Measures the latency of the hot message and reaction queries with and without the indexes added
+in the v11 migration.
+
+Usage::
+
+    python -m linkedin_matrix.bench.db_indexes [--database URL] [--rows N] [--queries N]
+
+The database is filled with synthetic rows, so don't point this at a bridge database.
+"""
+
+from __future__ import annotations
+
+from typing import Awaitable, Callable
+from base64 import b64encode
+from datetime import datetime
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from linkedin_messaging import URN
+from mautrix.util.async_db import Database, Scheme
+
+from ..db import Message, Reaction, init as init_db, upgrade_table
+
+INDEXES = {
+    "message_thread_timestamp_idx": (
+        'message (li_thread_urn, li_receiver_urn, timestamp, "index")',
+        None,
+    ),
+    "reaction_message_room_idx": ('reaction (li_message_urn, mx_room, "index")', None),
+    "reaction_message_sender_idx": (
+        "reaction (li_message_urn, li_receiver_urn, li_sender_urn, reaction)",
+        Scheme.SQLITE,
+    ),
+}
+
+MESSAGES_PER_THREAD = 100
+RECEIVERS = 50
+SENDERS = 7
+EMOJIS = ["👍", "❤️", "😂", "😮", "🎉"]
+BATCH_SIZE = 10000
+
+
+# The synthetic URNs have about the same length as real ones, since that matters for row and
+# index sizes.
+def thread_urn(thread: int) -> URN:
+    return URN(f"urn:li:fs_conversation:2-{b64encode(f'{thread:042d}'.encode()).decode()}")
+
+
+def profile_id(n: int) -> str:
+    return f"ACoAA{n:034d}"
+
+
+def receiver_urn(thread: int) -> URN:
+    return URN(f"urn:li:fs_miniProfile:{profile_id(thread % RECEIVERS)}")
+
+
+def message_urn(message: int) -> URN:
+    event_id = b64encode(f"{message:064d}".encode()).decode()
+    return URN(
+        f"urn:li:fs_event:({thread_urn(message // MESSAGES_PER_THREAD).id_str()},2-{event_id})"
+    )
+
+
+def room_id(thread: int) -> str:
+    return f"!room{thread}:example.com"
+
+
+async def insert(db: Database, table: str, columns: list[str], records: list[tuple]):
+    async with db.acquire() as conn, conn.transaction():
+        if db.scheme == Scheme.POSTGRES:
+            await conn.copy_records_to_table(table, records=records, columns=columns)
+        else:
+            columns_str = ",".join(f'"{c}"' for c in columns)
+            values_str = ",".join(f"${i + 1}" for i in range(len(columns)))
+            await conn.executemany(
+                f"INSERT INTO {table} ({columns_str}) VALUES ({values_str})", records
+            )
+
+
+def sender_urn(message: int) -> URN:
+    return URN(f"urn:li:fs_miniProfile:{profile_id(RECEIVERS + message % SENDERS)}")
+
+
+async def load(db: Database, rows: int, urn_ids: bool = True):
+    """
+    Fill the database with ``rows`` synthetic messages and about a quarter as many reactions.
+    If ``urn_ids`` is ``False``, only the URN text is stored, as it was before the v12 migration.
+    """
+    threads = max(rows // MESSAGES_PER_THREAD, 1)
+    await insert(
+        db,
+        "portal",
+        ["li_thread_urn", "li_receiver_urn", "mxid"],
+        [(thread_urn(t).id_str(), receiver_urn(t).id_str(), room_id(t)) for t in range(threads)],
+    )
+
+    def message_id(m: int) -> int:
+        return m + 1
+
+    def sender_id(m: int) -> int:
+        return rows + 1 + m % SENDERS
+
+    def columns(field_list: list[str]) -> list[str]:
+        return field_list if urn_ids else [f for f in field_list if not f.endswith("_urn_id")]
+
+    if urn_ids:
+        for offset in range(0, rows, BATCH_SIZE):
+            records = [
+                (message_id(m), message_urn(m).id_str())
+                for m in range(offset, min(offset + BATCH_SIZE, rows))
+            ]
+            await insert(db, "urn", ["id", "urn"], records)
+        await insert(
+            db,
+            "urn",
+            ["id", "urn"],
+            [(sender_id(s), sender_urn(s).id_str()) for s in range(SENDERS)],
+        )
+
+    start = datetime.now().timestamp() - rows
+    for offset in range(0, rows, BATCH_SIZE):
+        records = []
+        for m in range(offset, min(offset + BATCH_SIZE, rows)):
+            t = m // MESSAGES_PER_THREAD
+            record: tuple = (
+                f"$msg{m}",
+                room_id(t),
+                message_urn(m).id_str(),
+                thread_urn(t).id_str(),
+                sender_urn(m).id_str(),
+                receiver_urn(t).id_str(),
+                0,
+                start + m,
+            )
+            records.append(record + (message_id(m), sender_id(m)) if urn_ids else record)
+        await insert(db, "message", columns(Message._field_list), records)
+
+    # Roughly one reaction per four messages
+    for offset in range(0, rows, BATCH_SIZE):
+        records = []
+        for m in range(offset, min(offset + BATCH_SIZE, rows), 4):
+            t = m // MESSAGES_PER_THREAD
+            record = (
+                f"$reaction{m}",
+                room_id(t),
+                message_urn(m).id_str(),
+                receiver_urn(t).id_str(),
+                sender_urn(m).id_str(),
+                EMOJIS[m % len(EMOJIS)],
+            )
+            records.append(record + (message_id(m), sender_id(m)) if urn_ids else record)
+        await insert(db, "reaction", columns(Reaction._field_list), records)
+
+
+async def drop_indexes(db: Database):
+    for name in INDEXES:
+        await db.execute(f"DROP INDEX IF EXISTS {name}")
+
+
+async def create_indexes(db: Database):
+    for name, (target, scheme) in INDEXES.items():
+        if scheme is None or scheme == db.scheme:
+            await db.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {target}")
+    if db.scheme == Scheme.POSTGRES:
+        await db.execute("ANALYZE message")
+        await db.execute("ANALYZE reaction")
+    else:
+        await db.execute("ANALYZE")
+
+
+def make_queries(rows: int) -> dict[str, Callable[[int], Awaitable]]:
+    threads = max(rows // MESSAGES_PER_THREAD, 1)
+
+    def reacted_message(i: int) -> int:
+        return (i * 7919 % rows) // 4 * 4
+
+    return {
+        "Message.get_most_recent": lambda i: Message.get_most_recent(
+            thread_urn(i % threads), receiver_urn(i % threads)
+        ),
+        "Message.get_all_by_li_message_urn": lambda i: Message.get_all_by_li_message_urn(
+            message_urn(i * 7919 % rows), receiver_urn(i * 7919 % rows // MESSAGES_PER_THREAD)
+        ),
+        "Reaction.get_most_recent_by_li_message_urn": lambda i: (
+            Reaction.get_most_recent_by_li_message_urn(
+                room_id(reacted_message(i) // MESSAGES_PER_THREAD),
+                message_urn(reacted_message(i)),
+            )
+        ),
+        "Reaction.get_by_li_message_urn_and_emoji": lambda i: (
+            Reaction.get_by_li_message_urn_and_emoji(
+                message_urn(reacted_message(i)),
+                receiver_urn(reacted_message(i) // MESSAGES_PER_THREAD),
+                sender_urn(reacted_message(i)),
+                EMOJIS[reacted_message(i) % len(EMOJIS)],
+            )
+        ),
+    }
+
+
+async def measure(
+    queries: dict[str, Callable[[int], Awaitable]], count: int
+) -> dict[str, list[float]]:
+    results = {}
+    for name, query in queries.items():
+        order = list(range(count))
+        random.shuffle(order)
+        timings = []
+        for i in order:
+            start = time.perf_counter()
+            await query(i)
+            timings.append(time.perf_counter() - start)
+        results[name] = timings
+    return results
+
+
+def summarize(timings: list[float]) -> str:
+    timings = sorted(timings)
+    p50 = timings[len(timings) // 2] * 1000
+    p95 = timings[int(len(timings) * 0.95)] * 1000
+    return f"p50 {p50:8.3f} ms  p95 {p95:8.3f} ms  mean {statistics.mean(timings) * 1000:8.3f} ms"
+
+
+async def run(url: str, rows: int, count: int):
+    db = Database.create(url, upgrade_table=upgrade_table)
+    init_db(db)
+    await db.start()
+    try:
+        print(f"Loading {rows} messages into {db.scheme.value}...")  # noqa: T201
+        start = time.perf_counter()
+        await load(db, rows)
+        print(f"Loaded in {time.perf_counter() - start:.1f}s")  # noqa: T201
+
+        queries = make_queries(rows)
+        await drop_indexes(db)
+        before = await measure(queries, count)
+        start = time.perf_counter()
+        await create_indexes(db)
+        print(f"Created indexes in {time.perf_counter() - start:.1f}s")  # noqa: T201
+        after = await measure(queries, count)
+
+        for name in queries:
+            print(name)  # noqa: T201
+            print(f"  before: {summarize(before[name])}")  # noqa: T201
+            print(f"  after:  {summarize(after[name])}")  # noqa: T201
+    finally:
+        await db.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--database",
+        help="Database URL to fill with synthetic rows (default: a temporary SQLite file)",
+    )
+    parser.add_argument("--rows", type=int, default=1_000_000, help="Number of messages")
+    parser.add_argument("--queries", type=int, default=1000, help="Queries per measurement")
+    args = parser.parse_args()
+
+    if args.database:
+        asyncio.run(run(args.database, args.rows, args.queries))
+        return
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "bench.db")
+        asyncio.run(run(f"sqlite:{path}", args.rows, args.queries))
+
+
+if __name__ == "__main__":
+    main()
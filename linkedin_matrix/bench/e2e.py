@@ -0,0 +1,538 @@
+"""
+End-to-end throughput benchmarks that run the real bridge against a stub LinkedIn server and a
+fake homeserver.
+
+Usage::
+
+    python -m linkedin_matrix.bench.e2e [--scenario NAME ...] [--users N] [--conversations N]
+        [--backfill N] [--rate N] [--duration SECONDS] [--database URL] [--output FILE]
+
+Scenarios:
+
+* ``initial-sync``: every user syncs their conversations, without backfill.
+* ``backfill``: initial sync with ``--backfill`` messages per conversation.
+* ``realtime``: after the initial sync, each user receives ``--rate`` messages per second for
+  ``--duration`` seconds.
+* ``media``: like ``realtime``, but every message has an image attachment.
+* ``reactions``: after a backfill, each user receives ``--rate`` reactions per second.
+
+Each scenario runs in a new process with a fresh database. The stub server and the homeserver
+run in another process, so the reported peak RSS and CPU time are the bridge's own. The results
+are printed as JSON: for every phase, the number of Matrix events, throughput, message latency
+percentiles (from the stub sending a message to the homeserver receiving it), database queries
+per event, CPU time and peak RSS.
+
+The database is filled with synthetic users, so don't point ``--database`` at a bridge
+database.
+"""
+
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Any, Awaitable, Callable
+from collections import Counter
+from multiprocessing.connection import Connection
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import re
+import resource
+import socket
+import sys
+import tempfile
+import time
+
+from aiohttp import web
+import aiohttp
+
+from linkedin_messaging import set_base_url
+from mautrix.util.async_db import Database
+from mautrix.util.async_db.connection import LOG_MESSAGE
+from mautrix.util.logging import SILLY
+
+from ..db import Cookie, User, init as init_db, upgrade_table
+from ..util import get_peak_rss
+from ..version import version
+from .voyager_stub import MESSAGE_EVENT_KEY, StubConversation, VoyagerStub
+
+if TYPE_CHECKING:
+    from ..__main__ import LinkedInBridge
+
+DOMAIN = "bench.local"
+BOT_USERNAME = "linkedinbot"
+TOKEN_RE = re.compile(r"^bench-(\d+)")
+SCENARIOS = {
+    "initial-sync": {"backfill": False, "rate": False},
+    "backfill": {"backfill": True, "rate": False},
+    "realtime": {"backfill": False, "rate": True},
+    "media": {"backfill": False, "rate": True, "media_fraction": 1.0},
+    "reactions": {"backfill": True, "rate": True, "reaction_fraction": 1.0},
+}
+# A phase is over when nothing has arrived at the homeserver for this long.
+IDLE_TIMEOUT = 5
+
+
+def percentile(values: list[float], p: float) -> float | None:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+class BenchStub(VoyagerStub):
+    """A :class:`VoyagerStub` that tags live messages so their latency can be measured."""
+
+    def __init__(self, **kwargs: Any):
+        self.sent_at: dict[int, float] = {}
+        self.reactions_sent = 0
+        self._tokens = itertools.count()
+        super().__init__(**kwargs)
+
+    def _text(self) -> str:
+        return f"bench-{next(self._tokens)} {super()._text()}"
+
+    def _publish(self, conversation: StubConversation, event: dict[str, Any]):
+        if match := TOKEN_RE.match(event["eventContent"][MESSAGE_EVENT_KEY]["body"]):
+            self.sent_at[int(match.group(1))] = time.monotonic()
+        super()._publish(conversation, event)
+
+    def _react(self, conversation: StubConversation, sender: str) -> dict[str, Any]:
+        self.reactions_sent += 1
+        return super()._react(conversation, sender)
+
+    def control(self, options: dict[str, Any]):
+        for key in ("event_rate", "media_fraction", "reaction_fraction"):
+            if key in options:
+                setattr(self, key, options[key])
+        if options.get("reset"):
+            self.reactions_sent = 0
+
+    def stats(self) -> dict[str, Any]:
+        return {"pending_messages": len(self.sent_at), "reactions_sent": self.reactions_sent}
+
+
+class FakeHomeserver:
+    """
+    Just enough of the client-server API for the bridge to create rooms, register ghosts and
+    send events. Everything is accepted, and requests that aren't handled specially get an
+    empty JSON object.
+    """
+
+    def __init__(self, stub: BenchStub):
+        self.stub = stub
+        self.events: Counter[str] = Counter()
+        self.unhandled: Counter[str] = Counter()
+        self.latencies: list[float] = []
+        self.last_event_at = time.monotonic()
+        self._ids = itertools.count()
+        self._runner: web.AppRunner | None = None
+        self.app = web.Application(client_max_size=1024**3)
+        self.app.router.add_get("/_bench/stats", self.get_stats)
+        self.app.router.add_post("/_bench/control", self.control)
+        self.app.router.add_route("*", "/{path:.*}", self.handle)
+
+    async def start(self) -> str:
+        self._runner = web.AppRunner(self.app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, "127.0.0.1", 0).start()
+        return f"http://127.0.0.1:{self._runner.addresses[0][1]}"
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+
+    def _record(self, event_type: str, content: dict[str, Any]):
+        self.last_event_at = time.monotonic()
+        if event_type == "m.room.message":
+            event_type = f"{event_type}:{content.get('msgtype')}"
+            if match := TOKEN_RE.match(content.get("body", "")):
+                sent_at = self.stub.sent_at.pop(int(match.group(1)), None)
+                if sent_at is not None:
+                    self.latencies.append(self.last_event_at - sent_at)
+        self.events[event_type] += 1
+
+    async def handle(self, request: web.Request) -> web.Response:
+        path = request.path
+        parts = path.split("/")
+        body: Any = {}
+        if request.can_read_body and request.content_type == "application/json":
+            body = await request.json()
+        else:
+            await request.read()
+
+        if path == "/_matrix/client/versions":
+            return web.json_response({"versions": [f"v1.{i}" for i in range(1, 12)]})
+        elif path.endswith("/account/whoami"):
+            user_id = request.query.get("user_id", f"@{BOT_USERNAME}:{DOMAIN}")
+            return web.json_response({"user_id": user_id})
+        elif path.endswith("/register"):
+            return web.json_response({"user_id": f"@{body.get('username')}:{DOMAIN}"})
+        elif path.endswith("/createRoom"):
+            self._record("createRoom", body)
+            return web.json_response({"room_id": f"!room{next(self._ids)}:{DOMAIN}"})
+        elif "/send/" in path or ("/state/" in path and request.method == "PUT"):
+            if "/send/" in path:
+                self._record(parts[parts.index("send") + 1], body)
+            return web.json_response({"event_id": f"${next(self._ids)}"})
+        elif path.endswith("/join") or "/join/" in path:
+            return web.json_response({"room_id": parts[-1] if "/join/" in path else parts[-2]})
+        elif path.endswith("/joined_members"):
+            return web.json_response({"joined": {}})
+        elif path.endswith("/members"):
+            return web.json_response({"chunk": []})
+        elif path.endswith("/state") and request.method == "GET":
+            return web.json_response([])
+        elif path.startswith("/_matrix/media/") and (
+            path.endswith("/upload") or path.endswith("/create")
+        ):
+            return web.json_response({"content_uri": f"mxc://{DOMAIN}/m{next(self._ids)}"})
+        elif path.endswith("/config") and path.startswith("/_matrix/media/"):
+            return web.json_response({"m.upload.size": 1024**3})
+        self.unhandled[f"{request.method} {re.sub(r'[!@$][^/]+', '*', path)}"] += 1
+        return web.json_response({})
+
+    async def get_stats(self, request: web.Request) -> web.Response:
+        return web.json_response(
+            {
+                "events": self.events,
+                "latencies": self.latencies,
+                "idle": time.monotonic() - self.last_event_at,
+                "unhandled": self.unhandled,
+                **self.stub.stats(),
+            }
+        )
+
+    async def control(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        if body.get("reset"):
+            self.events.clear()
+            self.latencies.clear()
+        self.stub.control(body)
+        return web.json_response({})
+
+
+def serve(conn: Connection, stub_class: type[BenchStub], stub_args: dict[str, Any]):
+    """Run the stub and the fake homeserver until the parent sends anything on ``conn``."""
+
+    async def run():
+        stub = stub_class(**stub_args)
+        homeserver = FakeHomeserver(stub)
+        conn.send((await stub.start(), await homeserver.start()))
+        await asyncio.get_running_loop().run_in_executor(None, conn.recv)
+        await homeserver.stop()
+        await stub.stop()
+
+    asyncio.run(run())
+
+
+class QueryCounter(logging.Handler):
+    """Counts database queries using the duration log lines of mautrix's connection wrapper."""
+
+    def __init__(self):
+        super().__init__(level=SILLY)
+        self.count = 0
+
+    def emit(self, record: logging.LogRecord):
+        if record.msg == LOG_MESSAGE:
+            self.count += 1
+
+    def install(self):
+        log = logging.getLogger("mau.db")
+        log.disabled = False
+        log.setLevel(SILLY)
+        log.propagate = False
+        log.addHandler(self)
+
+
+def bridge_config(
+    hs_url: str, database: str, initial_chat_sync: int, backfill: int, log_level: str
+) -> dict[str, Any]:
+    port = free_port()
+    return {
+        "homeserver": {"address": hs_url, "domain": DOMAIN, "http_retry_count": 0},
+        "appservice": {
+            "address": f"http://127.0.0.1:{port}",
+            "hostname": "127.0.0.1",
+            "port": port,
+            "database": database,
+            "database_opts": {"min_size": 1, "max_size": 10},
+            "provisioning": {"enabled": False},
+            "bot_username": BOT_USERNAME,
+            "bot_avatar": "",
+            "as_token": "bench-as-token",
+            "hs_token": "bench-hs-token",
+        },
+        "bridge": {
+            "space_support": {"enable": False},
+            "initial_chat_sync": initial_chat_sync,
+            "update_avatar_initial_sync": False,
+            "backfill": {"initial_limit": backfill, "missed_limit": 0},
+            "temporary_disconnect_notices": False,
+            "permissions": {DOMAIN: "user"},
+        },
+        "logging": {
+            "version": 1,
+            "disable_existing_loggers": False,
+            "formatters": {"plain": {"format": "%(asctime)s %(levelname)s %(name)s %(message)s"}},
+            "handlers": {"console": {"class": "logging.StreamHandler", "formatter": "plain"}},
+            "root": {"level": log_level, "handlers": ["console"]},
+        },
+    }
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class BenchEnvironment:
+    """
+    Runs the stub and the fake homeserver in another process and sets up a bridge in this one,
+    with a fresh database that has ``users`` logged in users.
+
+    :param seed: Called with the database models initialized before the bridge starts, to add
+                 more rows to the database.
+    """
+
+    bridge: LinkedInBridge
+    control: aiohttp.ClientSession
+
+    def __init__(
+        self,
+        stub_class: type[BenchStub],
+        stub_args: dict[str, Any],
+        users: int,
+        database: str | None = None,
+        initial_chat_sync: int = 0,
+        backfill: int = 0,
+        log_level: str = "WARNING",
+        seed: Callable[[], Awaitable[None]] | None = None,
+    ):
+        self.stub_class = stub_class
+        self.stub_args = stub_args
+        self.users = users
+        self.database = database
+        self.initial_chat_sync = initial_chat_sync
+        self.backfill = backfill
+        self.log_level = log_level
+        self.seed = seed
+        self.queries = QueryCounter()
+        self._started = False
+
+    async def __aenter__(self) -> BenchEnvironment:
+        from ..__main__ import LinkedInBridge
+
+        self._conn, child_conn = multiprocessing.Pipe()
+        self._servers = multiprocessing.get_context("spawn").Process(
+            target=serve, args=(child_conn, self.stub_class, self.stub_args)
+        )
+        self._servers.start()
+        stub_url, hs_url = self._conn.recv()
+        set_base_url(stub_url)
+        self.control = aiohttp.ClientSession(base_url=hs_url)
+
+        self._tmpdir = tempfile.TemporaryDirectory(prefix="linkedin-matrix-bench-")
+        database = self.database or f"sqlite:{os.path.join(self._tmpdir.name, 'bridge.db')}"
+        await self._seed_database(database)
+        config_path = os.path.join(self._tmpdir.name, "config.yaml")
+        with open(config_path, "w") as file:
+            config = bridge_config(
+                hs_url, database, self.initial_chat_sync, self.backfill, self.log_level
+            )
+            json.dump(config, file)
+
+        self.bridge = LinkedInBridge()
+        self.bridge.prepare_arg_parser()
+        self.bridge.args = self.bridge.parser.parse_args(
+            ["-c", config_path, "-r", os.path.join(self._tmpdir.name, "registration.yaml"), "-n"]
+        )
+        self.bridge.prepare_config()
+        self.bridge.prepare_log()
+        self.bridge.check_config()
+        self.bridge.loop = asyncio.get_running_loop()
+        self.queries.install()
+        return self
+
+    async def _seed_database(self, database: str):
+        db = Database.create(database, upgrade_table=upgrade_table)
+        init_db(db)
+        await db.start()
+        for n in range(self.users):
+            mxid = f"@bench{n}:{DOMAIN}"
+            await User(mxid, VoyagerStub.user_urn(n), None, None).insert()
+            await Cookie.bulk_upsert(mxid, VoyagerStub.cookies(n))
+        if self.seed:
+            await self.seed()
+        await db.stop()
+
+    async def start_bridge(self):
+        self._started = True
+        self.bridge.prepare()
+        await self.bridge.start()
+
+    async def send_control(self, **options: Any):
+        async with self.control.post("/_bench/control", json=options) as resp:
+            resp.raise_for_status()
+
+    async def get_stats(self) -> dict[str, Any]:
+        async with self.control.get("/_bench/stats") as resp:
+            return await resp.json()
+
+    async def wait_for_idle(self, live: bool = False) -> dict[str, Any]:
+        """
+        Wait until the homeserver stops receiving events. If ``live`` is set, stop as soon as
+        every live message sent by the stub has arrived.
+        """
+        while True:
+            await asyncio.sleep(0.5)
+            stats = await self.get_stats()
+            if stats["idle"] >= IDLE_TIMEOUT or (
+                live and stats["pending_messages"] == 0 and stats["events"] and stats["idle"] >= 1
+            ):
+                return stats
+
+    async def __aexit__(self, *_: Any):
+        try:
+            if self._started:
+                self.bridge.prepare_stop()
+                await self.bridge.stop()
+        finally:
+            await self.control.close()
+            self._conn.send("stop")
+            self._servers.join()
+            self._tmpdir.cleanup()
+
+
+class Phase:
+    """Measures the bridge process while a phase of a scenario runs."""
+
+    def __init__(self, queries: QueryCounter):
+        self.queries = queries
+        self.start = time.monotonic()
+        self.start_queries = queries.count
+        self.start_cpu = self._cpu()
+
+    @staticmethod
+    def _cpu() -> float:
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        return usage.ru_utime + usage.ru_stime
+
+    def result(self, stats: dict[str, Any], idle: float) -> dict[str, Any]:
+        duration = time.monotonic() - self.start - idle
+        events = sum(stats["events"].values())
+        queries = self.queries.count - self.start_queries
+        latencies = stats["latencies"]
+        return {
+            "duration_seconds": round(duration, 3),
+            "events": stats["events"],
+            "events_per_second": round(events / duration, 2) if duration > 0 else None,
+            "latency_ms": {
+                "count": len(latencies),
+                "p50": (p50 * 1000 if (p50 := percentile(latencies, 0.5)) is not None else None),
+                "p99": (p99 * 1000 if (p99 := percentile(latencies, 0.99)) is not None else None),
+            },
+            "db_queries": queries,
+            "db_queries_per_event": round(queries / events, 2) if events else None,
+            "cpu_seconds": round(self._cpu() - self.start_cpu, 3),
+            "peak_rss_bytes": get_peak_rss(),
+            "pending_messages": stats["pending_messages"],
+            "unhandled_homeserver_requests": stats["unhandled"],
+        }
+
+
+async def run_scenario(name: str, args: argparse.Namespace) -> dict[str, Any]:
+    scenario = SCENARIOS[name]
+    backfill = args.backfill if scenario["backfill"] else 0
+    stub_args = {
+        "users": args.users,
+        "conversations": args.conversations,
+        "messages": max(backfill, 1),
+        "event_rate": 0,
+        "media_fraction": scenario.get("media_fraction", 0.0),
+        "reaction_fraction": scenario.get("reaction_fraction", 0.0),
+    }
+    results = {}
+    async with BenchEnvironment(
+        BenchStub,
+        stub_args,
+        users=args.users,
+        database=args.database,
+        initial_chat_sync=args.conversations,
+        backfill=backfill,
+        log_level=args.log_level,
+    ) as env:
+        phase = Phase(env.queries)
+        await env.start_bridge()
+        stats = await env.wait_for_idle()
+        results["sync"] = phase.result(stats, stats["idle"])
+
+        if scenario["rate"]:
+            await env.send_control(reset=True)
+            phase = Phase(env.queries)
+            await env.send_control(event_rate=args.rate)
+            await asyncio.sleep(args.duration)
+            await env.send_control(event_rate=0)
+            stats = await env.wait_for_idle(live=True)
+            results["realtime"] = phase.result(stats, stats["idle"])
+    return results
+
+
+def run_in_process(name: str, args: argparse.Namespace, conn: Connection):
+    conn.send(asyncio.run(run_scenario(name, args)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--scenario",
+        nargs="+",
+        choices=list(SCENARIOS),
+        default=list(SCENARIOS),
+        help="Scenarios to run (default: all)",
+    )
+    parser.add_argument("--users", type=int, default=5, help="Number of LinkedIn users")
+    parser.add_argument("--conversations", type=int, default=20, help="Conversations per user")
+    parser.add_argument("--backfill", type=int, default=20, help="Messages to backfill per chat")
+    parser.add_argument("--rate", type=float, default=5, help="Live events per second per user")
+    parser.add_argument("--duration", type=float, default=20, help="Seconds of live traffic")
+    parser.add_argument(
+        "--database",
+        help="Database URL for the bridge (default: a temporary SQLite database)",
+    )
+    parser.add_argument("--output", help="File to write the JSON results to (default: stdout)")
+    parser.add_argument("--log-level", default="WARNING", help="Log level of the bridge")
+    args = parser.parse_args()
+
+    results: dict[str, Any] = {
+        "version": version,
+        "timestamp": int(time.time()),
+        "python": sys.version.split()[0],
+        "parameters": {
+            key: getattr(args, key)
+            for key in ("users", "conversations", "backfill", "rate", "duration")
+        },
+        "scenarios": {},
+    }
+    context = multiprocessing.get_context("spawn")
+    for name in args.scenario:
+        print(f"Running {name}...", file=sys.stderr)  # noqa: T201
+        parent_conn, child_conn = context.Pipe()
+        process = context.Process(target=run_in_process, args=(name, args, child_conn))
+        process.start()
+        process.join()
+        results["scenarios"][name] = parent_conn.recv() if parent_conn.poll() else None
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output + "\n")
+    else:
+        print(output)  # noqa: T201
+
+
+if __name__ == "__main__":
+    main()
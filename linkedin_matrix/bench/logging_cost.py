@@ -0,0 +1,138 @@
+"""
+Measures the CPU time that log statements on the hot paths cost per event, before and after they
+were made lazy and sampled.
+
+Usage::
+
+    python -m linkedin_matrix.bench.logging_cost [--events N] [--level LEVEL ...] [--output FILE]
+
+For every log level, each kind of event (a realtime message, a presence update and a typing
+notification) is run ``--events`` times through the old eagerly formatted log statements and
+through the current ones. Enabled messages are formatted and written to ``/dev/null``, so the
+cost of records that are actually logged is included. The results are printed as JSON, in
+microseconds of CPU time per event.
+"""
+
+from __future__ import annotations
+
+from typing import Any, Callable
+import argparse
+import json
+import logging
+import os
+import time
+
+from linkedin_messaging import URN
+from mautrix.types import EventID, PresenceEventContent, PresenceState, RoomID, UserID
+
+from ..util import LogSampler
+from .voyager_stub import DECORATED_EVENT_KEY, VoyagerStub, decorated_event
+
+EventLogger = Callable[[logging.Logger, LogSampler, dict[str, Any]], None]
+
+
+def _event_data() -> dict[str, Any]:
+    stub = VoyagerStub(users=1, conversations=1, messages=0)
+    data = decorated_event(stub.add_incoming_message(0))
+    payload = data[DECORATED_EVENT_KEY]["payload"]
+    thread_id, message_id = URN(payload["event"]["entityUrn"]).id_parts
+    return {
+        "data": data,
+        "payload": payload,
+        "message_urn": URN(message_id),
+        "event_ids": [EventID("$bench-event-id-0123456789abcdef")],
+        "user_id": UserID("@alice:example.com"),
+        "presence": PresenceEventContent(presence=PresenceState.ONLINE, last_active_ago=1000),
+        "room_id": RoomID("!bench-room-0123456789:example.com"),
+        "typing": [UserID("@alice:example.com"), UserID("@bob:example.com")],
+    }
+
+
+def realtime_before(log: logging.Logger, sampler: LogSampler, e: dict[str, Any]):
+    log.debug(f"Got data from event stream {e['data'].keys()}")
+    log.debug(f"Firing events for keys {e['payload'].keys()}")
+    log.debug(f"Handled LinkedIn message {e['message_urn']} -> {e['event_ids']}")
+
+
+def realtime_after(log: logging.Logger, sampler: LogSampler, e: dict[str, Any]):
+    log.debug("Got data from event stream %s", e["data"].keys())
+    log.debug("Firing events for keys %s", e["payload"].keys())
+    log.debug("Handled LinkedIn message %s -> %s", e["message_urn"], e["event_ids"])
+
+
+def presence_before(log: logging.Logger, sampler: LogSampler, e: dict[str, Any]):
+    log.info(f"user ({e['user_id']}) is present {e['presence']}")
+
+
+def presence_after(log: logging.Logger, sampler: LogSampler, e: dict[str, Any]):
+    sampler.log(log, logging.DEBUG, "presence", "%s is present: %s", e["user_id"], e["presence"])
+
+
+def typing_before(log: logging.Logger, sampler: LogSampler, e: dict[str, Any]):
+    log.info(f"room: {e['room_id']}: typing {e['typing']}")
+
+
+def typing_after(log: logging.Logger, sampler: LogSampler, e: dict[str, Any]):
+    sampler.log(log, logging.DEBUG, "typing", "Typing in %s: %s", e["room_id"], e["typing"])
+
+
+CASES: dict[str, tuple[EventLogger, EventLogger]] = {
+    "realtime_message": (realtime_before, realtime_after),
+    "presence": (presence_before, presence_after),
+    "typing": (typing_before, typing_after),
+}
+
+
+def measure(fn: EventLogger, log: logging.Logger, events: int, data: dict[str, Any]) -> float:
+    """Return the CPU time per event in microseconds."""
+    sampler = LogSampler()
+    start = time.process_time()
+    for _ in range(events):
+        fn(log, sampler, data)
+    return (time.process_time() - start) / events * 1_000_000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--events", type=int, default=200_000, help="Events per measurement")
+    parser.add_argument(
+        "--level",
+        nargs="+",
+        default=["WARNING", "INFO", "DEBUG"],
+        help="Log levels to measure with",
+    )
+    parser.add_argument("--output", help="File to write the JSON results to (default: stdout)")
+    args = parser.parse_args()
+
+    data = _event_data()
+    log = logging.getLogger("mau.bench.logging_cost")
+    log.propagate = False
+    with open(os.devnull, "w") as devnull:
+        handler = logging.StreamHandler(devnull)
+        handler.setFormatter(
+            logging.Formatter("[%(asctime)s] [%(levelname)s@%(name)s] %(message)s")
+        )
+        log.addHandler(handler)
+        results: dict[str, Any] = {}
+        for level in args.level:
+            log.setLevel(level)
+            results[level] = {}
+            for name, (before, after) in CASES.items():
+                before_us = measure(before, log, args.events, data)
+                after_us = measure(after, log, args.events, data)
+                results[level][name] = {
+                    "before_us": round(before_us, 3),
+                    "after_us": round(after_us, 3),
+                    "saved_us": round(before_us - after_us, 3),
+                }
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output + "\n")
+    else:
+        print(output)  # noqa: T201
+
+
+if __name__ == "__main__":
+    main()
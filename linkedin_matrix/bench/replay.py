@@ -0,0 +1,322 @@
+"""
+Replays a recorded LinkedIn event stream through the bridge's event handlers, for profiling
+deserialization and dispatch without a live session.
+
+Usage::
+
+    python -m linkedin_matrix.bench.replay [CAPTURE] [--speed X] [--synthetic N]
+        [--profile cprofile|pyinstrument] [--profile-output FILE] [--output FILE]
+
+``CAPTURE`` is either an event journal directory (see ``bridge.event_journal``) or a file with
+the raw ``data:`` lines of a ``/realtime/connect`` stream. Without a capture, ``--synthetic``
+messages are generated instead. ``--speed 1`` replays at the recorded speed (based on the
+message timestamps), ``--speed 10`` ten times faster, and the default of 0 as fast as the
+bridge can handle the events.
+
+The events are served by a stub LinkedIn server to a real ``LinkedInMessaging`` client, and
+handled by the real ``User``, ``Portal`` and ``Puppet`` code, which send the Matrix events to a
+fake homeserver. Portals for every chat in the capture are created in the database before the
+replay. The stub and the homeserver run in another process, so they don't show up in profiles.
+
+The results are printed as JSON: the same measurements as ``linkedin_matrix.bench.e2e``, plus
+the time spent in every event listener.
+"""
+
+from __future__ import annotations
+
+from typing import Any, Awaitable, Callable
+from collections import defaultdict
+from pathlib import Path
+import argparse
+import asyncio
+import cProfile
+import json
+import os
+import pstats
+import sys
+import tempfile
+import time
+
+from linkedin_messaging import URN, LinkedInMessaging
+from mautrix.util import background_task
+
+from ..db import Portal
+from .e2e import DOMAIN, TOKEN_RE, BenchEnvironment, BenchStub, Phase, percentile
+from .voyager_stub import (
+    CLIENT_CONNECTION_KEY,
+    DECORATED_EVENT_KEY,
+    MESSAGE_EVENT_KEY,
+    VoyagerStub,
+    decorated_event,
+    profile_id,
+)
+
+try:
+    import pyinstrument
+except ImportError:
+    pyinstrument = None
+
+
+def _event_time(data: dict[str, Any]) -> int | None:
+    payload = data.get(DECORATED_EVENT_KEY, {}).get("payload", {})
+    return (payload.get("event") or {}).get("createdAt")
+
+
+def load_capture(path: str | Path) -> list[tuple[int | None, dict[str, Any]]]:
+    """
+    Read a capture and return its events with their timestamps in milliseconds, or ``None``
+    for events that don't have one. Connection events are skipped, the stub sends its own.
+    """
+    path = Path(path)
+    if path.is_dir():
+        from ..util import read_journal
+
+        events = [json.loads(record.payload) for record in read_journal(path)]
+    else:
+        with path.open() as file:
+            events = [json.loads(line[5:]) for line in file if line.startswith("data:")]
+    return [(_event_time(data), data) for data in events if CLIENT_CONNECTION_KEY not in data]
+
+
+def write_synthetic_capture(path: str | Path, messages: int, conversations: int):
+    """
+    Write a capture of messages from contacts in a synthetic user's conversations. The messages
+    are tagged like the live messages in the end-to-end benchmark, so their latency is measured.
+    """
+    stub = BenchStub(users=1, conversations=conversations, messages=0)
+    start = int(time.time() * 1000)
+    with Path(path).open("w") as file:
+        for i in range(messages):
+            event = stub.add_incoming_message(0, created_at=start + i * 100)
+            file.write(f"data: {json.dumps(decorated_event(event))}\n\n")
+
+
+def capture_threads(capture: list[tuple[int | None, dict[str, Any]]]) -> set[URN]:
+    threads = set()
+    for _, data in capture:
+        payload = data.get(DECORATED_EVENT_KEY, {}).get("payload", {})
+        event_urn = (payload.get("event") or {}).get("entityUrn") or payload.get("eventUrn")
+        if event_urn:
+            threads.add(URN(f"urn:li:fs_conversation:{URN(event_urn).id_parts[0]}"))
+    return threads
+
+
+class ReplayStub(BenchStub):
+    """A stub server with a single user, whose realtime stream replays a capture on request."""
+
+    def __init__(self, capture: str, speed: float):
+        super().__init__(users=1, conversations=0, messages=0, event_rate=0)
+        self.capture = load_capture(capture)
+        self.speed = speed
+        self.replayed = 0
+        self.replay_done = False
+
+    def control(self, options: dict[str, Any]):
+        super().control(options)
+        if options.get("replay"):
+            background_task.create(self._replay())
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            **super().stats(),
+            "streams": len(self._streams.get(profile_id(0), ())),
+            "replayed": self.replayed,
+            "replay_done": self.replay_done,
+        }
+
+    async def _replay(self):
+        prev_time = None
+        for timestamp, data in self.capture:
+            if self.speed > 0 and timestamp is not None and prev_time is not None:
+                await asyncio.sleep(max(timestamp - prev_time, 0) / 1000 / self.speed)
+            if timestamp is not None:
+                prev_time = timestamp
+            payload = data.get(DECORATED_EVENT_KEY, {}).get("payload", {})
+            content = (payload.get("event") or {}).get("eventContent", {})
+            body = content.get(MESSAGE_EVENT_KEY, {}).get("body", "")
+            if match := TOKEN_RE.match(body):
+                self.sent_at[int(match.group(1))] = time.monotonic()
+            for queue in self._streams.get(profile_id(0), ()):
+                queue.put_nowait(data)
+            self.replayed += 1
+        self.replay_done = True
+
+
+class ListenerTimer:
+    """Measures how long each event listener of a :class:`LinkedInMessaging` client takes."""
+
+    def __init__(self):
+        self.timings: defaultdict[str, list[float]] = defaultdict(list)
+
+    def wrap(self, name: str, fn: Callable[..., Awaitable[Any]]) -> Callable[..., Awaitable[Any]]:
+        async def timed(*args: Any) -> Any:
+            start = time.perf_counter()
+            try:
+                return await fn(*args)
+            finally:
+                self.timings[name].append(time.perf_counter() - start)
+
+        return timed
+
+    def install(self, client: LinkedInMessaging):
+        for key, listeners in client.event_listeners.items():
+            client.event_listeners[key] = [
+                self.wrap(f"{key}: {getattr(fn, '__qualname__', repr(fn))}", fn)
+                for fn in listeners
+            ]
+        # Deserializing the payloads and calling the listeners for them
+        client._fire_decorated_event = self.wrap("dispatch", client._fire_decorated_event)
+
+    def summary(self) -> dict[str, dict[str, Any]]:
+        return {
+            name: {
+                "calls": len(timings),
+                "total_ms": round(sum(timings) * 1000, 3),
+                "p50_ms": round(percentile(timings, 0.5) * 1000, 3),
+                "p99_ms": round(percentile(timings, 0.99) * 1000, 3),
+            }
+            for name, timings in sorted(self.timings.items())
+        }
+
+
+class Profiler:
+    def __init__(self, kind: str | None, output: str | None):
+        self.kind = kind
+        self.output = output
+        if kind == "cprofile":
+            self._profiler = cProfile.Profile()
+        elif kind == "pyinstrument":
+            # Sample all tasks, not just the one that started the profiler.
+            self._profiler = pyinstrument.Profiler(async_mode="disabled")
+
+    def start(self):
+        if self.kind:
+            self._profiler.enable() if self.kind == "cprofile" else self._profiler.start()
+
+    def stop(self):
+        if self.kind == "cprofile":
+            self._profiler.disable()
+            if self.output:
+                self._profiler.dump_stats(self.output)
+            else:
+                pstats.Stats(self._profiler, stream=sys.stderr).sort_stats(
+                    "cumulative"
+                ).print_stats(40)
+        elif self.kind == "pyinstrument":
+            self._profiler.stop()
+            if self.output:
+                with open(self.output, "w") as file:
+                    if self.output.endswith(".html"):
+                        file.write(self._profiler.output_html())
+                    else:
+                        file.write(self._profiler.output_text(unicode=True))
+            else:
+                print(self._profiler.output_text(unicode=True), file=sys.stderr)  # noqa: T201
+
+
+async def wait_for_listener(env: BenchEnvironment) -> LinkedInMessaging:
+    from ..user import User
+
+    while True:
+        await asyncio.sleep(0.1)
+        user = User.by_mxid.get(f"@bench0:{DOMAIN}")
+        if user and user.client and user.listener_event_handlers_created:
+            if (await env.get_stats())["streams"]:
+                return user.client
+
+
+async def run(args: argparse.Namespace, capture_path: str) -> dict[str, Any]:
+    capture = load_capture(capture_path)
+    threads = capture_threads(capture)
+
+    async def seed():
+        for i, thread_urn in enumerate(threads):
+            await Portal(
+                li_thread_urn=thread_urn,
+                li_receiver_urn=VoyagerStub.user_urn(0),
+                li_is_group_chat=True,
+                li_other_user_urn=None,
+                mxid=f"!replay{i}:{DOMAIN}",
+                encrypted=False,
+                name=None,
+                photo_id=None,
+                avatar_url=None,
+                topic=None,
+                name_set=False,
+                avatar_set=False,
+                topic_set=False,
+            ).insert()
+
+    async with BenchEnvironment(
+        ReplayStub,
+        {"capture": capture_path, "speed": args.speed},
+        users=1,
+        database=args.database,
+        log_level=args.log_level,
+        seed=seed,
+    ) as env:
+        await env.start_bridge()
+        client = await wait_for_listener(env)
+        timer = ListenerTimer()
+        timer.install(client)
+        profiler = Profiler(args.profile, args.profile_output)
+
+        await env.send_control(reset=True)
+        phase = Phase(env.queries)
+        profiler.start()
+        await env.send_control(replay=True)
+        while not (stats := await env.wait_for_idle(live=True))["replay_done"]:
+            pass
+        profiler.stop()
+        return {
+            "events_replayed": stats["replayed"],
+            "chats": len(threads),
+            **phase.result(stats, stats["idle"]),
+            "listeners": timer.summary(),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("capture", nargs="?", help="Event journal directory or SSE capture file")
+    parser.add_argument(
+        "--synthetic", type=int, default=1000, help="Messages to generate without a capture"
+    )
+    parser.add_argument(
+        "--conversations", type=int, default=20, help="Conversations for synthetic messages"
+    )
+    parser.add_argument(
+        "--speed", type=float, default=0, help="Replay speed relative to the recording (0: max)"
+    )
+    parser.add_argument("--profile", choices=["cprofile", "pyinstrument"], help="Profiler to use")
+    parser.add_argument(
+        "--profile-output",
+        help="File for the profile (cProfile stats, or pyinstrument text/HTML by extension)",
+    )
+    parser.add_argument(
+        "--database",
+        help="Database URL for the bridge (default: a temporary SQLite database)",
+    )
+    parser.add_argument("--output", help="File to write the JSON results to (default: stdout)")
+    parser.add_argument("--log-level", default="WARNING", help="Log level of the bridge")
+    args = parser.parse_args()
+    if args.profile == "pyinstrument" and not pyinstrument:
+        parser.error("pyinstrument is not installed")
+
+    with tempfile.TemporaryDirectory(prefix="linkedin-matrix-replay-") as tmpdir:
+        capture_path = args.capture
+        if not capture_path:
+            capture_path = os.path.join(tmpdir, "capture.sse")
+            write_synthetic_capture(capture_path, args.synthetic, args.conversations)
+        results = asyncio.run(run(args, capture_path))
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output + "\n")
+    else:
+        print(output)  # noqa: T201
+
+
+if __name__ == "__main__":
+    main()
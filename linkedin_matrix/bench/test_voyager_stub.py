@@ -0,0 +1,95 @@
+from typing import Any
+import asyncio
+
+import pytest
+
+from linkedin_messaging import LinkedInMessaging, set_base_url
+from linkedin_messaging.api_objects import AttributedBody, MessageCreate, RealTimeEventStreamEvent
+from linkedin_messaging.exceptions import TooManyRequestsError
+
+from .voyager_stub import VoyagerStub
+
+
+def test_client_against_stub():
+    async def run():
+        stub = VoyagerStub(users=2, conversations=25, messages=30, event_rate=0)
+        set_base_url(await stub.start())
+        li = LinkedInMessaging.from_cookies_and_headers(stub.cookies(0), None)
+        try:
+            profile = await li.get_user_profile()
+            assert profile.mini_profile.entity_urn == stub.user_urn(0)
+
+            conversations = [c async for c in li.get_all_conversations()]
+            assert len(conversations) == 25
+
+            events = []
+            listening = asyncio.Event()
+
+            async def on_event(event: RealTimeEventStreamEvent) -> None:
+                events.append(event)
+
+            async def on_connect(data: dict[str, Any]) -> None:
+                listening.set()
+
+            li.add_event_listener("event", on_event)
+            li.add_event_listener("ALL_EVENTS", on_connect)
+            listener = asyncio.create_task(li.start_listener(profile.mini_profile.entity_urn))
+            await asyncio.wait_for(listening.wait(), timeout=5)
+
+            urn = conversations[0].entity_urn
+            history = await li.get_conversation(urn)
+            assert len(history.elements) == 20
+            body = AttributedBody(text="hello stub")
+            sent = await li.send_message(urn, MessageCreate(attributed_body=body))
+            assert await li.add_emoji_reaction(urn, sent.value.event_urn, "👍")
+            reactors = await li.get_reactors(sent.value.event_urn, "👍")
+            assert len(reactors.elements) == 1
+
+            for _ in range(50):
+                if events:
+                    break
+                await asyncio.sleep(0.05)
+            assert events[0].event.entity_urn == sent.value.event_urn
+            listener.cancel()
+
+            stub.rate_limit = 1
+            with pytest.raises(TooManyRequestsError):
+                await li.get_user_profile()
+        finally:
+            await li.close()
+            await stub.stop()
+            set_base_url()
+
+    asyncio.run(run())
+
+
+def test_request_metrics():
+    prometheus_client = pytest.importorskip("prometheus_client")
+
+    def sample(name: str, **labels: str) -> float:
+        return prometheus_client.REGISTRY.get_sample_value(name, labels) or 0
+
+    async def run():
+        stub = VoyagerStub(users=1, conversations=5, messages=0, event_rate=0)
+        set_base_url(await stub.start())
+        li = LinkedInMessaging.from_cookies_and_headers(stub.cookies(0), None)
+        before_ok = sample("linkedin_request_time_seconds_count", endpoint="profile", status="2xx")
+        before_429 = sample("linkedin_rate_limited_total", endpoint="conversations")
+        try:
+            await li.get_user_profile()
+            stub.rate_limit = 1
+            with pytest.raises(TooManyRequestsError):
+                await li.get_conversations()
+        finally:
+            await li.close()
+            await stub.stop()
+            set_base_url()
+
+        assert (
+            sample("linkedin_request_time_seconds_count", endpoint="profile", status="2xx")
+            == before_ok + 1
+        )
+        assert sample("linkedin_response_size_bytes_sum", endpoint="profile", status="2xx") > 0
+        assert sample("linkedin_rate_limited_total", endpoint="conversations") == before_429 + 1
+
+    asyncio.run(run())
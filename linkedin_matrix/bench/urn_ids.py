@@ -0,0 +1,193 @@
+"""
+Measures the v12 migration, which adds integer URN IDs to the message and reaction tables: how
+long the migration and the background backfill take, how long each backfill transaction holds
+its locks, the size of the tables and indexes before and after, and how many queries storing a
+message takes.
+
+Usage::
+
+    python -m linkedin_matrix.bench.urn_ids [--database URL] [--rows N] [--batch-size N]
+
+The database is filled with synthetic rows, so don't point this at a bridge database.
+"""
+
+from __future__ import annotations
+
+from typing import Any, Awaitable, Callable
+from datetime import datetime
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+from linkedin_messaging import URN
+from mautrix.types import EventID
+from mautrix.util.async_db import Database, Scheme, UpgradeTable
+
+from ..db import Message, UrnMap, init as init_db, upgrade_table, write_queue
+from .db_indexes import load, receiver_urn, room_id, sender_urn, thread_urn
+
+TABLES = ("message", "reaction", "urn")
+
+
+async def table_sizes(db: Database) -> dict[str, tuple[int, int]]:
+    """Return the size in bytes of each table and of all of its indexes."""
+    sizes = {}
+    if db.scheme == Scheme.POSTGRES:
+        for table in TABLES:
+            row = await db.fetchrow(
+                "SELECT pg_relation_size(c.oid) AS data, pg_indexes_size(c.oid) AS indexes "
+                "FROM pg_class c WHERE c.relname=$1 AND c.relkind='r'",
+                table,
+            )
+            if row:
+                sizes[table] = (row["data"], row["indexes"])
+        return sizes
+
+    rows = await db.fetch(
+        "SELECT m.tbl_name AS tbl, m.type AS type, SUM(s.pgsize) AS size"
+        "  FROM dbstat s JOIN sqlite_master m ON m.name = s.name"
+        " GROUP BY m.tbl_name, m.type"
+    )
+    for row in rows:
+        if row["tbl"] not in TABLES:
+            continue
+        data, indexes = sizes.get(row["tbl"], (0, 0))
+        if row["type"] == "table":
+            data += row["size"]
+        else:
+            indexes += row["size"]
+        sizes[row["tbl"]] = (data, indexes)
+    return sizes
+
+
+def print_sizes(label: str, sizes: dict[str, tuple[int, int]]):
+    print(label)  # noqa: T201
+    total = 0
+    for table, (data, indexes) in sorted(sizes.items()):
+        total += data + indexes
+        print(  # noqa: T201
+            f"  {table:10} data {data / 2**20:9.1f} MiB  indexes {indexes / 2**20:9.1f} MiB"
+        )
+    print(f"  {'total':10} {total / 2**20:9.1f} MiB")  # noqa: T201
+
+
+class QueryCounter:
+    """Counts the queries that are made through the execute and fetch methods of a database."""
+
+    methods = ("execute", "executemany", "fetch", "fetchrow", "fetchval")
+
+    def __init__(self, db: Database):
+        self.count = 0
+        for name in self.methods:
+            setattr(db, name, self._counted(getattr(db, name)))
+
+    def _counted(self, method: Callable[..., Awaitable[Any]]) -> Callable[..., Awaitable[Any]]:
+        async def wrapper(*args: Any, **kwargs: Any) -> Any:
+            self.count += 1
+            return await method(*args, **kwargs)
+
+        return wrapper
+
+
+async def backfill(batch_size: int) -> list[float]:
+    """Run the URN ID backfill to the end and return how long each transaction took."""
+    durations = []
+    for table in UrnMap.backfill_tables:
+        while table not in UrnMap.backfilled:
+            start = time.perf_counter()
+            if await UrnMap.backfill_batch(table, batch_size):
+                durations.append(time.perf_counter() - start)
+    return durations
+
+
+async def queries_per_message(db: Database, messages: int) -> float:
+    """Store new messages from a known sender one by one and count the queries per message."""
+    counter = QueryCounter(db)
+    write_queue.configure(False, 1, 0)
+    for i in range(messages):
+        await Message(
+            mxid=EventID(f"$new{i}"),
+            mx_room=room_id(0),
+            li_message_urn=URN(f"urn:li:fs_event:(new,{i})"),
+            li_thread_urn=thread_urn(0),
+            li_sender_urn=sender_urn(0),
+            li_receiver_urn=receiver_urn(0),
+            index=0,
+            timestamp=datetime.now(),
+        ).insert()
+    return counter.count / messages
+
+
+async def run(url: str, rows: int, batch_size: int):
+    # Stop at v11, the last version without URN IDs.
+    before_v12 = UpgradeTable()
+    before_v12.upgrades = upgrade_table.upgrades[:11]
+    db = Database.create(url, upgrade_table=before_v12)
+    init_db(db)
+    await db.start()
+    try:
+        print(f"Loading {rows} messages into {db.scheme.value}...")  # noqa: T201
+        await load(db, rows, urn_ids=False)
+        if db.scheme == Scheme.SQLITE:
+            await db.execute("VACUUM")
+        print_sizes("Before (text URNs):", await table_sizes(db))
+
+        start = time.perf_counter()
+        await upgrade_table.upgrade(db)
+        print(f"Migrated in {time.perf_counter() - start:.3f}s")  # noqa: T201
+
+        await UrnMap.load_backfill_state()
+        start = time.perf_counter()
+        durations = await backfill(batch_size)
+        print(  # noqa: T201
+            f"Backfilled in {time.perf_counter() - start:.1f}s with {len(durations)} "
+            f"transactions of {batch_size} message URNs: "
+            f"p50 {statistics.median(durations) * 1000:.1f} ms, "
+            f"max {max(durations) * 1000:.1f} ms"
+        )
+        if db.scheme == Scheme.SQLITE:
+            await db.execute("VACUUM")
+        else:
+            await db.execute("VACUUM ANALYZE")
+        print_sizes("After (text URNs and integer IDs):", await table_sizes(db))
+
+        most_recent = await Message.get_most_recent(thread_urn(0), receiver_urn(0))
+        assert most_recent, "backfilled rows can't be read back"
+        assert await Message.get_by_li_message_urn(
+            most_recent.li_message_urn, receiver_urn(0)
+        ), "backfilled rows can't be found by their URN ID"
+
+        UrnMap._ids.clear()
+        print(  # noqa: T201
+            f"Queries per stored message: {await queries_per_message(db, 1000):.2f} "
+            "(new message URN, cached sender)"
+        )
+    finally:
+        await db.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--database",
+        help="Database URL to fill with synthetic rows (default: a temporary SQLite file)",
+    )
+    parser.add_argument("--rows", type=int, default=1_000_000, help="Number of messages")
+    parser.add_argument(
+        "--batch-size", type=int, default=1000, help="Message URNs per backfill transaction"
+    )
+    args = parser.parse_args()
+
+    if args.database:
+        asyncio.run(run(args.database, args.rows, args.batch_size))
+        return
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "bench.db")
+        asyncio.run(run(f"sqlite:{path}", args.rows, args.batch_size))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,611 @@
+"""
+A local stand-in for the parts of the LinkedIn Voyager API that the bridge uses, for load and
+integration tests that shouldn't talk to real LinkedIn.
+
+Usage::
+
+    python -m linkedin_matrix.bench.voyager_stub [--port N] [--users N] [--conversations N]
+        [--event-rate N] [--media-fraction P] [--reaction-fraction P] [--latency SECONDS]
+        [--rate-limit P]
+
+Point the client at it with :func:`linkedin_messaging.linkedin.set_base_url` and log in with
+the cookies from :meth:`VoyagerStub.cookies`, which are ``li_at=stub-<n>`` for user ``n``.
+
+Every user has ``--conversations`` synthetic conversations with ``--messages`` messages each.
+While a user is connected to the realtime stream, new messages from their contacts arrive at
+``--event-rate`` events per second (Poisson distributed), and messages sent through the API are
+delivered to the stream of every connected participant, including the sender. A
+``--media-fraction`` of the incoming messages have an image attachment, and a
+``--reaction-fraction`` of the incoming events are reactions to earlier messages. API responses
+are delayed by an exponentially distributed latency with a mean of ``--latency`` seconds, and a
+``--rate-limit`` fraction of them fail with HTTP 429.
+"""
+
+from __future__ import annotations
+
+from typing import Any, Awaitable, Callable
+from base64 import b64encode
+from collections import Counter, defaultdict
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import struct
+import time
+import uuid
+
+from aiohttp import web
+
+from linkedin_messaging import URN
+
+from .db_indexes import profile_id, thread_urn
+
+PAGE_SIZE = 20
+KEEPALIVE_INTERVAL = 10
+MEDIA_SIZE = 256 * 1024
+MESSAGE_CREATE_KEY = "com.linkedin.voyager.messaging.create.MessageCreate"
+MEMBER_KEY = "com.linkedin.voyager.messaging.MessagingMember"
+MESSAGE_EVENT_KEY = "com.linkedin.voyager.messaging.event.MessageEvent"
+CLIENT_CONNECTION_KEY = "com.linkedin.realtimefrontend.ClientConnection"
+DECORATED_EVENT_KEY = "com.linkedin.realtimefrontend.DecoratedEvent"
+EMOJIS = ["👍", "❤️", "😂", "😮", "🎉"]
+WORDS = ["hello", "meeting", "tomorrow", "thanks", "project", "great", "call", "soon", "update"]
+
+
+def now_ms() -> int:
+    return int(time.time() * 1000)
+
+
+def event_id(n: int) -> str:
+    return f"2-{b64encode(f'{n:064d}'.encode()).decode()}"
+
+
+def mini_profile(member: str) -> dict[str, Any]:
+    return {
+        "entityUrn": f"urn:li:fs_miniProfile:{member}",
+        "objectUrn": f"urn:li:member:{member}",
+        "publicIdentifier": f"stub-{member[-8:]}",
+        "firstName": "Stub",
+        "lastName": member[-8:].lstrip("0") or "0",
+        "occupation": "Synthetic user",
+    }
+
+
+def messaging_member(conversation_id: str, member: str) -> dict[str, Any]:
+    return {
+        MEMBER_KEY: {
+            "entityUrn": f"urn:li:fs_messagingMember:({conversation_id},{member})",
+            "miniProfile": mini_profile(member),
+        }
+    }
+
+
+def decorated_event(event: dict[str, Any]) -> dict[str, Any]:
+    """Wrap a conversation event the way the realtime stream delivers new messages."""
+    return {
+        DECORATED_EVENT_KEY: {
+            "topic": "urn:li-realtime:messagesTopic:urn:li-realtime:myself",
+            "payload": {
+                "previousEventInConversation": event.get("previousEventInConversation"),
+                "event": event,
+            },
+        }
+    }
+
+
+class StubConversation:
+    def __init__(self, conversation_id: str, members: list[str]):
+        self.id = conversation_id
+        self.members = members
+        self.events: list[dict[str, Any]] = []
+
+    @property
+    def urn(self) -> str:
+        return f"urn:li:fs_conversation:{self.id}"
+
+    @property
+    def last_activity_at(self) -> int:
+        return self.events[-1]["createdAt"] if self.events else 0
+
+    def serialize(self, viewer: str) -> dict[str, Any]:
+        return {
+            "entityUrn": self.urn,
+            "groupChat": len(self.members) > 2,
+            "lastActivityAt": self.last_activity_at,
+            "read": True,
+            "unreadCount": 0,
+            "totalEventCount": len(self.events),
+            "name": "",
+            "muted": False,
+            "events": self.events[-1:],
+            "participants": [messaging_member(self.id, m) for m in self.members if m != viewer],
+        }
+
+
+class VoyagerStub:
+    """
+    An aiohttp application that serves synthetic Voyager API responses. The data is generated
+    from ``seed``, so two stubs with the same parameters serve the same initial conversations.
+    """
+
+    def __init__(
+        self,
+        users: int = 10,
+        conversations: int = 50,
+        messages: int = 20,
+        event_rate: float = 1.0,
+        media_fraction: float = 0.0,
+        reaction_fraction: float = 0.0,
+        latency: float = 0.0,
+        rate_limit: float = 0.0,
+        seed: int = 0,
+    ):
+        self.event_rate = event_rate
+        self.media_fraction = media_fraction
+        self.reaction_fraction = reaction_fraction
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.random = random.Random(seed)
+        self.requests: Counter[str] = Counter()
+        self.base_url = ""
+
+        self._event_ids = itertools.count()
+        self._uploads = itertools.count()
+        self._media = itertools.count()
+        self._users = [profile_id(n) for n in range(users)]
+        self._conversations: dict[str, StubConversation] = {}
+        self._by_user: dict[str, list[StubConversation]] = defaultdict(list)
+        self._reactions: dict[tuple[str, str], set[str]] = defaultdict(set)
+        self._streams: dict[str, set[asyncio.Queue]] = defaultdict(set)
+        self._runner: web.AppRunner | None = None
+
+        # The history is one message per second, ending now.
+        created_at = itertools.count(now_ms() - users * conversations * messages * 1000, 1000)
+        contacts = itertools.count(users)
+        for user in range(users):
+            for _ in range(conversations):
+                # Every fifth conversation is a group chat.
+                group = len(self._conversations) % 5 == 4
+                members = [self._users[user]] + [
+                    profile_id(next(contacts)) for _ in range(2 if group else 1)
+                ]
+                conversation = self._add_conversation(members)
+                for _ in range(messages):
+                    self._add_event(
+                        conversation,
+                        self.random.choice(members),
+                        self._text(),
+                        created_at=next(created_at),
+                    )
+
+        self.app = web.Application(middlewares=[self._middleware], client_max_size=1024**3)
+        self.app.add_routes(
+            [
+                web.get("/voyager/api/me", self.get_me),
+                web.get("/voyager/api/messaging/conversations", self.get_conversations),
+                web.post("/voyager/api/messaging/conversations", self.post_conversations),
+                web.post("/voyager/api/messaging/conversations/{id}", self.mark_read),
+                web.get("/voyager/api/messaging/conversations/{id}/events", self.get_events),
+                web.post("/voyager/api/messaging/conversations/{id}/events", self.send_message),
+                web.post(
+                    "/voyager/api/messaging/conversations/{conversation}/events/{id}",
+                    self.event_action,
+                ),
+                web.post("/voyager/api/voyagerMediaUploadMetadata", self.upload_metadata),
+                web.put("/stub-upload/{id}", self.upload),
+                web.get("/stub-media/{id}", self.download),
+                web.get("/voyager/api/voyagerMessagingDashReactors", self.get_reactors),
+                web.get("/realtime/connect", self.realtime),
+                web.post("/realtime/realtimeFrontendClientConnectivityTracking", self.heartbeat),
+            ]
+        )
+
+    # region Lifecycle
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """Start serving and return the base URL. Port 0 picks a free port."""
+        self._runner = web.AppRunner(self.app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = self._runner.addresses[0][1]
+        self.base_url = f"http://{host}:{port}"
+        return self.base_url
+
+    async def stop(self):
+        for queues in self._streams.values():
+            for queue in queues:
+                queue.put_nowait(None)
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+    @staticmethod
+    def cookies(user: int) -> dict[str, str]:
+        return {"li_at": f"stub-{user}", "JSESSIONID": f'"ajax:stub{user}"'}
+
+    @staticmethod
+    def user_urn(user: int) -> URN:
+        return URN(f"urn:li:fs_miniProfile:{profile_id(user)}")
+
+    # endregion
+
+    # region Synthetic data
+
+    def _text(self) -> str:
+        return " ".join(self.random.choices(WORDS, k=self.random.randint(1, 12)))
+
+    def add_incoming_message(self, user: int, created_at: int | None = None) -> dict[str, Any]:
+        """
+        Add a message from a contact to a random conversation of the given user and return the
+        new event, without delivering it to any realtime streams.
+        """
+        user_id = self._users[user]
+        conversation = self.random.choice(self._by_user[user_id])
+        sender = self.random.choice([m for m in conversation.members if m != user_id])
+        return self._add_event(conversation, sender, self._text(), created_at=created_at)
+
+    def _add_conversation(self, members: list[str]) -> StubConversation:
+        conversation = StubConversation(thread_urn(len(self._conversations)).get_id(), members)
+        self._conversations[conversation.id] = conversation
+        for member in members:
+            if member in self._users:
+                self._by_user[member].append(conversation)
+        return conversation
+
+    def _add_event(
+        self,
+        conversation: StubConversation,
+        sender: str,
+        text: str,
+        attachments: list[dict[str, Any]] | None = None,
+        created_at: int | None = None,
+    ) -> dict[str, Any]:
+        event = {
+            "entityUrn": f"urn:li:fs_event:({conversation.id},{event_id(next(self._event_ids))})",
+            "createdAt": created_at or now_ms(),
+            "subtype": "MEMBER_TO_MEMBER",
+            "from": messaging_member(conversation.id, sender),
+            "eventContent": {
+                MESSAGE_EVENT_KEY: {
+                    "body": text,
+                    "attributedBody": {"text": text, "attributes": []},
+                    "attachments": attachments or [],
+                },
+            },
+            "reactionSummaries": [],
+        }
+        if conversation.events:
+            event["previousEventInConversation"] = conversation.events[-1]["entityUrn"]
+        conversation.events.append(event)
+        return event
+
+    def _publish(self, conversation: StubConversation, event: dict[str, Any]):
+        payload = decorated_event(event)
+        for member in conversation.members:
+            for queue in self._streams.get(member, ()):
+                queue.put_nowait(payload)
+
+    # endregion
+
+    # region Request handling
+
+    @web.middleware
+    async def _middleware(
+        self,
+        request: web.Request,
+        handler: Callable[[web.Request], Awaitable[web.StreamResponse]],
+    ) -> web.StreamResponse:
+        route = request.match_info.route.resource
+        self.requests[route.canonical if route else request.path] += 1
+        if request.path.startswith("/stub-"):
+            return await handler(request)
+        if not self._user(request):
+            return web.json_response({"status": 401}, status=401)
+        if request.path.startswith("/voyager/api/"):
+            if self.latency > 0:
+                await asyncio.sleep(self.random.expovariate(1 / self.latency))
+            if self.random.random() < self.rate_limit:
+                self.requests["429"] += 1
+                return web.json_response({"status": 429}, status=429)
+        return await handler(request)
+
+    def _user(self, request: web.Request) -> str | None:
+        try:
+            return self._users[int(request.cookies.get("li_at", "")[5:])]
+        except (ValueError, IndexError):
+            return None
+
+    def _conversation(self, request: web.Request, key: str = "id") -> StubConversation:
+        conversation = self._conversations.get(URN(request.match_info[key]).id_parts[-1])
+        if not conversation or self._user(request) not in conversation.members:
+            raise web.HTTPNotFound(
+                text=json.dumps({"status": 404}), content_type="application/json"
+            )
+        return conversation
+
+    def _created_before(self, request: web.Request) -> int:
+        try:
+            return int(request.query.get("createdBefore", ""))
+        except ValueError:
+            return now_ms() + 1
+
+    async def get_me(self, request: web.Request) -> web.Response:
+        user = self._user(request)
+        return web.json_response({"plainId": user[-8:], "miniProfile": mini_profile(user)})
+
+    async def get_conversations(self, request: web.Request) -> web.Response:
+        user = self._user(request)
+        before = self._created_before(request)
+        conversations = sorted(
+            (c for c in self._by_user[user] if c.last_activity_at < before),
+            key=lambda c: c.last_activity_at,
+            reverse=True,
+        )[:PAGE_SIZE]
+        return web.json_response(
+            {
+                "elements": [c.serialize(user) for c in conversations],
+                "paging": {"count": PAGE_SIZE, "start": 0, "links": []},
+            }
+        )
+
+    async def post_conversations(self, request: web.Request) -> web.Response:
+        action = request.query.get("action")
+        body = await request.json()
+        if action == "typing":
+            return web.Response(status=201)
+        elif action != "create":
+            return web.json_response({"status": 400}, status=400)
+        create = body["conversationCreate"]
+        user = self._user(request)
+        recipients = [r for r in create.get("recipients", []) if r != user]
+        conversation = self._add_conversation([user, *recipients])
+        return self._message_created(
+            request, conversation, create["eventCreate"]["value"][MESSAGE_CREATE_KEY]
+        )
+
+    async def mark_read(self, request: web.Request) -> web.Response:
+        self._conversation(request)
+        return web.json_response({})
+
+    async def get_events(self, request: web.Request) -> web.Response:
+        conversation = self._conversation(request)
+        before = self._created_before(request)
+        events = [e for e in conversation.events if e["createdAt"] < before][-PAGE_SIZE:]
+        return web.json_response(
+            {"elements": events, "paging": {"count": PAGE_SIZE, "start": 0, "links": []}}
+        )
+
+    async def send_message(self, request: web.Request) -> web.Response:
+        conversation = self._conversation(request)
+        if request.query.get("action") != "create":
+            return web.json_response({"status": 400}, status=400)
+        body = await request.json()
+        return self._message_created(
+            request, conversation, body["eventCreate"]["value"][MESSAGE_CREATE_KEY]
+        )
+
+    def _message_created(
+        self, request: web.Request, conversation: StubConversation, create: dict[str, Any]
+    ) -> web.Response:
+        text = (create.get("attributedBody") or {}).get("text") or create.get("body", "")
+        attachments = create.get("attachments")
+        event = self._add_event(conversation, self._user(request), text, attachments)
+        self._publish(conversation, event)
+        return web.json_response(
+            {
+                "value": {
+                    "createdAt": event["createdAt"],
+                    "eventUrn": event["entityUrn"],
+                    "backendEventUrn": event["entityUrn"],
+                    "conversationUrn": conversation.urn,
+                    "backendConversationUrn": conversation.urn,
+                }
+            },
+            status=201,
+        )
+
+    async def event_action(self, request: web.Request) -> web.Response:
+        conversation = self._conversation(request, "conversation")
+        event_urn = f"urn:li:fs_event:({conversation.id},{request.match_info['id']})"
+        action = request.query.get("action")
+        if action == "recall":
+            conversation.events = [e for e in conversation.events if e["entityUrn"] != event_urn]
+        elif action in ("reactWithEmoji", "unreactWithEmoji"):
+            emoji = (await request.json())["emoji"]
+            reactors = self._reactions[(request.match_info["id"], emoji)]
+            if action == "reactWithEmoji":
+                reactors.add(self._user(request))
+            else:
+                reactors.discard(self._user(request))
+        else:
+            return web.json_response({"status": 400}, status=400)
+        return web.Response(status=204)
+
+    async def get_reactors(self, request: web.Request) -> web.Response:
+        message_id = URN(request.query.get("messageUrn", "")).id_parts[-1]
+        reactors = self._reactions.get((message_id, request.query.get("emoji", "")), ())
+        return web.json_response(
+            {
+                "elements": [
+                    {
+                        "reactorUrn": f"urn:li:fsd_profile:{member}",
+                        "reactor": {
+                            "firstName": "Stub",
+                            "lastName": member[-8:],
+                            "entityUrn": f"urn:li:fsd_profile:{member}",
+                        },
+                    }
+                    for member in reactors
+                ],
+                "paging": {"count": len(reactors), "start": 0, "links": []},
+            }
+        )
+
+    async def upload_metadata(self, request: web.Request) -> web.Response:
+        n = next(self._uploads)
+        return web.json_response(
+            {
+                "value": {
+                    "singleUploadUrl": f"{self.base_url}/stub-upload/{n}",
+                    "urn": f"urn:li:digitalmediaAsset:stub{n}",
+                }
+            }
+        )
+
+    async def upload(self, request: web.Request) -> web.Response:
+        async for _ in request.content.iter_chunked(64 * 1024):
+            pass
+        return web.Response(status=201)
+
+    async def heartbeat(self, request: web.Request) -> web.Response:
+        return web.json_response({})
+
+    async def realtime(self, request: web.Request) -> web.StreamResponse:
+        user = self._user(request)
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+
+        async def send(data: dict[str, Any]):
+            await response.write(b"data: " + json.dumps(data).encode("utf-8") + b"\n\n")
+
+        queue: asyncio.Queue[dict[str, Any] | None] = asyncio.Queue()
+        self._streams[user].add(queue)
+        generator = asyncio.create_task(self._generate_events(user))
+        try:
+            connection_id = uuid.UUID(int=self.random.getrandbits(128), version=4)
+            await send({CLIENT_CONNECTION_KEY: {"id": str(connection_id)}})
+            while True:
+                try:
+                    data = await asyncio.wait_for(queue.get(), timeout=KEEPALIVE_INTERVAL)
+                except asyncio.TimeoutError:
+                    await response.write(b":\n")
+                    continue
+                if data is None:
+                    break
+                await send(data)
+        except ConnectionResetError:
+            pass
+        finally:
+            generator.cancel()
+            self._streams[user].discard(queue)
+        return response
+
+    async def download(self, request: web.Request) -> web.Response:
+        # Only the header has to be valid, the bridge doesn't decode the image.
+        header = b"\x89PNG\r\n\x1a\n" + struct.pack(">I4sII", 13, b"IHDR", 640, 480)
+        return web.Response(
+            body=header + bytes(MEDIA_SIZE - len(header)), content_type="image/png"
+        )
+
+    def _attachment(self) -> dict[str, Any]:
+        n = next(self._media)
+        return {
+            "id": f"urn:li:digitalmediaAsset:stubmedia{n}",
+            "byteSize": MEDIA_SIZE,
+            "mediaType": "image/png",
+            "name": f"image{n}.png",
+            "reference": {"string": f"{self.base_url}/stub-media/{n}"},
+        }
+
+    def _react(self, conversation: StubConversation, sender: str) -> dict[str, Any]:
+        event = self.random.choice(conversation.events)
+        emoji = self.random.choice(EMOJIS)
+        reactors = self._reactions[(URN(event["entityUrn"]).id_parts[-1], emoji)]
+        reactors.add(sender)
+        return {
+            DECORATED_EVENT_KEY: {
+                "topic": "urn:li-realtime:messageReactionSummariesTopic:urn:li-realtime:myself",
+                "payload": {
+                    "reactionAdded": True,
+                    "actorMiniProfileUrn": f"urn:li:fs_miniProfile:{sender}",
+                    "eventUrn": event["entityUrn"],
+                    "reactionSummary": {
+                        "emoji": emoji,
+                        "count": len(reactors),
+                        "firstReactedAt": now_ms(),
+                        "viewerReacted": False,
+                    },
+                },
+            }
+        }
+
+    async def _generate_events(self, user: str):
+        if not self._by_user[user]:
+            return
+        while True:
+            # The rate can be changed while the stream is open, so check it every time.
+            if self.event_rate <= 0:
+                await asyncio.sleep(1)
+                continue
+            await asyncio.sleep(self.random.expovariate(self.event_rate))
+            conversation = self.random.choice(self._by_user[user])
+            sender = self.random.choice([m for m in conversation.members if m != user])
+            if conversation.events and self.random.random() < self.reaction_fraction:
+                for queue in self._streams.get(user, ()):
+                    queue.put_nowait(self._react(conversation, sender))
+                continue
+            attachments = (
+                [self._attachment()] if self.random.random() < self.media_fraction else None
+            )
+            event = self._add_event(conversation, sender, self._text(), attachments)
+            self._publish(conversation, event)
+
+    # endregion
+
+
+async def run(args: argparse.Namespace):
+    stub = VoyagerStub(
+        users=args.users,
+        conversations=args.conversations,
+        messages=args.messages,
+        event_rate=args.event_rate,
+        media_fraction=args.media_fraction,
+        reaction_fraction=args.reaction_fraction,
+        latency=args.latency,
+        rate_limit=args.rate_limit,
+        seed=args.seed,
+    )
+    base_url = await stub.start(args.host, args.port)
+    print(f"Serving {args.users} users at {base_url}")  # noqa: T201
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await stub.stop()
+        for route, count in stub.requests.most_common():
+            print(f"{count:>10} {route}")  # noqa: T201
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on")
+    parser.add_argument("--port", type=int, default=8080, help="Port to listen on")
+    parser.add_argument("--users", type=int, default=10, help="Number of users")
+    parser.add_argument("--conversations", type=int, default=50, help="Conversations per user")
+    parser.add_argument("--messages", type=int, default=20, help="Messages per conversation")
+    parser.add_argument(
+        "--event-rate", type=float, default=1.0, help="Incoming events per second per user"
+    )
+    parser.add_argument(
+        "--media-fraction", type=float, default=0.0, help="Fraction of messages with an image"
+    )
+    parser.add_argument(
+        "--reaction-fraction",
+        type=float,
+        default=0.0,
+        help="Fraction of events that are reactions",
+    )
+    parser.add_argument("--latency", type=float, default=0.0, help="Mean response latency")
+    parser.add_argument(
+        "--rate-limit", type=float, default=0.0, help="Fraction of requests that get HTTP 429"
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    try:
+        asyncio.run(run(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
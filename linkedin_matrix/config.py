@@ -39,6 +39,13 @@ class Config(BaseBridgeConfig):
         copy("bridge.backfill.invite_own_puppet")
         copy("bridge.backfill.missed_limit")
         copy("bridge.backfill.unread_hours_threshold")
+        copy_dict("bridge.background_tasks.limits")
+        copy("bridge.background_tasks.drain_timeout")
+        copy("bridge.cache_limits.portals")
+        copy("bridge.cache_limits.puppets")
+        copy("bridge.cache_limits.sweep_interval")
+        copy("bridge.coalescing.read_receipt_delay")
+        copy("bridge.coalescing.typing_window")
         copy("bridge.command_prefix")
         copy("bridge.delivery_receipts")
         copy("bridge.displayname_preference")
@@ -49,15 +56,45 @@ class Config(BaseBridgeConfig):
         copy("bridge.space_support.name")
         copy("bridge.federate_rooms")
         copy("bridge.initial_chat_sync")
+        copy("bridge.event_journal.directory")
+        copy("bridge.event_journal.enabled")
+        copy("bridge.event_journal.fsync")
+        copy("bridge.event_journal.segment_size")
         copy("bridge.invite_own_puppet_to_pm")
+        copy("bridge.loop_monitor.lag_sample_interval")
+        copy("bridge.loop_monitor.slow_callback_threshold")
+        copy("bridge.media_offload.executor")
+        copy("bridge.media_offload.inline_threshold")
+        copy("bridge.media_offload.max_workers")
         copy("bridge.mute_bridging")
+        copy("bridge.outbox.enabled")
+        copy("bridge.outbox.max_attempts")
+        copy("bridge.outbox.max_backoff")
+        copy("bridge.outbox.min_backoff")
+        copy("bridge.portal_lookup.lock_shards")
+        copy("bridge.portal_lookup.negative_ttl")
         copy("bridge.resend_bridge_info")
         copy("bridge.set_topic_on_dms")
+        copy("bridge.startup_cache_warm_up")
+        copy("bridge.startup_urn_cleanup")
         copy("bridge.sync_direct_chat_list")
+        copy("bridge.thumbnails.blurhash")
+        copy("bridge.thumbnails.cache_size")
+        copy("bridge.thumbnails.enabled")
+        copy("bridge.thumbnails.format")
+        copy("bridge.thumbnails.max_queue")
+        copy("bridge.thumbnails.max_size")
+        copy("bridge.thumbnails.quality")
+        copy("bridge.thumbnails.workers")
         copy("bridge.sync_with_custom_puppets")
         copy("bridge.tag_only_on_create")
         copy("bridge.temporary_disconnect_notices")
+        copy("bridge.urn_backfill.batch_size")
+        copy("bridge.urn_backfill.delay")
         copy("bridge.username_template")
+        copy("bridge.write_behind.enabled")
+        copy("bridge.write_behind.flush_interval_ms")
+        copy("bridge.write_behind.max_batch_size")
 
         if "bridge.login_shared_secret" in self:
             base["bridge.login_shared_secret_map"] = {
@@ -73,7 +110,11 @@ class Config(BaseBridgeConfig):
             base["bridge.private_chat_portal_meta"] = "default"
 
         # analytics
+        copy("analytics.batch_size")
+        copy("analytics.flush_interval")
         copy("analytics.host")
+        copy("analytics.max_attempts")
+        copy("analytics.max_queue")
         if "appservice.provisioning.segment_key" in self:
             base["analytics.token"] = self["appservice.provisioning.segment_key"]
         else:
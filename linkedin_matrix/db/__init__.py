@@ -3,17 +3,31 @@ from mautrix.util.async_db import Database
 from .cookie import Cookie
 from .http_header import HttpHeader
 from .message import Message
-from .model_base import Model
+from .model_base import Model, RecordModel
+from .outbox import OutboxMessage
 from .portal import Portal
 from .puppet import Puppet
 from .reaction import Reaction
 from .upgrade import upgrade_table
+from .urn import UrnMap
 from .user import User
 from .user_portal import UserPortal
+from .write_queue import WriteBehindQueue, write_queue
 
 
 def init(db: Database):
-    for table in (HttpHeader, Cookie, Message, Portal, Puppet, Reaction, User, UserPortal):
+    for table in (
+        HttpHeader,
+        Cookie,
+        Message,
+        OutboxMessage,
+        Portal,
+        Puppet,
+        Reaction,
+        UrnMap,
+        User,
+        UserPortal,
+    ):
         table.db = db  # type: ignore
 
 
@@ -25,9 +39,15 @@ __all__ = (
     "Cookie",
     "Message",
     "Model",
+    "OutboxMessage",
     "Portal",
     "Puppet",
     "Reaction",
+    "RecordModel",
+    "UrnMap",
     "User",
     "UserPortal",
+    # Write-behind queue
+    "WriteBehindQueue",
+    "write_queue",
 )
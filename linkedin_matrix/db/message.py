@@ -10,11 +10,13 @@ from linkedin_messaging import URN
 from mautrix.types import EventID, RoomID
 from mautrix.util.async_db import Scheme
 
-from .model_base import Model
+from .model_base import RecordModel
+from .urn import UrnMap
+from .write_queue import write_queue
 
 
 @dataclass
-class Message(Model):
+class Message(RecordModel):
     mxid: EventID
     mx_room: RoomID
     li_message_urn: URN
@@ -34,6 +36,8 @@ class Message(Model):
         "li_receiver_urn",
         "index",
         "timestamp",
+        "li_message_urn_id",
+        "li_sender_urn_id",
     ]
 
     @classmethod
@@ -41,6 +45,8 @@ class Message(Model):
         if row is None:
             return None
         data = {**row}
+        data.pop("li_message_urn_id")
+        data.pop("li_sender_urn_id")
         li_message_urn = data.pop("li_message_urn")
         li_thread_urn = data.pop("li_thread_urn")
         li_sender_urn = data.pop("li_sender_urn")
@@ -50,20 +56,58 @@ class Message(Model):
             **data,
             li_message_urn=URN(li_message_urn),
             li_thread_urn=URN(li_thread_urn),
-            li_sender_urn=URN(li_sender_urn),
+            li_sender_urn=URN(li_sender_urn) if li_sender_urn is not None else None,
             li_receiver_urn=URN(li_receiver_urn),
             timestamp=datetime.fromtimestamp(timestamp),
         )
 
+    @classmethod
+    async def to_records(cls, rows: list[RecordModel]) -> list[tuple]:
+        # Look up the IDs for all rows at once so that to_record only hits the cache.
+        await UrnMap.get_ids(
+            (
+                urn
+                for m in cast(list[Message], rows)
+                for urn in (m.li_message_urn, m.li_sender_urn)
+            ),
+            create=True,
+        )
+        return await super().to_records(rows)
+
+    async def to_record(self) -> tuple:
+        ids = await UrnMap.get_ids((self.li_message_urn, self.li_sender_urn), create=True)
+        return (
+            self.mxid,
+            self.mx_room,
+            self.li_message_urn.id_str(),
+            self.li_thread_urn.id_str(),
+            self.li_sender_urn.id_str(),
+            self.li_receiver_urn.id_str(),
+            self.index,
+            self.timestamp.timestamp(),
+            ids[self.li_message_urn],
+            ids[self.li_sender_urn],
+        )
+
     @classmethod
     async def get_all_by_li_message_urn(
         cls,
         li_message_urn: URN,
         li_receiver_urn: URN,
     ) -> list["Message"]:
-        query = Message.select_constructor("li_message_urn=$1 AND li_receiver_urn=$2")
+        query = Message.select_constructor(
+            f"{UrnMap.condition('message', 'li_message_urn', '$1')} AND li_receiver_urn=$2"
+        )
         rows = await cls.db.fetch(query, li_message_urn.id_str(), li_receiver_urn.id_str())
-        return [cast(Message, cls._from_row(row)) for row in rows if row]
+        messages = [cast(Message, cls._from_row(row)) for row in rows]
+        if queued := write_queue.find(
+            cls,
+            lambda m: m.li_message_urn == li_message_urn and m.li_receiver_urn == li_receiver_urn,
+        ):
+            stored = {m.index for m in messages}
+            messages += [m for m in queued if m.index not in stored]
+            messages.sort(key=lambda m: m.index)
+        return messages
 
     @classmethod
     async def get_by_li_message_urn(
@@ -72,25 +116,35 @@ class Message(Model):
         li_receiver_urn: URN,
         index: int = 0,
     ) -> Message | None:
+        if queued := write_queue.find(
+            cls,
+            lambda m: (
+                m.li_message_urn == li_message_urn
+                and m.li_receiver_urn == li_receiver_urn
+                and m.index == index
+            ),
+        ):
+            return queued[0]
         query = Message.select_constructor(
-            """
-            li_message_urn=$1 AND li_receiver_urn=$2 AND "index"=$3
+            f"""
+            {UrnMap.condition("message", "li_message_urn", "$1")}
+            AND li_receiver_urn=$2 AND "index"=$3
             """
         )
         row = await cls.db.fetchrow(
-            query,
-            li_message_urn.id_str(),
-            li_receiver_urn.id_str(),
-            index,
+            query, li_message_urn.id_str(), li_receiver_urn.id_str(), index
         )
         return cls._from_row(row)
 
     @classmethod
     async def delete_all_by_room(cls, room_id: RoomID):
+        await write_queue.discard(cls, lambda m: m.mx_room == room_id)
         await cls.db.execute("DELETE FROM message WHERE mx_room=$1", room_id)
 
     @classmethod
     async def get_by_mxid(cls, mxid: EventID, mx_room: RoomID) -> Message | None:
+        if queued := write_queue.find(cls, lambda m: m.mxid == mxid and m.mx_room == mx_room):
+            return queued[0]
         query = Message.select_constructor("mxid=$1 AND mx_room=$2")
         row = await cls.db.fetchrow(query, mxid, mx_room)
         return cls._from_row(row)
@@ -107,21 +161,24 @@ class Message(Model):
             + " LIMIT 1"
         )
         row = await cls.db.fetchrow(query, li_thread_urn.id_str(), li_receiver_urn.id_str())
-        return cls._from_row(row)
+        most_recent = cls._from_row(row)
+        for queued in write_queue.find(
+            cls,
+            lambda m: m.li_thread_urn == li_thread_urn and m.li_receiver_urn == li_receiver_urn,
+        ):
+            if not most_recent or (queued.timestamp, queued.index) >= (
+                most_recent.timestamp,
+                most_recent.index,
+            ):
+                most_recent = queued
+        return most_recent
 
     async def insert(self):
+        if write_queue.enabled:
+            await write_queue.add([self])
+            return
         query = Message.insert_constructor()
-        await self.db.execute(
-            query,
-            self.mxid,
-            self.mx_room,
-            self.li_message_urn.id_str(),
-            self.li_thread_urn.id_str(),
-            self.li_sender_urn.id_str(),
-            self.li_receiver_urn.id_str(),
-            self.index,
-            self.timestamp.timestamp(),
-        )
+        await self.db.execute(query, *await self.to_record())
 
     @classmethod
     async def bulk_create(
@@ -137,19 +194,24 @@ class Message(Model):
         if not event_ids:
             return
 
-        records = [
-            (
-                mxid,
-                mx_room,
-                li_message_urn.id_str(),
-                li_thread_urn.id_str(),
-                li_sender_urn.id_str(),
-                li_receiver_urn.id_str(),
-                index,
-                timestamp.timestamp(),
+        messages = [
+            cls(
+                mxid=mxid,
+                mx_room=mx_room,
+                li_message_urn=li_message_urn,
+                li_thread_urn=li_thread_urn,
+                li_sender_urn=li_sender_urn,
+                li_receiver_urn=li_receiver_urn,
+                index=index,
+                timestamp=timestamp,
             )
             for index, mxid in enumerate(event_ids)
         ]
+        if write_queue.enabled:
+            await write_queue.add(messages)
+            return
+
+        records = await cls.to_records(messages)
         async with cls.db.acquire() as conn, conn.transaction():
             if cls.db.scheme == Scheme.POSTGRES:
                 await conn.copy_records_to_table(
@@ -159,15 +221,20 @@ class Message(Model):
                 await conn.executemany(Message.insert_constructor(), records)
 
     async def delete(self):
-        q = """
+        await write_queue.discard(
+            Message,
+            lambda m: (
+                m.li_message_urn == self.li_message_urn
+                and m.li_receiver_urn == self.li_receiver_urn
+                and m.index == self.index
+            ),
+        )
+        q = f"""
             DELETE FROM message
-             WHERE li_message_urn=$1
+             WHERE {UrnMap.condition("message", "li_message_urn", "$1")}
                AND li_receiver_urn=$2
                AND "index"=$3
         """
         await self.db.execute(
-            q,
-            self.li_message_urn.id_str(),
-            self.li_receiver_urn.id_str(),
-            self.index,
+            q, self.li_message_urn.id_str(), self.li_receiver_urn.id_str(), self.index
         )
@@ -1,8 +1,11 @@
 from __future__ import annotations
 
-from typing import TYPE_CHECKING, ClassVar
+from typing import TYPE_CHECKING, Any, ClassVar
+from abc import ABC, abstractmethod
 
-from mautrix.util.async_db import Database
+from asyncpg import Record
+
+from mautrix.util.async_db import Database, Scheme
 
 fake_db = Database("") if TYPE_CHECKING else None
 
@@ -14,6 +17,9 @@ class Model:
     _table_name: str
     _field_list: list[str]
 
+    # SQLite limits the number of query parameters, so IN lists are split into chunks.
+    _in_chunk_size: ClassVar[int] = 500
+
     @classmethod
     def field_list_str(cls) -> str:
         return ",".join(map(lambda f: f'"{f}"', cls._field_list))
@@ -32,3 +38,31 @@ class Model:
             INSERT INTO "{cls._table_name}" ({cls.field_list_str()})
             VALUES ({values_str})
         """
+
+    @classmethod
+    async def fetch_where_in(cls, column: str, values: list[Any]) -> list[Record]:
+        """
+        Fetch all rows where ``column`` is one of ``values``, using ``= ANY($1)`` on Postgres and
+        ``IN (...)`` on SQLite.
+        """
+        select = cls.select_constructor()
+        if cls.db.scheme == Scheme.POSTGRES:
+            return await cls.db.fetch(f'{select} WHERE "{column}"=ANY($1)', values)
+        rows = []
+        for i in range(0, len(values), cls._in_chunk_size):
+            chunk = values[i : i + cls._in_chunk_size]
+            params = ",".join(f"${j + 1}" for j in range(len(chunk)))
+            rows += await cls.db.fetch(f'{select} WHERE "{column}" IN ({params})', *chunk)
+        return rows
+
+
+class RecordModel(Model, ABC):
+    """A model whose rows can be converted to records for bulk inserts."""
+
+    @abstractmethod
+    async def to_record(self) -> tuple:
+        """Return the values of the fields in ``_field_list`` as they are stored in the DB."""
+
+    @classmethod
+    async def to_records(cls, rows: list[RecordModel]) -> list[tuple]:
+        return [await row.to_record() for row in rows]
@@ -0,0 +1,84 @@
+from __future__ import annotations
+
+from typing import cast
+
+from asyncpg import Record
+from attr import dataclass
+
+from mautrix.types import EventID, RoomID, UserID
+
+from .model_base import Model
+
+
+@dataclass
+class OutboxMessage(Model):
+    """A Matrix message that has been accepted by the bridge but not yet sent to LinkedIn."""
+
+    mx_room: RoomID
+    event_id: EventID
+    sender: UserID
+    content: str
+    created: float
+    attempts: int = 0
+    id: int | None = None
+
+    _table_name = "outbox"
+    _field_list = [
+        "mx_room",
+        "event_id",
+        "sender",
+        "content",
+        "created",
+        "attempts",
+        "id",
+    ]
+
+    @classmethod
+    def _from_row(cls, row: Record | None) -> OutboxMessage | None:
+        if row is None:
+            return None
+        return cls(**row)
+
+    @classmethod
+    async def get_next(cls, mx_room: RoomID) -> OutboxMessage | None:
+        query = OutboxMessage.select_constructor("mx_room=$1 ORDER BY id LIMIT 1")
+        return cls._from_row(await cls.db.fetchrow(query, mx_room))
+
+    @classmethod
+    async def get_rooms_by_sender(cls, sender: UserID) -> list[RoomID]:
+        rows = await cls.db.fetch("SELECT DISTINCT mx_room FROM outbox WHERE sender=$1", sender)
+        return [cast(RoomID, row["mx_room"]) for row in rows]
+
+    async def insert(self) -> bool:
+        """
+        Add the message to the outbox. Returns ``False`` if the event is already in the outbox,
+        which happens if the homeserver redelivers a transaction.
+        """
+        query = """
+            INSERT INTO outbox (mx_room, event_id, sender, content, created, attempts)
+                 VALUES ($1, $2, $3, $4, $5, $6)
+            ON CONFLICT (event_id) DO NOTHING
+              RETURNING id
+        """
+        self.id = await self.db.fetchval(
+            query,
+            self.mx_room,
+            self.event_id,
+            self.sender,
+            self.content,
+            self.created,
+            self.attempts,
+        )
+        return self.id is not None
+
+    async def save_attempts(self):
+        await self.db.execute("UPDATE outbox SET attempts=$2 WHERE id=$1", self.id, self.attempts)
+
+    async def delete(self):
+        await self.db.execute("DELETE FROM outbox WHERE id=$1", self.id)
+
+    @classmethod
+    async def delete_by_event_id(cls, event_id: EventID, mx_room: RoomID) -> bool:
+        """Remove a message from the outbox. Returns whether it was in the outbox."""
+        query = "DELETE FROM outbox WHERE event_id=$1 AND mx_room=$2 RETURNING id"
+        return await cls.db.fetchval(query, event_id, mx_room) is not None
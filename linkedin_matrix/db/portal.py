@@ -90,6 +90,13 @@ class Portal(Model):
         rows = await cls.db.fetch(query, li_receiver_urn.id_str())
         return [cast(Portal, cls._from_row(row)) for row in rows if row]
 
+    @classmethod
+    async def get_all_by_li_receiver_urns(cls, li_receiver_urns: list[URN]) -> list["Portal"]:
+        rows = await cls.fetch_where_in(
+            "li_receiver_urn", [urn.id_str() for urn in li_receiver_urns]
+        )
+        return [cast(Portal, cls._from_row(row)) for row in rows if row]
+
     @classmethod
     async def all(cls) -> list["Portal"]:
         query = Portal.select_constructor()
@@ -9,11 +9,11 @@ from yarl import URL
 from linkedin_messaging import URN
 from mautrix.types import ContentURI, SyncToken, UserID
 
-from .model_base import Model
+from .model_base import RecordModel
 
 
 @dataclass
-class Puppet(Model):
+class Puppet(RecordModel):
     li_member_urn: URN
     name: str | None
     photo_id: str | None
@@ -64,6 +64,11 @@ class Puppet(Model):
         row = await cls.db.fetchrow(query, li_member_urn.id_str())
         return cls._from_row(row)
 
+    @classmethod
+    async def get_many_by_li_member_urn(cls, li_member_urns: list[URN]) -> list[Puppet]:
+        rows = await cls.fetch_where_in("li_member_urn", [urn.id_str() for urn in li_member_urns])
+        return [cast(Puppet, cls._from_row(row)) for row in rows]
+
     @classmethod
     async def get_by_name(cls, name: str) -> Puppet | None:
         query = Puppet.select_constructor("name=$1")
@@ -84,8 +89,18 @@ class Puppet(Model):
 
     async def insert(self):
         query = Puppet.insert_constructor()
-        await self.db.execute(
-            query,
+        await self.db.execute(query, *await self.to_record())
+
+    @classmethod
+    async def bulk_insert(cls, puppets: list[Puppet]):
+        """Insert all of the given puppets, skipping any that already exist."""
+        query = Puppet.insert_constructor() + " ON CONFLICT (li_member_urn) DO NOTHING"
+        records = await cls.to_records(cast(list[RecordModel], puppets))
+        async with cls.db.acquire() as conn, conn.transaction():
+            await conn.executemany(query, records)
+
+    async def to_record(self) -> tuple:
+        return (
             self.li_member_urn.id_str(),
             self.name,
             self.photo_id,
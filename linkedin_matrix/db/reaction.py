@@ -1,16 +1,20 @@
 from __future__ import annotations
 
+from typing import cast
+
 from asyncpg import Record
 from attr import dataclass
 
 from linkedin_messaging import URN
 from mautrix.types import EventID, RoomID
 
-from .model_base import Model
+from .model_base import RecordModel
+from .urn import UrnMap
+from .write_queue import write_queue
 
 
 @dataclass
-class Reaction(Model):
+class Reaction(RecordModel):
     mxid: EventID
     mx_room: RoomID
     li_message_urn: URN
@@ -26,6 +30,8 @@ class Reaction(Model):
         "li_receiver_urn",
         "li_sender_urn",
         "reaction",
+        "li_message_urn_id",
+        "li_sender_urn_id",
     ]
 
     @classmethod
@@ -33,18 +39,48 @@ class Reaction(Model):
         if row is None:
             return None
         data = {**row}
+        data.pop("li_message_urn_id")
+        data.pop("li_sender_urn_id")
         li_message_urn = data.pop("li_message_urn")
         li_receiver_urn = data.pop("li_receiver_urn")
         li_sender_urn = data.pop("li_sender_urn")
         return cls(
             **data,
-            li_message_urn=URN(li_message_urn),
+            li_message_urn=URN(li_message_urn) if li_message_urn is not None else None,
             li_receiver_urn=URN(li_receiver_urn),
-            li_sender_urn=URN(li_sender_urn),
+            li_sender_urn=URN(li_sender_urn) if li_sender_urn is not None else None,
+        )
+
+    @classmethod
+    async def to_records(cls, rows: list[RecordModel]) -> list[tuple]:
+        # Look up the IDs for all rows at once so that to_record only hits the cache.
+        await UrnMap.get_ids(
+            (
+                urn
+                for r in cast(list[Reaction], rows)
+                for urn in (r.li_message_urn, r.li_sender_urn)
+            ),
+            create=True,
+        )
+        return await super().to_records(rows)
+
+    async def to_record(self) -> tuple:
+        ids = await UrnMap.get_ids((self.li_message_urn, self.li_sender_urn), create=True)
+        return (
+            self.mxid,
+            self.mx_room,
+            self.li_message_urn.id_str(),
+            self.li_receiver_urn.id_str(),
+            self.li_sender_urn.id_str() if self.li_sender_urn else None,
+            self.reaction,
+            ids[self.li_message_urn],
+            ids.get(self.li_sender_urn),
         )
 
     @classmethod
     async def get_by_mxid(cls, mxid: EventID, mx_room: RoomID) -> Reaction | None:
+        if queued := write_queue.find(cls, lambda r: r.mxid == mxid and r.mx_room == mx_room):
+            return queued[0]
         query = Reaction.select_constructor("mxid=$1 AND mx_room=$2")
         row = await cls.db.fetchrow(query, mxid, mx_room)
         return cls._from_row(row)
@@ -53,8 +89,14 @@ class Reaction(Model):
     async def get_most_recent_by_li_message_urn(
         cls, mx_room: RoomID, li_message_urn: URN
     ) -> Reaction | None:
+        if queued := write_queue.find(
+            cls, lambda r: r.mx_room == mx_room and r.li_message_urn == li_message_urn
+        ):
+            return queued[-1]
         query = (
-            Reaction.select_constructor("mx_room=$1 AND li_message_urn=$2")
+            Reaction.select_constructor(
+                f"mx_room=$1 AND {UrnMap.condition('reaction', 'li_message_urn', '$2')}"
+            )
             + ' ORDER BY "index" DESC'
             + " LIMIT 1"
         )
@@ -69,11 +111,21 @@ class Reaction(Model):
         li_sender_urn: URN,
         reaction: str,
     ) -> Reaction | None:
+        if queued := write_queue.find(
+            cls,
+            lambda r: (
+                r.li_message_urn == li_message_urn
+                and r.li_receiver_urn == li_receiver_urn
+                and r.li_sender_urn == li_sender_urn
+                and r.reaction == reaction
+            ),
+        ):
+            return queued[0]
         query = Reaction.select_constructor(
-            """
-                li_message_urn=$1
+            f"""
+                {UrnMap.condition("reaction", "li_message_urn", "$1")}
             AND li_receiver_urn=$2
-            AND li_sender_urn=$3
+            AND {UrnMap.condition("reaction", "li_sender_urn", "$3")}
             AND reaction=$4
             """
         )
@@ -86,41 +138,106 @@ class Reaction(Model):
         )
         return cls._from_row(row)
 
-    async def insert(self):
-        query = Reaction.insert_constructor()
-        await self.db.execute(
-            query,
-            self.mxid,
-            self.mx_room,
-            self.li_message_urn.id_str(),
-            self.li_receiver_urn.id_str(),
-            self.li_sender_urn.id_str(),
-            self.reaction,
+    @classmethod
+    async def get_all_by_li_message_urn_and_emoji(
+        cls,
+        li_message_urn: URN,
+        li_receiver_urn: URN,
+        reaction: str,
+    ) -> list[Reaction]:
+        query = Reaction.select_constructor(
+            f"{UrnMap.condition('reaction', 'li_message_urn', '$1')}"
+            " AND li_receiver_urn=$2 AND reaction=$3"
         )
+        rows = await cls.db.fetch(
+            query, li_message_urn.id_str(), li_receiver_urn.id_str(), reaction
+        )
+        reactions = [cast(Reaction, cls._from_row(row)) for row in rows]
+        stored = {(r.li_sender_urn, r.mxid) for r in reactions}
+        for queued in write_queue.find(
+            cls,
+            lambda r: (
+                r.li_message_urn == li_message_urn
+                and r.li_receiver_urn == li_receiver_urn
+                and r.reaction == reaction
+            ),
+        ):
+            if (queued.li_sender_urn, queued.mxid) not in stored:
+                reactions.append(queued)
+        return reactions
 
-    async def delete(self):
-        query = """
-            DELETE FROM reaction
-             WHERE li_message_urn=$1
+    @classmethod
+    async def get_counts_by_li_message_urn(
+        cls,
+        li_message_urn: URN,
+        li_receiver_urn: URN,
+        viewer_urn: URN | None,
+    ) -> dict[str, tuple[int, bool]]:
+        """
+        Count the stored reactions to a message per emoji.
+
+        :returns: a map from emoji to the number of reactions with that emoji, and whether
+            ``viewer_urn`` is one of the senders.
+        """
+        viewer = UrnMap.condition("reaction", "li_sender_urn", "$3")
+        query = f"""
+            SELECT reaction,
+                   COUNT(*) AS count,
+                   SUM(CASE WHEN {viewer} THEN 1 ELSE 0 END) AS viewer_count
+              FROM reaction
+             WHERE {UrnMap.condition("reaction", "li_message_urn", "$1")}
                AND li_receiver_urn=$2
-               AND li_sender_urn=$3
+             GROUP BY reaction
         """
-        await self.db.execute(
+        rows = await cls.db.fetch(
             query,
-            self.li_message_urn.id_str(),
-            self.li_receiver_urn.id_str(),
-            self.li_sender_urn.id_str(),
+            li_message_urn.id_str(),
+            li_receiver_urn.id_str(),
+            viewer_urn.id_str() if viewer_urn else None,
+        )
+        counts = {row["reaction"]: (row["count"], row["viewer_count"] > 0) for row in rows}
+        for queued in write_queue.find(
+            cls,
+            lambda r: r.li_message_urn == li_message_urn and r.li_receiver_urn == li_receiver_urn,
+        ):
+            count, viewer_reacted = counts.get(queued.reaction, (0, False))
+            counts[queued.reaction] = (
+                count + 1,
+                viewer_reacted or queued.li_sender_urn == viewer_urn,
+            )
+        return counts
+
+    async def insert(self):
+        if write_queue.enabled:
+            await write_queue.add([self])
+            return
+        query = Reaction.insert_constructor()
+        await self.db.execute(query, *await self.to_record())
+
+    async def delete(self):
+        await write_queue.discard(
+            Reaction, lambda r: r.mxid == self.mxid and r.mx_room == self.mx_room
+        )
+        await self.db.execute(
+            "DELETE FROM reaction WHERE mxid=$1 AND mx_room=$2", self.mxid, self.mx_room
         )
 
     async def save(self):
-        query = """
+        if write_queue.is_pending(self):
+            # The queued row is this object, so it will be written with the new values.
+            return
+        await write_queue.discard(Reaction, lambda r: r is self)
+        if self.li_sender_urn is None:
+            # Reactions that lost their sender in the SQLite v5 migration can't be matched.
+            return
+        query = f"""
             UPDATE reaction
                SET mxid=$1,
                    mx_room=$2,
                    reaction=$3
-             WHERE li_message_urn=$1
-               AND li_receiver_urn=$2
-               AND li_sender_urn=$3
+             WHERE {UrnMap.condition("reaction", "li_message_urn", "$4")}
+               AND li_receiver_urn=$5
+               AND {UrnMap.condition("reaction", "li_sender_urn", "$6")}
         """
         await self.db.execute(
             query,
@@ -0,0 +1,143 @@
+from typing import Awaitable, Callable
+import asyncio
+
+from linkedin_messaging import URN
+from mautrix.types import EventID, RoomID
+from mautrix.util.async_db import Database, UpgradeTable
+
+from . import init, upgrade_table
+from .message import Message
+from .reaction import Reaction
+from .urn import UrnMap
+from .write_queue import write_queue
+
+ROOM = RoomID("!room:example.com")
+RECEIVER = URN("urn:li:fsd_profile:receiver")
+SENDER = URN("urn:li:fsd_profile:sender")
+
+
+def _message_urn(i: int) -> URN:
+    return URN(f"urn:li:msg_message:{i}")
+
+
+def _run_from_v11(test: Callable[[Database], Awaitable[None]]) -> None:
+    async def run() -> None:
+        # Start with three messages and a reaction that were stored before v12.
+        before_v12 = UpgradeTable()
+        before_v12.upgrades = upgrade_table.upgrades[:11]
+        db = Database.create("sqlite::memory:", upgrade_table=before_v12)
+        await db.start()
+        try:
+            await db.execute(
+                "INSERT INTO portal (li_thread_urn, li_receiver_urn, mxid) VALUES ($1, $2, $3)",
+                "thread",
+                RECEIVER.id_str(),
+                ROOM,
+            )
+            for i in range(3):
+                await db.execute(
+                    "INSERT INTO message (mxid, mx_room, li_message_urn, li_thread_urn,"
+                    ' li_sender_urn, li_receiver_urn, "index", timestamp)'
+                    " VALUES ($1, $2, $3, $4, $5, $6, 0, $7)",
+                    f"$msg{i}",
+                    ROOM,
+                    _message_urn(i).id_str(),
+                    "thread",
+                    SENDER.id_str(),
+                    RECEIVER.id_str(),
+                    1700000000 + i,
+                )
+            await db.execute(
+                "INSERT INTO reaction (mxid, mx_room, li_message_urn, li_receiver_urn,"
+                " li_sender_urn, reaction) VALUES ('$reaction', $1, $2, $3, $4, '👍')",
+                ROOM,
+                _message_urn(1).id_str(),
+                RECEIVER.id_str(),
+                SENDER.id_str(),
+            )
+            await upgrade_table.upgrade(db)
+            init(db)
+            UrnMap._ids.clear()
+            await UrnMap.load_backfill_state()
+            write_queue.configure(False, 100, 60_000)
+            await test(db)
+        finally:
+            await db.stop()
+            UrnMap.backfilled = set()
+
+    asyncio.run(run())
+
+
+def test_reads_switch_to_ids_after_backfill() -> None:
+    async def test(db: Database) -> None:
+        assert UrnMap.backfilled == set()
+        found = await Message.get_by_li_message_urn(_message_urn(1), RECEIVER)
+        assert found and found.mxid == "$msg1"
+
+        batches = []
+        while "message" not in UrnMap.backfilled:
+            batches.append(await UrnMap.backfill_batch("message", 2))
+        assert batches == [2, 1, 0]
+        while "reaction" not in UrnMap.backfilled:
+            await UrnMap.backfill_batch("reaction", 2)
+        assert (
+            await db.fetchval("SELECT COUNT(*) FROM message WHERE li_sender_urn_id IS NULL") == 0
+        )
+
+        # The backfill state is stored, so a restart doesn't start over.
+        UrnMap.backfilled = set()
+        await UrnMap.load_backfill_state()
+        assert UrnMap.backfilled == {"message", "reaction"}
+        assert "li_message_urn_id" in Message.select_constructor(
+            UrnMap.condition("message", "li_message_urn", "$1")
+        )
+
+        found = await Message.get_by_li_message_urn(_message_urn(1), RECEIVER)
+        assert found and found.mxid == "$msg1" and found.li_sender_urn == SENDER
+        reaction = await Reaction.get_by_li_message_urn_and_emoji(
+            _message_urn(1), RECEIVER, SENDER, "👍"
+        )
+        assert reaction and reaction.mxid == "$reaction"
+        assert await Reaction.get_counts_by_li_message_urn(_message_urn(1), RECEIVER, SENDER) == {
+            "👍": (1, True)
+        }
+
+        await found.delete()
+        assert await Message.get_by_li_message_urn(_message_urn(1), RECEIVER) is None
+
+    _run_from_v11(test)
+
+
+def test_rows_written_during_backfill_are_found_by_id() -> None:
+    async def test(db: Database) -> None:
+        assert await UrnMap.backfill_batch("message", 1) == 1
+        await Message(
+            mxid=EventID("$new"),
+            mx_room=ROOM,
+            li_message_urn=_message_urn(0),
+            li_thread_urn=URN("thread"),
+            li_sender_urn=SENDER,
+            li_receiver_urn=RECEIVER,
+            index=1,
+            timestamp=(await Message.get_by_mxid(EventID("$msg0"), ROOM)).timestamp,
+        ).insert()
+        while "message" not in UrnMap.backfilled:
+            await UrnMap.backfill_batch("message", 1)
+
+        found = await Message.get_all_by_li_message_urn(_message_urn(0), RECEIVER)
+        assert [m.mxid for m in found] == ["$msg0", "$new"]
+
+    _run_from_v11(test)
+
+
+def test_get_ids_creates_missing_urns_and_keeps_existing_ones() -> None:
+    async def test(db: Database) -> None:
+        first = await UrnMap.get_ids([SENDER, _message_urn(0)], create=True)
+        UrnMap._ids.clear()
+        assert await UrnMap.get_ids([SENDER, _message_urn(9)]) == {SENDER: first[SENDER]}
+        UrnMap._ids.clear()
+        second = await UrnMap.get_ids([SENDER, _message_urn(9)], create=True)
+        assert second[SENDER] == first[SENDER]
+        assert second[_message_urn(9)] not in first.values()
+
+    _run_from_v11(test)
@@ -0,0 +1,119 @@
+from typing import Awaitable, Callable
+from datetime import datetime
+import asyncio
+
+from linkedin_messaging import URN
+from mautrix.types import EventID, RoomID
+from mautrix.util.async_db import Database
+
+from . import init, upgrade_table
+from .message import Message
+from .urn import UrnMap
+from .write_queue import write_queue
+
+ROOM = RoomID("!room:example.com")
+
+
+def _message(mxid: str, message_id: str = "1", index: int = 0) -> Message:
+    return Message(
+        mxid=EventID(mxid),
+        mx_room=ROOM,
+        li_message_urn=URN(f"urn:li:msg_message:{message_id}"),
+        li_thread_urn=URN("urn:li:msg_conversation:thread"),
+        li_sender_urn=URN("urn:li:fsd_profile:sender"),
+        li_receiver_urn=URN("urn:li:fsd_profile:receiver"),
+        index=index,
+        timestamp=datetime.fromtimestamp(1700000000),
+    )
+
+
+async def _stored_mxids() -> list[str]:
+    rows = await Message.db.fetch("SELECT mxid FROM message ORDER BY mxid")
+    return [row["mxid"] for row in rows]
+
+
+def _run_with_db(test: Callable[[], Awaitable[None]], max_batch_size: int = 100) -> None:
+    async def run() -> None:
+        db = Database.create("sqlite::memory:", upgrade_table=upgrade_table)
+        await db.start()
+        init(db)
+        # The URN ID cache is global, so don't let IDs from other databases leak in.
+        UrnMap._ids.clear()
+        await UrnMap.load_backfill_state()
+        await db.execute(
+            "INSERT INTO portal (li_thread_urn, li_receiver_urn) VALUES ($1, $2)",
+            "thread",
+            "receiver",
+        )
+        write_queue.configure(True, max_batch_size, 60_000)
+        try:
+            await test()
+        finally:
+            await write_queue.stop()
+            await db.stop()
+
+    asyncio.run(run())
+
+
+def test_queued_rows_are_visible_before_flush() -> None:
+    async def test() -> None:
+        await _message("$a").insert()
+        assert await _stored_mxids() == []
+        found = await Message.get_by_li_message_urn(
+            URN("urn:li:msg_message:1"), URN("urn:li:fsd_profile:receiver")
+        )
+        assert found and found.mxid == "$a"
+        assert await Message.get_by_mxid(EventID("$a"), ROOM) is found
+
+        await write_queue.flush()
+        assert await _stored_mxids() == ["$a"]
+        stored = await Message.get_by_mxid(EventID("$a"), ROOM)
+        assert stored and stored is not found and stored.li_sender_urn == found.li_sender_urn
+
+    _run_with_db(test)
+
+
+def test_discarded_rows_are_not_written() -> None:
+    async def test() -> None:
+        await _message("$a", "1").insert()
+        await _message("$b", "2").insert()
+        await _message("$a", "1").delete()
+        assert await Message.get_by_mxid(EventID("$a"), ROOM) is None
+        await write_queue.flush()
+        assert await _stored_mxids() == ["$b"]
+
+    _run_with_db(test)
+
+
+def test_full_batch_is_flushed() -> None:
+    async def test() -> None:
+        await Message.bulk_create(
+            li_message_urn=URN("urn:li:msg_message:1"),
+            li_thread_urn=URN("urn:li:msg_conversation:thread"),
+            li_sender_urn=URN("urn:li:fsd_profile:sender"),
+            li_receiver_urn=URN("urn:li:fsd_profile:receiver"),
+            timestamp=datetime.fromtimestamp(1700000000),
+            event_ids=[EventID("$a"), EventID("$b")],
+            mx_room=ROOM,
+        )
+        assert await _stored_mxids() == []
+        await _message("$c", "2").insert()
+        assert await _stored_mxids() == ["$a", "$b", "$c"]
+        assert write_queue.find(Message, lambda m: True) == []
+
+    _run_with_db(test, max_batch_size=3)
+
+
+def test_failed_batch_falls_back_to_single_rows() -> None:
+    async def test() -> None:
+        write_queue.enabled = False
+        await _message("$dup", "1").insert()
+        write_queue.enabled = True
+        # The second row conflicts with the stored one, which fails the whole batch.
+        await _message("$a", "2").insert()
+        await _message("$dup", "3").insert()
+        await _message("$b", "4").insert()
+        await write_queue.flush()
+        assert await _stored_mxids() == ["$a", "$b", "$dup"]
+
+    _run_with_db(test)
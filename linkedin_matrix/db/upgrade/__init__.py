@@ -13,6 +13,9 @@ from . import (  # noqa: E402
     v08_splat_pickle_data,
     v09_cookie_table,
     v10_http_header_table,
+    v11_message_reaction_indexes,
+    v12_urn_ids,
+    v13_outbox,
 )
 
 __all__ = (
@@ -26,4 +29,7 @@ __all__ = (
     "v08_splat_pickle_data",
     "v09_cookie_table",
     "v10_http_header_table",
+    "v11_message_reaction_indexes",
+    "v12_urn_ids",
+    "v13_outbox",
 )
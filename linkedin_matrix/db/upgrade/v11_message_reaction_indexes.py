@@ -0,0 +1,41 @@
+from mautrix.util.async_db import Connection, Scheme
+
+from . import upgrade_table
+
+
+@upgrade_table.register(
+    description="Add indexes for message and reaction lookups",
+    transaction=False,
+)
+async def upgrade_v11(conn: Connection, scheme: Scheme):
+    if scheme == Scheme.SQLITE:
+        # v5 named the column "rowid" on SQLite, so ORDER BY "index" was ordering by a string
+        # literal. The column is still the INTEGER PRIMARY KEY, so this is just a rename.
+        await conn.execute('ALTER TABLE reaction RENAME COLUMN rowid TO "index"')
+        concurrently = ""
+    else:
+        concurrently = "CONCURRENTLY"
+
+    # Message.get_most_recent
+    await conn.execute(
+        f"""
+        CREATE INDEX {concurrently} IF NOT EXISTS message_thread_timestamp_idx
+            ON message (li_thread_urn, li_receiver_urn, timestamp, "index")
+        """
+    )
+    # Reaction.get_most_recent_by_li_message_urn
+    await conn.execute(
+        f"""
+        CREATE INDEX {concurrently} IF NOT EXISTS reaction_message_room_idx
+            ON reaction (li_message_urn, mx_room, "index")
+        """
+    )
+    if scheme == Scheme.SQLITE:
+        # Reaction.get_by_li_message_urn_and_emoji and Reaction.delete. On Postgres, the primary
+        # key from v2 covers these, but SQLite lost it when the table was rebuilt in v5.
+        await conn.execute(
+            """
+            CREATE INDEX IF NOT EXISTS reaction_message_sender_idx
+                ON reaction (li_message_urn, li_receiver_urn, li_sender_urn, reaction)
+            """
+        )
@@ -0,0 +1,45 @@
+from mautrix.util.async_db import Connection, Scheme
+
+from . import upgrade_table
+
+
+@upgrade_table.register(
+    description="Add integer URN ID columns to the message and reaction tables"
+)
+async def upgrade_v12(conn: Connection, scheme: Scheme):
+    # This only adds a table and nullable columns, so it doesn't rewrite or lock the message and
+    # reaction tables for longer than it takes to change their definitions. New rows get both
+    # the URN text and the IDs. The IDs of existing rows are filled in by UrnMap.backfill_batch
+    # in small transactions after the bridge has started, and reads switch to the IDs once a
+    # table is done (see the urn_backfill table).
+    #
+    # The text columns stay for now: they're part of the primary keys, and SQLite can only drop
+    # them by rebuilding the tables. Dropping them is left to a later migration.
+    if scheme == Scheme.POSTGRES:
+        id_column = "SERIAL PRIMARY KEY"
+    else:
+        id_column = "INTEGER PRIMARY KEY"
+
+    await conn.execute(
+        f"""
+        CREATE TABLE urn (
+            id  {id_column},
+            urn TEXT NOT NULL UNIQUE
+        )
+        """
+    )
+    for table in ("message", "reaction"):
+        # No foreign keys, since Postgres would check every existing row while holding a lock.
+        await conn.execute(f"ALTER TABLE {table} ADD COLUMN li_message_urn_id INTEGER")
+        await conn.execute(f"ALTER TABLE {table} ADD COLUMN li_sender_urn_id INTEGER")
+
+    await conn.execute(
+        """
+        CREATE TABLE urn_backfill (
+            table_name TEXT PRIMARY KEY,
+            last_key   TEXT,
+            done       BOOLEAN NOT NULL DEFAULT false
+        )
+        """
+    )
+    await conn.execute("INSERT INTO urn_backfill (table_name) VALUES ('message'), ('reaction')")
@@ -0,0 +1,25 @@
+from mautrix.util.async_db import Connection, Scheme
+
+from . import upgrade_table
+
+
+@upgrade_table.register(description="Add an outbox table for queued Matrix to LinkedIn messages")
+async def upgrade_v13(conn: Connection, scheme: Scheme):
+    if scheme == Scheme.POSTGRES:
+        id_column = "SERIAL PRIMARY KEY"
+    else:
+        id_column = "INTEGER PRIMARY KEY AUTOINCREMENT"
+    await conn.execute(
+        f"""
+        CREATE TABLE outbox (
+            id          {id_column},
+            mx_room     TEXT    NOT NULL,
+            event_id    TEXT    NOT NULL UNIQUE,
+            sender      TEXT    NOT NULL,
+            content     TEXT    NOT NULL,
+            attempts    INTEGER NOT NULL DEFAULT 0,
+            created     FLOAT   NOT NULL
+        )
+        """
+    )
+    await conn.execute("CREATE INDEX outbox_room_idx ON outbox (mx_room, id)")
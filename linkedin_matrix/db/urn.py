@@ -0,0 +1,209 @@
+from __future__ import annotations
+
+from typing import ClassVar, Iterable
+
+from linkedin_messaging import URN
+from mautrix.util.async_db import Scheme
+
+from .model_base import Model
+
+
+class UrnMap(Model):
+    """
+    Maps URNs to the compact integer IDs that the message and reaction tables store next to the
+    URN text. The IDs of recently used URNs are cached.
+
+    The IDs of rows written before the v12 migration are filled in by :meth:`backfill_batch`.
+    Until that has finished for a table, queries on it have to compare the URN text, so they
+    build their conditions with :meth:`condition`.
+    """
+
+    _table_name = "urn"
+    _field_list = ["id", "urn"]
+
+    cache_size: ClassVar[int] = 100_000
+    _ids: ClassVar[dict[str, int]] = {}
+
+    backfill_tables: ClassVar[tuple[str, ...]] = ("message", "reaction")
+    backfilled: ClassVar[set[str]] = set()
+    # The indexes that the ID lookups need. They're created when the backfill of their table is
+    # done, since creating them earlier would lock the table while it's filled.
+    _backfill_indexes: ClassVar[dict[str, dict[str, str]]] = {
+        "message": {
+            "message_urn_id_idx": '(li_message_urn_id, li_receiver_urn, "index")',
+        },
+        "reaction": {
+            "reaction_urn_id_room_idx": '(li_message_urn_id, mx_room, "index")',
+            "reaction_urn_id_sender_idx": (
+                "(li_message_urn_id, li_receiver_urn, li_sender_urn_id, reaction)"
+            ),
+        },
+    }
+
+    @staticmethod
+    def id_query(param: str) -> str:
+        """Return a subquery for the ID of the URN in the given query parameter, like ``$1``."""
+        return f"(SELECT id FROM urn WHERE urn={param})"
+
+    @classmethod
+    def condition(cls, table: str, column: str, param: str) -> str:
+        """
+        Return a condition that compares a URN column of ``table``, like ``li_message_urn``, with
+        the URN text in the given query parameter. It uses the ID column once the table has been
+        backfilled.
+        """
+        if table in cls.backfilled:
+            return f"{column}_id={cls.id_query(param)}"
+        return f"{column}={param}"
+
+    @classmethod
+    async def load_backfill_state(cls):
+        rows = await cls.db.fetch("SELECT table_name FROM urn_backfill WHERE done")
+        cls.backfilled = {row["table_name"] for row in rows}
+
+    @classmethod
+    async def backfill_batch(cls, table: str, batch_size: int) -> int:
+        """
+        Fill in the URN IDs of the rows of the next ``batch_size`` message URNs in ``table`` in
+        one transaction, and remember where to continue. Once there are no rows left, create the
+        indexes for the ID columns and switch the table's reads over to them.
+
+        :returns: the number of message URNs that were processed, 0 if the table is done.
+        """
+        async with cls.db.acquire() as conn, conn.transaction():
+            last_key = await conn.fetchval(
+                "SELECT last_key FROM urn_backfill WHERE table_name=$1", table
+            )
+            keys = await conn.fetch(
+                f"""
+                SELECT DISTINCT li_message_urn FROM {table}
+                 WHERE li_message_urn > $1
+                 ORDER BY li_message_urn
+                 LIMIT $2
+                """,
+                last_key or "",
+                batch_size,
+            )
+            if keys:
+                batch = (last_key or "", keys[-1]["li_message_urn"])
+                in_batch = "li_message_urn > $1 AND li_message_urn <= $2"
+                # The WHERE clause also keeps SQLite from parsing ON CONFLICT as part of a join.
+                await conn.execute(
+                    f"""
+                    INSERT INTO urn (urn)
+                    SELECT u FROM (
+                        SELECT li_message_urn AS u FROM {table} WHERE {in_batch}
+                         UNION
+                        SELECT li_sender_urn FROM {table} WHERE {in_batch}
+                    ) AS batch
+                     WHERE u IS NOT NULL
+                    ON CONFLICT (urn) DO NOTHING
+                    """,
+                    *batch,
+                )
+                # Rows written since the migration already have their IDs.
+                await conn.execute(
+                    f"""
+                    UPDATE {table}
+                       SET li_message_urn_id=(SELECT id FROM urn WHERE urn=li_message_urn),
+                           li_sender_urn_id=(SELECT id FROM urn WHERE urn=li_sender_urn)
+                     WHERE {in_batch} AND li_message_urn_id IS NULL
+                    """,
+                    *batch,
+                )
+                await conn.execute(
+                    "UPDATE urn_backfill SET last_key=$2 WHERE table_name=$1", table, batch[1]
+                )
+                return len(keys)
+
+        concurrently = "CONCURRENTLY" if cls.db.scheme == Scheme.POSTGRES else ""
+        for name, columns in cls._backfill_indexes[table].items():
+            # Postgres can't create indexes concurrently in a transaction, so this runs on its
+            # own connection.
+            await cls.db.execute(
+                f"CREATE INDEX {concurrently} IF NOT EXISTS {name} ON {table} {columns}"
+            )
+        await cls.db.execute("UPDATE urn_backfill SET done=true WHERE table_name=$1", table)
+        cls.backfilled.add(table)
+        return 0
+
+    @classmethod
+    async def delete_unused(cls) -> int:
+        """
+        Delete the URNs that no message or reaction refers to anymore, e.g. after their portal
+        was deleted. This must not run while rows are being written, since those may refer to
+        IDs that were looked up but not stored yet, so the bridge only does it at startup. URNs
+        of rows that haven't been backfilled yet are deleted too, the backfill adds them again.
+
+        :returns: the number of deleted URNs.
+        """
+        query = """
+            DELETE FROM urn WHERE id NOT IN (
+                SELECT li_message_urn_id FROM message WHERE li_message_urn_id IS NOT NULL
+                 UNION
+                SELECT li_sender_urn_id FROM message WHERE li_sender_urn_id IS NOT NULL
+                 UNION
+                SELECT li_message_urn_id FROM reaction WHERE li_message_urn_id IS NOT NULL
+                 UNION
+                SELECT li_sender_urn_id FROM reaction WHERE li_sender_urn_id IS NOT NULL
+            )
+        """
+        result = await cls.db.execute(query)
+        cls._ids.clear()
+        # asyncpg returns the command tag, e.g. "DELETE 5", and SQLite returns a cursor.
+        if isinstance(result, str):
+            return int(result.split()[-1])
+        return result.rowcount
+
+    @classmethod
+    def _remember(cls, urn_id: int, urn: str):
+        if len(cls._ids) >= cls.cache_size:
+            # Dicts are insertion ordered, so this drops the oldest entry.
+            del cls._ids[next(iter(cls._ids))]
+        cls._ids[urn] = urn_id
+
+    @classmethod
+    async def _fetch_by_urn(cls, urns: list[str]) -> dict[str, int]:
+        found = {}
+        for row in await cls.fetch_where_in("urn", urns):
+            cls._remember(row["id"], row["urn"])
+            found[row["urn"]] = row["id"]
+        return found
+
+    @classmethod
+    async def _upsert(cls, urns: list[str]) -> dict[str, int]:
+        found = {}
+        # Sorted, so that concurrent upserts lock the rows in the same order.
+        urns = sorted(urns)
+        for i in range(0, len(urns), cls._in_chunk_size):
+            chunk = urns[i : i + cls._in_chunk_size]
+            values = ",".join(f"(${j + 1})" for j in range(len(chunk)))
+            # DO NOTHING would leave the URNs that already exist out of the returned rows.
+            rows = await cls.db.fetch(
+                f"""
+                INSERT INTO urn (urn) VALUES {values}
+                ON CONFLICT (urn) DO UPDATE SET urn=excluded.urn
+                RETURNING id, urn
+                """,
+                *chunk,
+            )
+            for row in rows:
+                cls._remember(row["id"], row["urn"])
+                found[row["urn"]] = row["id"]
+        return found
+
+    @classmethod
+    async def get_ids(cls, urns: Iterable[URN | None], create: bool = False) -> dict[URN, int]:
+        """
+        Get the IDs of the given URNs. URNs that aren't cached are looked up with one query, or
+        inserted and looked up with one upsert if ``create`` is ``True``. Otherwise, URNs that
+        don't have an ID yet are left out of the result.
+        """
+        urn_strs = {urn: urn.id_str() for urn in urns if urn is not None}
+        found = {s: cls._ids[s] for s in urn_strs.values() if s in cls._ids}
+        if missing := list({s for s in urn_strs.values() if s not in found}):
+            if create:
+                found.update(await cls._upsert(missing))
+            else:
+                found.update(await cls._fetch_by_urn(missing))
+        return {urn: found[s] for urn, s in urn_strs.items() if s in found}
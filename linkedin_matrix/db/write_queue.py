@@ -0,0 +1,145 @@
+from __future__ import annotations
+
+from typing import Callable, Iterable, TypeVar
+import asyncio
+import logging
+
+from mautrix.util import background_task
+from mautrix.util.async_db import Scheme
+from mautrix.util.opt_prometheus import Histogram
+
+from .model_base import RecordModel
+
+M = TypeVar("M", bound=RecordModel)
+
+METRIC_FLUSH_SIZE = Histogram(
+    "bridge_db_write_behind_flush_rows",
+    "Number of rows written per write-behind flush",
+    buckets=(1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500),
+)
+METRIC_FLUSH_TIME = Histogram(
+    "bridge_db_write_behind_flush_seconds",
+    "Time taken to write a write-behind flush to the database",
+)
+
+
+class WriteBehindQueue:
+    """
+    Collects inserted rows from all portals and writes them to the database in batches.
+
+    Rows that have been queued but not yet committed stay visible through :meth:`find`, so the
+    model getters can check them before querying the database. Rows are written once the queue
+    reaches ``max_batch_size`` rows, or ``flush_interval`` seconds after the first queued row.
+    """
+
+    log: logging.Logger = logging.getLogger("mau.db.write_behind")
+
+    enabled: bool
+    max_batch_size: int
+    flush_interval: float
+    _pending: list[RecordModel]
+    _flushing: list[RecordModel]
+    _flush_lock: asyncio.Lock
+    _timer: asyncio.Task | None
+
+    def __init__(self):
+        self.enabled = False
+        self.max_batch_size = 500
+        self.flush_interval = 0.05
+        self._pending = []
+        self._flushing = []
+        self._flush_lock = asyncio.Lock()
+        self._timer = None
+
+    def configure(self, enabled: bool, max_batch_size: int, flush_interval_ms: int):
+        self.enabled = enabled
+        self.max_batch_size = max(max_batch_size, 1)
+        self.flush_interval = max(flush_interval_ms, 0) / 1000
+
+    async def add(self, rows: Iterable[RecordModel]):
+        self._pending.extend(rows)
+        if len(self._pending) >= self.max_batch_size:
+            await self.flush()
+        elif self._pending and not self._timer:
+            self._timer = background_task.create(self._flush_later())
+
+    def find(self, table: type[M], predicate: Callable[[M], bool]) -> list[M]:
+        """Return the queued rows of ``table`` matching ``predicate``, oldest first."""
+        return [
+            row
+            for row in (*self._flushing, *self._pending)
+            if type(row) is table and predicate(row)  # type: ignore
+        ]
+
+    def is_pending(self, row: RecordModel) -> bool:
+        return any(pending is row for pending in self._pending)
+
+    async def discard(self, table: type[M], predicate: Callable[[M], bool]):
+        """
+        Drop queued rows of ``table`` matching ``predicate``. If a matching row is currently
+        being written, wait for that write to finish so that a subsequent ``DELETE`` sees it.
+        """
+        self._pending = [
+            row
+            for row in self._pending
+            if type(row) is not table or not predicate(row)  # type: ignore
+        ]
+        if any(type(row) is table and predicate(row) for row in self._flushing):  # type: ignore
+            async with self._flush_lock:
+                pass
+
+    async def _flush_later(self):
+        try:
+            await asyncio.sleep(self.flush_interval)
+        finally:
+            self._timer = None
+        await self.flush()
+
+    async def flush(self):
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            self._flushing, self._pending = self._pending, []
+            try:
+                with METRIC_FLUSH_TIME.time():
+                    by_table: dict[type[RecordModel], list[RecordModel]] = {}
+                    for row in self._flushing:
+                        by_table.setdefault(type(row), []).append(row)
+                    for table, rows in by_table.items():
+                        await self._write(table, rows)
+                METRIC_FLUSH_SIZE.observe(len(self._flushing))
+            finally:
+                self._flushing = []
+
+    async def _write(self, table: type[RecordModel], rows: list[RecordModel]):
+        records = await table.to_records(rows)
+        try:
+            async with table.db.acquire() as conn, conn.transaction():
+                if table.db.scheme == Scheme.POSTGRES:
+                    await conn.copy_records_to_table(
+                        table._table_name, records=records, columns=table._field_list
+                    )
+                else:
+                    await conn.executemany(table.insert_constructor(), records)
+            return
+        except Exception:
+            self.log.warning(
+                f"Failed to write batch of {len(records)} {table._table_name} rows, "
+                "falling back to inserting rows one by one",
+                exc_info=True,
+            )
+        for record in records:
+            try:
+                await table.db.execute(table.insert_constructor(), *record)
+            except Exception:
+                self.log.exception(f"Failed to write {table._table_name} row {record}")
+
+    async def stop(self):
+        self.enabled = False
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        await self.flush()
+
+
+write_queue = WriteBehindQueue()
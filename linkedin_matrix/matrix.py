@@ -2,16 +2,19 @@ from __future__ import annotations
 
 from typing import TYPE_CHECKING, cast
 import asyncio
+import logging
 
 from mautrix.bridge import BaseMatrixHandler
 from mautrix.types import (
     Event,
     EventID,
     EventType,
+    MessageEvent,
     PresenceEvent,
     PresenceEventContent,
     ReceiptEvent,
     RoomID,
+    SingleReceiptEventContent,
     TypingEvent,
     UserID,
 )
@@ -20,6 +23,7 @@ from mautrix.types.event.reaction import ReactionEventContent
 
 # these have to be in this particular order to avoid circular imports
 from . import portal as po, user as u
+from .util import MATRIX_TO_LINKEDIN, LagTrace, LogSampler, traced
 
 if TYPE_CHECKING:
     from .__main__ import LinkedInBridge
@@ -31,6 +35,8 @@ class MatrixHandler(BaseMatrixHandler):
         homeserver = bridge.config["homeserver.domain"]
         self.user_id_prefix = f"@{prefix}"
         self.user_id_suffix = f"{suffix}:{homeserver}"
+        # Presence and typing events arrive constantly, so only log a sample of them.
+        self.log_sampler = LogSampler()
         super().__init__(bridge=bridge)
 
     async def send_welcome_message(self, room_id: RoomID, inviter: "u.User"):
@@ -43,11 +49,20 @@ class MatrixHandler(BaseMatrixHandler):
                 "This room has been marked as your LinkedIn Messages bridge notice room.",
             )
 
-    async def handle_read_receipt(self, user: "u.User", portal: "po.Portal", *_):
+    async def handle_message(self, evt: MessageEvent, was_encrypted: bool = False):
+        with traced(LagTrace(MATRIX_TO_LINKEDIN, "direct", origin_ts=evt.timestamp / 1000)):
+            await super().handle_message(evt, was_encrypted)
+
+    async def handle_read_receipt(
+        self,
+        user: "u.User",
+        portal: "po.Portal",
+        event_id: EventID,
+        _: SingleReceiptEventContent,
+    ):
         if not user.client or not portal.mxid:
             return
-        self.log.debug(f"{user.li_member_urn} read {portal.li_thread_urn}")
-        await user.client.mark_conversation_as_read(portal.li_thread_urn)
+        await portal.handle_matrix_read_receipt(user, event_id)
 
     async def handle_leave(self, room_id: RoomID, user_id: UserID, _):
         portal = await po.Portal.get_by_mxid(room_id)
@@ -105,18 +120,23 @@ class MatrixHandler(BaseMatrixHandler):
 
     async def handle_presence(self, user_id: UserID, info: PresenceEventContent):
         # TODO (#50)
-        self.log.info(f"user ({user_id}) is present {info}")
+        self.log_sampler.log(
+            self.log, logging.DEBUG, "presence", "%s is present: %s", user_id, info
+        )
         if not self.config["bridge.presence"]:
             return
 
     async def handle_typing(self, room_id: RoomID, typing: list[UserID]):
-        self.log.info(f"room: {room_id}: typing {typing}")
+        self.log_sampler.log(
+            self.log, logging.DEBUG, "typing", "Typing in %s: %s", room_id, typing
+        )
         portal: po.Portal | None = await po.Portal.get_by_mxid(room_id)
         if not portal:
             return
 
         async def _send_typing(user_id: UserID):
-            await portal.handle_matrix_typing(await u.User.get_by_mxid(user_id))
+            if user := await u.User.get_by_mxid(user_id, create=False):
+                await portal.handle_matrix_typing(user)
 
         await asyncio.gather(*(_send_typing(user_id) for user_id in typing))
 
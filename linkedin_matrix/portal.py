@@ -1,13 +1,17 @@
 from __future__ import annotations
 
 from typing import TYPE_CHECKING, Any, AsyncGenerator, Literal, cast
-from collections import deque
+from collections import OrderedDict, deque
 from datetime import datetime, timedelta
 from io import BytesIO
 from itertools import zip_longest
 import asyncio
+import json
+import random
+import time
 
 from bs4 import BeautifulSoup
+import aiohttp
 import magic
 
 from linkedin_matrix.db.message import Message
@@ -19,15 +23,18 @@ from linkedin_messaging.api_objects import (
     Error,
     MediaAttachment,
     MessageAttachment,
+    MessageAttachmentCreate,
     MessageCreate,
+    MessagingMember,
     MiniProfile,
     ReactionSummary,
     RealTimeEventStreamEvent,
     ThirdPartyMedia,
 )
+from linkedin_messaging.exceptions import TooManyRequestsError
 from mautrix.appservice import IntentAPI
 from mautrix.bridge import BasePortal, NotificationDisabler, async_getter_lock
-from mautrix.errors import MatrixError, MForbidden
+from mautrix.errors import DecryptionError, MatrixError, MForbidden
 from mautrix.types import (
     AudioInfo,
     ContentURI,
@@ -42,22 +49,48 @@ from mautrix.types import (
     MessageType,
     RoomID,
     TextMessageEventContent,
+    ThumbnailInfo,
     VideoInfo,
 )
-from mautrix.types.event.message import Format
+from mautrix.types.event.message import Format, MessageEvent
 from mautrix.types.primitive import UserID
 from mautrix.util.message_send_checkpoint import MessageSendCheckpointStatus
+from mautrix.util.opt_prometheus import Counter, Histogram
 from mautrix.util.simple_lock import SimpleLock
 
 from . import matrix as m, puppet as p, user as u
 from .config import Config
-from .db import Message as DBMessage, Portal as DBPortal, Reaction as DBReaction
+from .db import (
+    Message as DBMessage,
+    OutboxMessage as DBOutboxMessage,
+    Portal as DBPortal,
+    Reaction as DBReaction,
+)
 from .formatter import (
     linkedin_spinmail_to_matrix,
     linkedin_subject_to_matrix,
     linkedin_to_matrix,
     matrix_to_linkedin,
 )
+from .util import (
+    LINKEDIN_TO_MATRIX,
+    MATRIX_TO_LINKEDIN,
+    AttachmentDecryptor,
+    Debouncer,
+    IdentityMap,
+    LagTrace,
+    LatestValueCoalescer,
+    content_hash,
+    current_trace,
+    decrypt_stream,
+    get_image_size,
+    iter_media,
+    lag_stage,
+    offloader,
+    task_registry,
+    thumbnailer,
+    traced,
+)
 
 if TYPE_CHECKING:
     from .__main__ import LinkedInBridge
@@ -73,6 +106,33 @@ except ImportError:
     decrypt_attachment = encrypt_attachment = None  # type: ignore
 
 
+def _detect_media(data: bytes, find_size: bool) -> tuple[str, tuple[int, int] | None]:
+    # This is a module-level function so that it can be run in a process pool.
+    mime = magic.from_buffer(data, mime=True)
+    if not find_size or not mime.startswith("image/"):
+        return mime, None
+    size = get_image_size(data)
+    if not size and Image:
+        # Formats the header parser doesn't know, like BMP or TIFF
+        with Image.open(BytesIO(data)) as img:
+            size = img.size
+    return mime, size
+
+
+class SenderNotConnected(Exception):
+    pass
+
+
+def _is_retryable(e: Exception) -> bool:
+    if isinstance(e, (TooManyRequestsError, SenderNotConnected, asyncio.TimeoutError)):
+        return True
+    if isinstance(e, Error):
+        return e.status == 429 or e.status >= 500
+    if isinstance(e, aiohttp.ClientResponseError):
+        return e.status == 429 or e.status >= 500
+    return isinstance(e, aiohttp.ClientError)
+
+
 class FakeLock:
     async def __aenter__(self):
         pass
@@ -84,13 +144,24 @@ class FakeLock:
 StateBridge = EventType.find("m.bridge", EventType.Class.STATE)
 StateHalfShotBridge = EventType.find("uk.half-shot.bridge", EventType.Class.STATE)
 MediaInfo = FileInfo | VideoInfo | AudioInfo | ImageInfo
+UploadedThumbnail = tuple[ContentURI, EncryptedFile | None, ThumbnailInfo, str | None]
 ConvertedMessage = tuple[EventType, MessageEventContent]
+PortalKey = tuple[URN, URN | None]
+
+METRIC_LOOKUP = Counter(
+    "bridge_portal_lookup", "Portal lookups by LinkedIn thread URN", ["result"]
+)
+METRIC_LOOKUP_LOCK_WAIT = Histogram(
+    "bridge_portal_lookup_lock_wait_seconds",
+    "Time spent waiting for a portal lookup lock shard",
+)
 
 
 class Portal(DBPortal, BasePortal):
     invite_own_puppet_to_pm: bool = False
     by_mxid: dict[RoomID, "Portal"] = {}
-    by_li_thread_urn: dict[tuple[URN, URN | None], "Portal"] = {}
+    by_li_thread_urn: IdentityMap[PortalKey, "Portal"] = IdentityMap()
+    max_cached: int = 0
     matrix: m.MatrixHandler
     config: Config
     private_chat_portal_meta: Literal["default", "always", "never"]
@@ -100,6 +171,36 @@ class Portal(DBPortal, BasePortal):
     _send_locks: dict[URN, asyncio.Lock]
     _noop_lock: FakeLock = FakeLock()
 
+    # Lookups by thread URN are serialized on a fixed set of lock shards instead of one lock per
+    # key, and misses are remembered for a short time so that events for threads without a
+    # portal don't hit the database every time.
+    _lookup_locks: list[asyncio.Lock] = [asyncio.Lock()]
+    _not_found: dict[PortalKey, float] = {}
+    _not_found_ttl: float = 30
+    _not_found_max_size: int = 10000
+
+    # Uploaded thumbnails, keyed by the hash of the original image and whether it was encrypted,
+    # so that an image that's sent to many chats is only thumbnailed once.
+    _thumbnail_cache: OrderedDict[tuple[str, bool], UploadedThumbnail] = OrderedDict()
+    _thumbnail_cache_size: int = 1000
+
+    outbox_enabled: bool = False
+    outbox_max_attempts: int = 8
+    outbox_min_backoff: float = 2
+    outbox_max_backoff: float = 300
+
+    # Typing notifications and read receipts are coalesced across all portals, keyed by the user
+    # and the chat that they are in.
+    _matrix_typing: Debouncer[tuple[UserID, URN]]
+    _linkedin_typing: Debouncer[tuple[UserID, RoomID]]
+    _linkedin_typing_timeout: int
+    _matrix_read_receipts: LatestValueCoalescer[
+        tuple[UserID, URN], tuple["u.User", "Portal", EventID]
+    ]
+    _linkedin_read_receipts: LatestValueCoalescer[
+        tuple[UserID, RoomID], tuple["p.Puppet", "Portal", URN]
+    ]
+
     def __init__(
         self,
         li_thread_urn: URN,
@@ -143,6 +244,10 @@ class Portal(DBPortal, BasePortal):
             "Waiting for backfilling to finish before handling %s", log=self.log
         )
         self._backfill_leave: set[IntentAPI] | None = None
+        self._outbox_task: asyncio.Task | None = None
+        self._outbox_pending = False
+        self._outbox_traces: dict[EventID, LagTrace] = {}
+        self._outbox_redacted: set[EventID] = set()
 
     @classmethod
     def init_cls(cls, bridge: "LinkedInBridge"):
@@ -153,6 +258,29 @@ class Portal(DBPortal, BasePortal):
         cls.matrix = bridge.matrix
         cls.invite_own_puppet_to_pm = cls.config["bridge.invite_own_puppet_to_pm"]
         cls.private_chat_portal_meta = cls.config["bridge.private_chat_portal_meta"]
+        cls._lookup_locks = [
+            asyncio.Lock() for _ in range(max(cls.config["bridge.portal_lookup.lock_shards"], 1))
+        ]
+        cls._not_found_ttl = cls.config["bridge.portal_lookup.negative_ttl"]
+        cls.max_cached = cls.config["bridge.cache_limits.portals"]
+        cls._thumbnail_cache_size = cls.config["bridge.thumbnails.cache_size"]
+        cls.outbox_enabled = cls.config["bridge.outbox.enabled"]
+        cls.outbox_max_attempts = cls.config["bridge.outbox.max_attempts"]
+        cls.outbox_min_backoff = cls.config["bridge.outbox.min_backoff"]
+        cls.outbox_max_backoff = cls.config["bridge.outbox.max_backoff"]
+        typing_window = cls.config["bridge.coalescing.typing_window"]
+        read_receipt_delay = cls.config["bridge.coalescing.read_receipt_delay"]
+        cls._matrix_typing = Debouncer(typing_window)
+        cls._linkedin_typing = Debouncer(typing_window)
+        # Refreshes arrive at most once per window, so the indicator has to outlive it or it
+        # flickers off between refreshes.
+        cls._linkedin_typing_timeout = int((typing_window + 5) * 1000)
+        cls._matrix_read_receipts = LatestValueCoalescer(
+            read_receipt_delay, cls._send_matrix_read_receipt, cls.log
+        )
+        cls._linkedin_read_receipts = LatestValueCoalescer(
+            read_receipt_delay, cls._send_linkedin_seen_receipt, cls.log
+        )
         NotificationDisabler.puppet_cls = p.Puppet
         NotificationDisabler.config_enabled = cls.config["bridge.backfill.disable_notifications"]
 
@@ -163,6 +291,7 @@ class Portal(DBPortal, BasePortal):
             await DBMessage.delete_all_by_room(self.mxid)
             self.by_mxid.pop(self.mxid, None)
         self.by_li_thread_urn.pop(self.li_urn_full, None)
+        self._not_found.pop(self.li_urn_full, None)
         await super().delete()
 
     # endregion
@@ -189,7 +318,7 @@ class Portal(DBPortal, BasePortal):
     # region Properties
 
     @property
-    def li_urn_full(self) -> tuple[URN, URN | None]:
+    def li_urn_full(self) -> PortalKey:
         return self.li_thread_urn, self.li_receiver_urn
 
     @property
@@ -221,10 +350,6 @@ class Portal(DBPortal, BasePortal):
     # region Database getters
 
     async def postinit(self):
-        self.by_li_thread_urn[self.li_urn_full] = self
-        if self.mxid:
-            self.by_mxid[self.mxid] = self
-
         if self.is_direct:
             if not self.li_other_user_urn:
                 raise ValueError("Portal.li_other_user_urn not set for private chat")
@@ -234,13 +359,23 @@ class Portal(DBPortal, BasePortal):
         else:
             self._main_intent = self.az.intent
 
+        # Cache hits in get_by_li_thread_urn don't take the lookup lock, so the portal must only
+        # become visible once it's fully initialised.
+        self.by_li_thread_urn[self.li_urn_full] = self
+        self._not_found.pop(self.li_urn_full, None)
+        if self.mxid:
+            self.by_mxid[self.mxid] = self
+
     @classmethod
     @async_getter_lock
     async def get_by_mxid(cls, mxid: RoomID) -> Portal | None:
         try:
-            return cls.by_mxid[mxid]
+            portal = cls.by_mxid[mxid]
         except KeyError:
             pass
+        else:
+            cls.by_li_thread_urn.touch(portal.li_urn_full)
+            return portal
 
         portal = cast("Portal", await super().get_by_mxid(mxid))
         if portal:
@@ -249,8 +384,63 @@ class Portal(DBPortal, BasePortal):
 
         return None
 
+    def _can_evict(self) -> bool:
+        if self.mxid and (lock := self._async_get_locks.get((self.mxid,))) and lock.locked():
+            return False
+        return not (
+            self.backfill_lock.locked
+            or self._create_room_lock.locked()
+            or any(lock.locked() for lock in self._send_locks.values())
+            or self._typing
+            or self._backfill_leave is not None
+            or (self._outbox_task is not None and not self._outbox_task.done())
+        )
+
+    @classmethod
+    def evict_idle(cls) -> int:
+        """
+        Drop the least recently used portals from the cache until there are at most
+        ``max_cached`` left. Portals that are busy are kept. Evicted portals are loaded from the
+        database again the next time they're needed.
+
+        :returns: the number of evicted portals.
+        """
+        evicted = cls.by_li_thread_urn.evict(cls.max_cached, lambda portal: portal._can_evict())
+        for portal in evicted:
+            if portal.mxid and cls.by_mxid.get(portal.mxid) is portal:
+                del cls.by_mxid[portal.mxid]
+                cls._async_get_locks.pop((portal.mxid,), None)
+        return len(evicted)
+
+    @classmethod
+    def _lookup_lock(cls, key: PortalKey) -> asyncio.Lock:
+        return cls._lookup_locks[hash(key) % len(cls._lookup_locks)]
+
+    @classmethod
+    def _is_known_missing(cls, key: PortalKey) -> bool:
+        try:
+            expires_at = cls._not_found[key]
+        except KeyError:
+            return False
+        if expires_at > time.monotonic():
+            return True
+        cls._not_found.pop(key, None)
+        return False
+
+    @classmethod
+    def _remember_missing(cls, key: PortalKey):
+        if cls._not_found_ttl <= 0:
+            return
+        now = time.monotonic()
+        if len(cls._not_found) >= cls._not_found_max_size:
+            # Drop expired entries first, then the oldest ones if that wasn't enough.
+            cls._not_found = {k: exp for k, exp in cls._not_found.items() if exp > now}
+            while len(cls._not_found) >= cls._not_found_max_size:
+                cls._not_found.pop(next(iter(cls._not_found)))
+        cls._not_found.pop(key, None)
+        cls._not_found[key] = now + cls._not_found_ttl
+
     @classmethod
-    @async_getter_lock
     async def get_by_li_thread_urn(
         cls,
         li_thread_urn: URN,
@@ -260,11 +450,48 @@ class Portal(DBPortal, BasePortal):
         li_other_user_urn: URN | None = None,
         create: bool = True,
     ) -> Portal | None:
+        key = (li_thread_urn, li_receiver_urn)
         try:
-            return cls.by_li_thread_urn[(li_thread_urn, li_receiver_urn)]
+            portal = cls.by_li_thread_urn[key]
         except KeyError:
             pass
+        else:
+            METRIC_LOOKUP.labels(result="hit").inc()
+            return portal
+        if not create and cls._is_known_missing(key):
+            METRIC_LOOKUP.labels(result="negative_hit").inc()
+            return None
+
+        lock = cls._lookup_lock(key)
+        wait_start = time.monotonic()
+        async with lock:
+            METRIC_LOOKUP_LOCK_WAIT.observe(time.monotonic() - wait_start)
+            return await cls._get_by_li_thread_urn(
+                key,
+                li_is_group_chat=li_is_group_chat,
+                li_other_user_urn=li_other_user_urn,
+                create=create,
+            )
+
+    @classmethod
+    async def _get_by_li_thread_urn(
+        cls,
+        key: PortalKey,
+        *,
+        li_is_group_chat: bool,
+        li_other_user_urn: URN | None,
+        create: bool,
+    ) -> Portal | None:
+        # Another task may have loaded or created the portal while we were waiting for the lock.
+        try:
+            return cls.by_li_thread_urn[key]
+        except KeyError:
+            pass
+        if not create and cls._is_known_missing(key):
+            return None
 
+        METRIC_LOOKUP.labels(result="miss").inc()
+        li_thread_urn, li_receiver_urn = key
         portal = cast(
             Portal,
             await super().get_by_li_thread_urn(li_thread_urn, li_receiver_urn),
@@ -279,14 +506,38 @@ class Portal(DBPortal, BasePortal):
                 )
                 await portal.insert()
             else:
+                cls._remember_missing(key)
                 return None
-
-        if li_other_user_urn is not None:
+        elif li_other_user_urn is not None and portal.li_other_user_urn != li_other_user_urn:
             portal.li_other_user_urn = li_other_user_urn
-        await portal.save()
+            await portal.save()
+
         await portal.postinit()
         return portal
 
+    @classmethod
+    async def warm_cache(cls, li_receiver_urns: list[URN]) -> int:
+        """
+        Load all portals of the given receivers into the cache, along with the puppets that
+        their main intents need.
+
+        :returns: the number of portals that were added to the cache.
+        """
+        portals = [
+            cast(Portal, portal)
+            for portal in await super().get_all_by_li_receiver_urns(li_receiver_urns)
+            if (portal.li_thread_urn, portal.li_receiver_urn) not in cls.by_li_thread_urn
+            # postinit refuses DMs without the other user, leave those for a normal lookup.
+            and not (portal.is_direct and not portal.li_other_user_urn)
+        ]
+        # Load the DM puppets in bulk so that postinit finds them in the cache.
+        await p.Puppet.get_many_by_li_member_urn(
+            portal.li_other_user_urn for portal in portals if portal.is_direct
+        )
+        for portal in portals:
+            await portal.postinit()
+        return len(portals)
+
     @classmethod
     async def get_all_by_li_receiver_urn(
         cls,
@@ -458,6 +709,7 @@ class Portal(DBPortal, BasePortal):
     ) -> bool:
         changed = False
 
+        participants: list[tuple[MessagingMember, URN]] = []
         for participant in conversation.participants if conversation else []:
             if (
                 not (mm := participant.messaging_member)
@@ -469,8 +721,12 @@ class Portal(DBPortal, BasePortal):
             participant_urn = entity_urn
             if participant_urn == URN("UNKNOWN"):
                 participant_urn = conversation.entity_urn
-            puppet = await p.Puppet.get_by_li_member_urn(participant_urn)
-            await puppet.update_info(source, participant.messaging_member)
+            participants.append((mm, participant_urn))
+        puppets = await p.Puppet.get_many_by_li_member_urn(urn for _, urn in participants)
+
+        for messaging_member, participant_urn in participants:
+            puppet = puppets[participant_urn]
+            await puppet.update_info(source, messaging_member)
             if self.is_direct and self.li_other_user_urn == puppet.li_member_urn:
                 changed = await self._update_name(puppet.name) or changed
                 changed = await self._update_photo_from_puppet(puppet) or changed
@@ -863,25 +1119,35 @@ class Portal(DBPortal, BasePortal):
         if limit and len(messages) > limit:
             messages = messages[-limit:]
 
+        senders: list[tuple[ConversationEvent, URN]] = []
+        for message in messages:
+            if (
+                not (f := message.from_)
+                or not (mm := f.messaging_member)
+                or not (mp := mm.mini_profile)
+                or not (entity_urn := mp.entity_urn)
+            ):
+                self.log.error("No entity_urn found on message mini_profile!", message)
+                continue
+            member_urn = entity_urn
+            if member_urn == URN("UNKNOWN"):
+                member_urn = conversation.entity_urn
+            senders.append((message, member_urn))
+        puppets = await p.Puppet.get_many_by_li_member_urn(urn for _, urn in senders)
+
         self._backfill_leave = set()
-        async with NotificationDisabler(self.mxid, source):
-            for message in messages:
-                if (
-                    not (f := message.from_)
-                    or not (mm := f.messaging_member)
-                    or not (mp := mm.mini_profile)
-                    or not (entity_urn := mp.entity_urn)
-                ):
-                    self.log.error("No entity_urn found on message mini_profile!", message)
-                    continue
-                member_urn = entity_urn
-                if member_urn == URN("UNKNOWN"):
-                    member_urn = conversation.entity_urn
-                puppet = await p.Puppet.get_by_li_member_urn(member_urn)
-                await self.handle_linkedin_message(source, puppet, message)
-        for intent in self._backfill_leave:
-            self.log.trace(f"Leaving room with {intent.mxid} post-backfill")
-            await intent.leave_room(self.mxid)
+        try:
+            async with NotificationDisabler(self.mxid, source):
+                for message, member_urn in senders:
+                    with traced(LagTrace(LINKEDIN_TO_MATRIX, "backfill")):
+                        await self.handle_linkedin_message(source, puppets[member_urn], message)
+            for intent in self._backfill_leave:
+                self.log.trace(f"Leaving room with {intent.mxid} post-backfill")
+                await intent.leave_room(self.mxid)
+        finally:
+            # Live messages add their senders to the set too, and the portal can't be evicted
+            # while it exists.
+            self._backfill_leave = None
         self.log.info(f"Backfilled {len(messages)} messages through {source.mxid}")
 
     # endregion
@@ -932,33 +1198,137 @@ class Portal(DBPortal, BasePortal):
     ):
         assert self.mxid
 
-        exception: Exception | None = None
-        status = MessageSendCheckpointStatus.PERM_FAILURE
+        if self.outbox_enabled:
+            queued = await DBOutboxMessage(
+                mx_room=self.mxid,
+                event_id=event_id,
+                sender=sender.mxid,
+                content=json.dumps(message.serialize()),
+                created=time.time(),
+            ).insert()
+            if queued:
+                if trace := current_trace():
+                    self._outbox_traces[event_id] = trace
+                self.wake_outbox()
+            return
+
         try:
             await self._handle_matrix_message(sender, message, event_id)
-        except NotImplementedError as e:
+        except Exception as e:
+            await self._handle_matrix_message_error(sender, message, event_id, e)
+
+    async def _handle_matrix_message_error(
+        self,
+        sender: "u.User",
+        message: MessageEventContent,
+        event_id: EventID,
+        exception: Exception,
+    ):
+        # This is called from an except block, so log.exception includes the traceback.
+        status = MessageSendCheckpointStatus.PERM_FAILURE
+        if isinstance(exception, NotImplementedError):
             self.log.exception(f"Got NotImplementedError while handling {event_id}")
-            await self._send_bridge_error(f"Event is unsupported: {e}", certain_failure=True)
-            exception = e
+            await self._send_bridge_error(
+                f"Event is unsupported: {exception}", certain_failure=True
+            )
             status = MessageSendCheckpointStatus.UNSUPPORTED
-        except Error as e:
-            self.log.exception(f"Failed handling {event_id}: {e.to_json()}")
-            await self._send_bridge_error(e.to_json())
-            exception = e
-        except Exception as e:
+        elif isinstance(exception, Error):
+            self.log.exception(f"Failed handling {event_id}: {exception.to_json()}")
+            await self._send_bridge_error(exception.to_json())
+        else:
             self.log.exception(f"Failed handling {event_id}")
-            await self._send_bridge_error(str(e))
-            exception = e
+            await self._send_bridge_error(str(exception))
 
-        if exception:
-            sender.send_remote_checkpoint(
-                status,
-                event_id,
-                self.mxid,
-                EventType.ROOM_MESSAGE,
-                message.msgtype,
-                error=exception,
-            )
+        sender.send_remote_checkpoint(
+            status,
+            event_id,
+            self.mxid,
+            EventType.ROOM_MESSAGE,
+            message.msgtype,
+            error=exception,
+        )
+
+    # region Outbox
+
+    def wake_outbox(self):
+        """Start sending the messages in this portal's outbox, unless that's already happening."""
+        self._outbox_pending = True
+        if not self._outbox_task or self._outbox_task.done():
+            self._outbox_task = task_registry.create("outbox", self._process_outbox())
+
+    async def _process_outbox(self):
+        # Messages are sent one at a time in the order they were received, so a message that is
+        # waiting for a retry holds back the rest of this chat, but not other chats.
+        try:
+            while True:
+                self._outbox_pending = False
+                entry = await DBOutboxMessage.get_next(self.mxid)
+                if not entry:
+                    if self._outbox_pending:
+                        continue
+                    return
+                await self._send_outbox_message(entry)
+        finally:
+            self._outbox_redacted.clear()
+
+    async def _send_outbox_message(self, entry: DBOutboxMessage):
+        message = MessageEvent.deserialize_content(json.loads(entry.content))
+        trace = self._outbox_traces.pop(entry.event_id, None)
+        if not trace:
+            # The trace is lost if the bridge was restarted, so count the lag from when the
+            # bridge first received the event.
+            trace = LagTrace(MATRIX_TO_LINKEDIN, "outbox", origin_ts=entry.created)
+            trace.received_at = entry.created
+        trace.source = "outbox"
+        trace.add("queue", time.monotonic() - trace.started)
+        while True:
+            if entry.event_id in self._outbox_redacted:
+                # The row was already deleted by _handle_matrix_redaction.
+                self.log.debug(f"Not sending {entry.event_id}, it was redacted")
+                return
+            sender = await u.User.get_by_mxid(entry.sender, create=False)
+            try:
+                if not sender or not sender.client:
+                    raise SenderNotConnected(f"{entry.sender} is not logged in")
+                with traced(trace):
+                    await self._handle_matrix_message(sender, message, entry.event_id)
+            except Exception as e:
+                if entry.attempts + 1 < self.outbox_max_attempts and _is_retryable(e):
+                    entry.attempts += 1
+                    delay = min(
+                        self.outbox_min_backoff * 2 ** (entry.attempts - 1),
+                        self.outbox_max_backoff,
+                    ) * random.uniform(0.8, 1.2)
+                    self.log.warning(
+                        f"Failed to send {entry.event_id} (attempt {entry.attempts}), "
+                        f"retrying in {delay:.1f} seconds: {e!r}"
+                    )
+                    if sender:
+                        sender.send_remote_checkpoint(
+                            MessageSendCheckpointStatus.WILL_RETRY,
+                            entry.event_id,
+                            self.mxid,
+                            EventType.ROOM_MESSAGE,
+                            message.msgtype,
+                            error=e,
+                            retry_num=entry.attempts,
+                        )
+                    await entry.save_attempts()
+                    await asyncio.sleep(delay)
+                    continue
+                if sender:
+                    await self._handle_matrix_message_error(sender, message, entry.event_id, e)
+                else:
+                    self.log.error(f"Dropping {entry.event_id}: sender {entry.sender} not found")
+            else:
+                if entry.event_id in self._outbox_redacted:
+                    # The redaction came in while the message was being sent, and it's stored
+                    # now, so it can be deleted like any other message.
+                    await self._handle_matrix_redaction(sender, entry.event_id)
+            await entry.delete()
+            return
+
+    # endregion
 
     async def _handle_matrix_message(
         self,
@@ -994,9 +1364,12 @@ class Portal(DBPortal, BasePortal):
         assert sender.li_member_urn
 
         async with self.require_send_lock(sender.li_member_urn):
-            resp = await sender.client.send_message(self.li_thread_urn, message_create)
+            with lag_stage("linkedin_send"):
+                resp = await sender.client.send_message(self.li_thread_urn, message_create)
             if not resp.value or not resp.value.event_urn:
                 raise Exception("Response value was None.")
+            if trace := current_trace():
+                trace.delivered()
 
             sender.send_remote_checkpoint(
                 MessageSendCheckpointStatus.SUCCESS,
@@ -1017,7 +1390,11 @@ class Portal(DBPortal, BasePortal):
             )
             await self._send_delivery_receipt(event_id)
             self._dedup.append(resp.value.event_urn)
-            await message.insert()
+            self._matrix_typing.reset((sender.mxid, self.li_thread_urn))
+            with lag_stage("db_persist"):
+                await message.insert()
+            if trace:
+                trace.finish()
             return message
 
     async def _handle_matrix_text(
@@ -1027,7 +1404,8 @@ class Portal(DBPortal, BasePortal):
         message: TextMessageEventContent,
     ):
         assert sender.client
-        message_create = await matrix_to_linkedin(message, sender, self.main_intent, self.log)
+        with lag_stage("convert"):
+            message_create = await matrix_to_linkedin(message, sender, self.main_intent, self.log)
         await self._send_linkedin_message(
             event_id,
             sender,
@@ -1045,30 +1423,77 @@ class Portal(DBPortal, BasePortal):
         if not message.info:
             return
 
+        attachment = None
+        with lag_stage("convert"):
+            if message.info.size:
+                try:
+                    attachment = await self._upload_matrix_media_stream(sender, message)
+                except DecryptionError:
+                    raise
+                except Exception:
+                    self.log.warning(
+                        f"Streaming upload of {event_id} failed, retrying with the file in "
+                        "memory",
+                        exc_info=True,
+                    )
+            if not attachment:
+                attachment = await self._upload_matrix_media(sender, message)
+        if not attachment:
+            return
+
+        attachment.media_type = attachment.media_type or ""
+        await self._send_linkedin_message(
+            event_id,
+            sender,
+            MessageCreate(AttributedBody(), attachments=[attachment]),
+            message.msgtype,
+        )
+
+    async def _upload_matrix_media(
+        self, sender: "u.User", message: MediaMessageEventContent
+    ) -> MessageAttachmentCreate | None:
         if message.file and message.file.url and decrypt_attachment:
             data = await self.main_intent.download_media(message.file.url)
             file_hash = message.file.hashes.get("sha256")
             if file_hash:
-                data = decrypt_attachment(
+                data = await offloader.run(
+                    len(data),
+                    decrypt_attachment,
                     data,
                     message.file.key.key,
                     file_hash,
                     message.file.iv,
                 )
             else:
-                return
+                return None
         elif message.url:
             data = await self.main_intent.download_media(message.url)
         else:
-            return
+            return None
 
-        attachment = await sender.client.upload_media(data, message.body, message.info.mimetype)
-        attachment.media_type = attachment.media_type or ""
-        await self._send_linkedin_message(
-            event_id,
-            sender,
-            MessageCreate(AttributedBody(), attachments=[attachment]),
-            message.msgtype,
+        return await sender.client.upload_media(data, message.body, message.info.mimetype)
+
+    async def _upload_matrix_media_stream(
+        self, sender: "u.User", message: MediaMessageEventContent
+    ) -> MessageAttachmentCreate | None:
+        """
+        Pipe the file from the homeserver to LinkedIn chunk by chunk, decrypting it on the way
+        if needed, so that memory use doesn't depend on the file size. This relies on the size
+        declared in the event info being correct.
+        """
+        if message.file and message.file.url and decrypt_attachment:
+            file_hash = message.file.hashes.get("sha256")
+            if not file_hash:
+                return None
+            decryptor = AttachmentDecryptor(message.file.key.key, file_hash, message.file.iv)
+            stream = decrypt_stream(iter_media(self.main_intent, message.file.url), decryptor)
+        elif message.url:
+            stream = iter_media(self.main_intent, message.url)
+        else:
+            return None
+
+        return await sender.client.upload_media_stream(
+            stream, message.info.size, message.body, message.info.mimetype
         )
 
     async def handle_matrix_redaction(
@@ -1097,7 +1522,18 @@ class Portal(DBPortal, BasePortal):
             await self._send_delivery_receipt(redaction_event_id)
 
     async def _handle_matrix_redaction(self, sender: "u.User", event_id: EventID):
-        if not self.mxid or not sender.client or not sender.li_member_urn:
+        if not self.mxid:
+            return
+
+        if self.outbox_enabled and await DBOutboxMessage.delete_by_event_id(event_id, self.mxid):
+            self.log.info(f"Dropped {event_id} from the outbox before it was sent")
+            self._outbox_traces.pop(event_id, None)
+            if self._outbox_task and not self._outbox_task.done():
+                # It may already be on its way, let _send_outbox_message know.
+                self._outbox_redacted.add(event_id)
+            return
+
+        if not sender.client or not sender.li_member_urn:
             return
 
         message = await DBMessage.get_by_mxid(event_id, self.mxid)
@@ -1133,7 +1569,7 @@ class Portal(DBPortal, BasePortal):
         async with self.require_send_lock(sender.li_member_urn):
             message = await DBMessage.get_by_mxid(reacting_to, self.mxid)
             if not message:
-                self.log.debug(f"Ignoring reaction to unknown event {reacting_to}")
+                self.log.debug("Ignoring reaction to unknown event %s", reacting_to)
                 return
 
             try:
@@ -1161,8 +1597,34 @@ class Portal(DBPortal, BasePortal):
                 await self._send_delivery_receipt(event_id)
 
     async def handle_matrix_typing(self, source: "u.User"):
+        if not source.client:
+            return
+        if not self._matrix_typing.should_send((source.mxid, self.li_thread_urn)):
+            return
         await source.client.set_typing(self.li_thread_urn)
 
+    async def handle_matrix_read_receipt(self, source: "u.User", event_id: EventID):
+        await self._matrix_read_receipts.submit(
+            (source.mxid, self.li_thread_urn), (source, self, event_id)
+        )
+
+    @classmethod
+    async def _send_matrix_read_receipt(
+        cls,
+        key: tuple[UserID, URN],
+        value: tuple["u.User", "Portal", EventID],
+    ):
+        source, portal, event_id = value
+        if not source.client:
+            return
+        cls.log.debug("%s read %s up to %s", source.li_member_urn, portal.li_thread_urn, event_id)
+        await source.client.mark_conversation_as_read(portal.li_thread_urn)
+
+    @classmethod
+    async def flush_read_receipts(cls):
+        await cls._matrix_read_receipts.flush()
+        await cls._linkedin_read_receipts.flush()
+
     # endregion
 
     # region LinkedIn event handling
@@ -1320,7 +1782,7 @@ class Portal(DBPortal, BasePortal):
         event_ids: list[EventID] = []
         async with self.require_send_lock(sender.li_member_urn):
             if li_message_urn in self._dedup:
-                self.log.trace(f"Not handling message {li_message_urn}, found ID in dedup queue")
+                self.log.trace("Not handling message %s, found ID in dedup queue", li_message_urn)
                 # Return here, because it is in the process of being handled.
                 return
             self._dedup.appendleft(li_message_urn)
@@ -1358,44 +1820,52 @@ class Portal(DBPortal, BasePortal):
                 self._backfill_leave.add(intent)
 
             timestamp = message.created_at or datetime.now()
+            trace = current_trace()
+            if trace and message.created_at:
+                trace.origin_ts = message.created_at.timestamp()
+            with lag_stage("convert"):
+                converted = await self._convert_linkedin_message(source, intent, message)
             event_ids = []
-            for event_type, content in await self._convert_linkedin_message(
-                source, intent, message
-            ):
-                event_ids.append(
-                    await self._send_message(
-                        intent, content, event_type=event_type, timestamp=timestamp
+            with lag_stage("matrix_send"):
+                for event_type, content in converted:
+                    event_ids.append(
+                        await self._send_message(
+                            intent, content, event_type=event_type, timestamp=timestamp
+                        )
                     )
-                )
             event_ids = [event_id for event_id in event_ids if event_id]
             if not event_ids:
                 self.log.warning(f"Unhandled LinkedIn message {message.entity_urn}")
                 return
+            if trace:
+                trace.delivered()
 
             # Save all of the messages in the database.
-            self.log.debug(f"Handled LinkedIn message {li_message_urn} -> {event_ids}")
-            await DBMessage.bulk_create(
-                li_message_urn=li_message_urn,
-                li_thread_urn=self.li_thread_urn,
-                li_sender_urn=sender.li_member_urn,
-                li_receiver_urn=self.li_receiver_urn,
-                mx_room=self.mxid,
-                timestamp=timestamp,
-                event_ids=event_ids,
-            )
+            self.log.debug("Handled LinkedIn message %s -> %s", li_message_urn, event_ids)
+            with lag_stage("db_persist"):
+                await DBMessage.bulk_create(
+                    li_message_urn=li_message_urn,
+                    li_thread_urn=self.li_thread_urn,
+                    li_sender_urn=sender.li_member_urn,
+                    li_receiver_urn=self.li_receiver_urn,
+                    mx_room=self.mxid,
+                    timestamp=timestamp,
+                    event_ids=event_ids,
+                )
+            if trace:
+                trace.finish()
             await self._send_delivery_receipt(event_ids[-1])
         # end if message_exists
 
         # Handle reactions
-        reaction_event_id = event_ids[-1]  # react to the last event
-        for reaction_summary in message.reaction_summaries:
-            await self._handle_reaction_summary(
-                li_message_urn,
-                source,
-                reaction_event_id,
-                reaction_summary,
-                message.created_at,
-            )
+        await self._reconcile_reactions(
+            li_message_urn,
+            source,
+            event_ids[-1],  # react to the last event
+            message.reaction_summaries,
+            message.created_at,
+            check_stored=message_exists,
+        )
 
     async def _redact_and_delete_message(
         self, sender: "p.Puppet", msg: Message, timestamp: datetime | None
@@ -1464,7 +1934,7 @@ class Portal(DBPortal, BasePortal):
             return
 
         # Save all of the messages in the database.
-        self.log.debug(f"Handled LinkedIn message edit {message.entity_urn} -> {event_ids}")
+        self.log.debug("Handled LinkedIn message edit %s -> %s", message.entity_urn, event_ids)
         await DBMessage.bulk_create(
             li_message_urn=message.entity_urn,
             li_thread_urn=self.li_thread_urn,
@@ -1476,6 +1946,52 @@ class Portal(DBPortal, BasePortal):
         )
         await self._send_delivery_receipt(event_ids[-1])
 
+    async def _reconcile_reactions(
+        self,
+        li_message_urn: URN,
+        source: "u.User",
+        reaction_event_id: EventID,
+        reaction_summaries: list[ReactionSummary],
+        timestamp: datetime | None,
+        check_stored: bool = True,
+    ):
+        """
+        Bring the bridged reactions to a message in line with its reaction summaries. Reactors
+        are only fetched for emojis whose stored count or own reaction doesn't match the summary.
+        """
+        assert self.li_receiver_urn
+        stored: dict[str, tuple[int, bool]] = {}
+        if check_stored:
+            stored = await DBReaction.get_counts_by_li_message_urn(
+                li_message_urn, self.li_receiver_urn, source.li_member_urn
+            )
+
+        summaries = {summary.emoji: summary for summary in reaction_summaries if summary.emoji}
+        for emoji, summary in summaries.items():
+            if stored.get(emoji, (0, False)) == (summary.count, summary.viewer_reacted):
+                continue
+            await self._handle_reaction_summary(
+                li_message_urn, source, reaction_event_id, summary, timestamp
+            )
+
+        for emoji in stored.keys() - summaries.keys():
+            self.log.debug(f"Reactions with {emoji} to {li_message_urn} were removed")
+            for reaction in await DBReaction.get_all_by_li_message_urn_and_emoji(
+                li_message_urn, self.li_receiver_urn, emoji
+            ):
+                await self._redact_and_delete_reaction(reaction, timestamp)
+
+    async def _redact_and_delete_reaction(self, reaction: DBReaction, timestamp: datetime | None):
+        intent = self.main_intent
+        if reaction.li_sender_urn:
+            sender = await p.Puppet.get_by_li_member_urn(reaction.li_sender_urn)
+            intent = sender.intent_for(self)
+        try:
+            await intent.redact(reaction.mx_room, reaction.mxid, timestamp=timestamp)
+        except MForbidden:
+            await self.main_intent.redact(reaction.mx_room, reaction.mxid, timestamp=timestamp)
+        await reaction.delete()
+
     async def _handle_reaction_summary(
         self,
         li_message_urn: URN,
@@ -1492,20 +2008,30 @@ class Portal(DBPortal, BasePortal):
 
         emoji = reaction_summary.emoji
         reactors = await source.client.get_reactors(li_message_urn, emoji)
+        existing = {
+            reaction.li_sender_urn: reaction
+            for reaction in await DBReaction.get_all_by_li_message_urn_and_emoji(
+                li_message_urn, self.li_receiver_urn, emoji
+            )
+        }
+
+        new_reactors = [
+            reactor.reactor_urn
+            for reactor in reactors.elements
+            if reactor.reactor_urn and not existing.pop(reactor.reactor_urn, None)
+        ]
+        puppets = await p.Puppet.get_many_by_li_member_urn(new_reactors)
 
         mxids = []
-        for reactor in reactors.elements:
-            sender = await p.Puppet.get_by_li_member_urn(reactor.reactor_urn)
+        for reactor_urn in new_reactors:
+            sender = puppets[reactor_urn]
             intent = sender.intent_for(self)
 
-            mxid = await intent.react(
-                self.mxid, reaction_event_id, reaction_summary.emoji, timestamp=timestamp
-            )
+            mxid = await intent.react(self.mxid, reaction_event_id, emoji, timestamp=timestamp)
             mxids.append(mxid)
 
             self.log.debug(
-                f"{sender.mxid} reacted to {reaction_event_id} with "
-                f"{reaction_summary.emoji}, got {mxid}."
+                f"{sender.mxid} reacted to {reaction_event_id} with {emoji}, got {mxid}."
             )
 
             await DBReaction(
@@ -1514,9 +2040,14 @@ class Portal(DBPortal, BasePortal):
                 li_message_urn=li_message_urn,
                 li_receiver_urn=self.li_receiver_urn,
                 li_sender_urn=sender.li_member_urn,
-                reaction=reaction_summary.emoji,
+                reaction=emoji,
             ).insert()
 
+        # Anything left over was removed on LinkedIn, unless the reactor list was cut short.
+        if len(reactors.elements) >= reaction_summary.count:
+            for reaction in existing.values():
+                await self._redact_and_delete_reaction(reaction, timestamp)
+
         return mxids
 
     async def _convert_linkedin_attachments(
@@ -1647,25 +2178,28 @@ class Portal(DBPortal, BasePortal):
         if len(file_data) > cls.matrix.media_config.upload_size:
             raise ValueError("File not available: too large")
 
-        mime = magic.from_buffer(file_data, mime=True)
+        find_size = find_size and (width is None or height is None)
+        mime, size = await offloader.run(len(file_data), _detect_media, file_data, find_size)
+        if size:
+            width, height = size
 
         info = FileInfo(mimetype=mime, size=len(file_data))
-        if Image and mime.startswith("image/"):
-            if (width is None or height is None) and find_size:
-                with Image.open(BytesIO(file_data)) as img:
-                    width, height = img.size
-            if width and height:
-                info = ImageInfo(
-                    mimetype=mime,
-                    size=len(file_data),
-                    width=width,
-                    height=height,
-                )
+        if mime.startswith("image/") and width and height:
+            info = ImageInfo(
+                mimetype=mime,
+                size=len(file_data),
+                width=width,
+                height=height,
+            )
+            if max(width, height) > thumbnailer.max_size:
+                await cls._add_thumbnail(info, file_data, intent, encrypt)
 
         upload_mime_type = mime
         decryption_info = None
         if encrypt and encrypt_attachment:
-            file_data, decryption_info = encrypt_attachment(file_data)
+            file_data, decryption_info = await offloader.run(
+                len(file_data), encrypt_attachment, file_data
+            )
             upload_mime_type = "application/octet-stream"
             filename = None
         url = await intent.upload_media(
@@ -1678,6 +2212,53 @@ class Portal(DBPortal, BasePortal):
             decryption_info.url = url
         return url, info, decryption_info
 
+    @classmethod
+    async def _add_thumbnail(
+        cls, info: ImageInfo, data: bytes, intent: IntentAPI, encrypt: bool
+    ) -> None:
+        if not thumbnailer.enabled:
+            return
+        cache_key = (await offloader.run(len(data), content_hash, data), encrypt)
+        try:
+            uploaded = cls._thumbnail_cache[cache_key]
+        except KeyError:
+            thumbnail = await thumbnailer.generate(data)
+            if not thumbnail:
+                return
+            thumbnail_data = thumbnail.data
+            decryption_info = None
+            upload_mime_type = thumbnail.mimetype
+            if encrypt and encrypt_attachment:
+                thumbnail_data, decryption_info = encrypt_attachment(thumbnail_data)
+                upload_mime_type = "application/octet-stream"
+            try:
+                url = await intent.upload_media(thumbnail_data, mime_type=upload_mime_type)
+            except Exception:
+                cls.log.warning("Failed to upload thumbnail", exc_info=True)
+                return
+            if decryption_info:
+                decryption_info.url = url
+            thumbnail_info = ThumbnailInfo(
+                mimetype=thumbnail.mimetype,
+                size=len(thumbnail.data),
+                width=thumbnail.width,
+                height=thumbnail.height,
+            )
+            uploaded = (url, decryption_info, thumbnail_info, thumbnail.blurhash)
+            cls._thumbnail_cache[cache_key] = uploaded
+            if len(cls._thumbnail_cache) > cls._thumbnail_cache_size:
+                cls._thumbnail_cache.popitem(last=False)
+        else:
+            cls._thumbnail_cache.move_to_end(cache_key)
+
+        url, decryption_info, info.thumbnail_info, blurhash = uploaded
+        if decryption_info:
+            info.thumbnail_file = decryption_info
+        else:
+            info.thumbnail_url = url
+        if blurhash:
+            info["xyz.amorgan.blurhash"] = blurhash
+
     async def handle_linkedin_reaction_add(
         self, source: "u.User", sender: "p.Puppet", event: RealTimeEventStreamEvent
     ):
@@ -1712,11 +2293,11 @@ class Portal(DBPortal, BasePortal):
 
         message = await DBMessage.get_by_li_message_urn(event.event_urn, self.li_receiver_urn)
         if not message:
-            self.log.debug(f"Ignoring reaction to unknown message {event.event_urn}")
+            self.log.debug("Ignoring reaction to unknown message %s", event.event_urn)
             return
 
         mxid = await intent.react(message.mx_room, message.mxid, reaction)
-        self.log.debug(f"Reacted to {message.mxid}, got {mxid}")
+        self.log.debug("Reacted to %s, got %s", message.mxid, mxid)
 
         await DBReaction(
             mxid=mxid,
@@ -1762,13 +2343,30 @@ class Portal(DBPortal, BasePortal):
     async def handle_linkedin_seen_receipt(
         self, source: "u.User", sender: "p.Puppet", event: RealTimeEventStreamEvent
     ):
+        if not self.mxid or not event.seen_receipt:
+            return
+        await self._linkedin_read_receipts.submit(
+            (sender.mxid, self.mxid), (sender, self, event.seen_receipt.event_urn)
+        )
+
+    @classmethod
+    async def _send_linkedin_seen_receipt(
+        cls,
+        key: tuple[UserID, RoomID],
+        value: tuple["p.Puppet", "Portal", URN],
+    ):
+        sender, portal, li_message_urn = value
         if messages := await DBMessage.get_all_by_li_message_urn(
-            event.seen_receipt.event_urn, self.li_receiver_urn
+            li_message_urn, portal.li_receiver_urn
         ):
             messages.sort(key=lambda m: m.index)
-            await sender.intent.mark_read(self.mxid, messages[-1].mxid)
+            await sender.intent.mark_read(portal.mxid, messages[-1].mxid)
 
     async def handle_linkedin_typing(self, sender: "p.Puppet"):
-        await sender.intent.set_typing(self.mxid)
+        if not self.mxid:
+            return
+        if not self._linkedin_typing.should_send((sender.mxid, self.mxid)):
+            return
+        await sender.intent.set_typing(self.mxid, timeout=self._linkedin_typing_timeout)
 
     # endregion
@@ -1,6 +1,7 @@
 from __future__ import annotations
 
-from typing import TYPE_CHECKING, AsyncGenerator, AsyncIterable, Awaitable, cast
+from typing import TYPE_CHECKING, AsyncGenerator, AsyncIterable, Awaitable, Iterable, cast
+from contextlib import AsyncExitStack
 from datetime import datetime
 import re
 
@@ -18,6 +19,7 @@ from mautrix.util.simple_template import SimpleTemplate
 from . import matrix as m, portal as p, user as u
 from .config import Config
 from .db import Puppet as DBPuppet
+from .util import IdentityMap, offloader
 
 if TYPE_CHECKING:
     from .__main__ import LinkedInBridge
@@ -30,8 +32,9 @@ class Puppet(DBPuppet, BasePuppet):
     hs_domain: str
     mxid_template: SimpleTemplate[str]
 
-    by_li_member_urn: dict[URN, "Puppet"] = {}
+    by_li_member_urn: IdentityMap[URN, "Puppet"] = IdentityMap()
     by_custom_mxid: dict[UserID, "Puppet"] = {}
+    max_cached: int = 0
 
     session: aiohttp.ClientSession
 
@@ -98,6 +101,7 @@ class Puppet(DBPuppet, BasePuppet):
             for server, secret in cls.config["bridge.login_shared_secret_map"].items()
         }
         cls.login_device_name = "LinkedIn Messages Bridge"
+        cls.max_cached = cls.config["bridge.cache_limits.puppets"]
         cls.session = aiohttp.ClientSession()
 
         return (puppet.try_start() async for puppet in Puppet.get_all_with_custom_mxid())
@@ -170,7 +174,7 @@ class Puppet(DBPuppet, BasePuppet):
                 raise Exception(f"Couldn't download avatar for {self.li_member_urn}: {url}")
 
             image_data = await req.content.read()
-            mime = magic.from_buffer(image_data, mime=True)
+            mime = await offloader.run(len(image_data), magic.from_buffer, image_data, True)
             return await intent.upload_media(
                 image_data, mime_type=mime, async_upload=self.config["homeserver.async_media"]
             )
@@ -249,6 +253,27 @@ class Puppet(DBPuppet, BasePuppet):
         if self.custom_mxid:
             self.by_custom_mxid[self.custom_mxid] = self
 
+    def _can_evict(self) -> bool:
+        # Double puppets have a running syncer, so they always stay in memory.
+        if self.custom_mxid:
+            return False
+        lock = self._async_get_locks.get((self.li_member_urn,))
+        return not lock or not lock.locked()
+
+    @classmethod
+    def evict_idle(cls) -> int:
+        """
+        Drop the least recently used puppets from the cache until there are at most
+        ``max_cached`` left. Evicted puppets are loaded from the database again the next time
+        they're needed.
+
+        :returns: the number of evicted puppets.
+        """
+        evicted = cls.by_li_member_urn.evict(cls.max_cached, lambda puppet: puppet._can_evict())
+        for puppet in evicted:
+            cls._async_get_locks.pop((puppet.li_member_urn,), None)
+        return len(evicted)
+
     @classmethod
     @async_getter_lock
     async def get_by_li_member_urn(
@@ -275,6 +300,59 @@ class Puppet(DBPuppet, BasePuppet):
 
         return None
 
+    @classmethod
+    async def get_many_by_li_member_urn(
+        cls,
+        li_member_urns: Iterable[URN],
+        *,
+        create: bool = True,
+    ) -> dict[URN, Puppet]:
+        """
+        Get the puppets for all of the given URNs with one query for the ones that aren't cached,
+        and one bulk insert for the ones that don't exist yet if ``create`` is ``True``.
+        """
+        puppets: dict[URN, Puppet] = {}
+        missing: list[URN] = []
+        for li_member_urn in dict.fromkeys(li_member_urns):
+            if puppet := cls.by_li_member_urn.get(li_member_urn):
+                puppets[li_member_urn] = puppet
+            else:
+                missing.append(li_member_urn)
+        if not missing:
+            return puppets
+
+        async with AsyncExitStack() as stack:
+            # Take the same locks as get_by_li_member_urn, in a consistent order so that
+            # concurrent bulk lookups can't deadlock each other.
+            for li_member_urn in sorted(missing, key=lambda urn: urn.id_str()):
+                await stack.enter_async_context(cls._async_get_locks[(li_member_urn,)])
+
+            # Another lookup may have loaded some of them while we were waiting for the locks.
+            to_fetch = []
+            for li_member_urn in missing:
+                if puppet := cls.by_li_member_urn.get(li_member_urn):
+                    puppets[li_member_urn] = puppet
+                else:
+                    to_fetch.append(li_member_urn)
+
+            for puppet in cast(list[Puppet], await super().get_many_by_li_member_urn(to_fetch)):
+                puppet._add_to_cache()
+                puppets[puppet.li_member_urn] = puppet
+
+            if create:
+                new_puppets = [
+                    cls(li_member_urn, None, None, None, False, False)
+                    for li_member_urn in to_fetch
+                    if li_member_urn not in puppets
+                ]
+                if new_puppets:
+                    await cls.bulk_insert(cast(list[DBPuppet], new_puppets))
+                    for puppet in new_puppets:
+                        puppet._add_to_cache()
+                        puppets[puppet.li_member_urn] = puppet
+
+        return puppets
+
     @classmethod
     async def get_by_mxid(cls, mxid: UserID, create: bool = True) -> Puppet | None:
         li_member_urn = cls.get_id_from_mxid(mxid)
@@ -0,0 +1,70 @@
+from typing import Any
+import asyncio
+
+from aiohttp import web
+from yarl import URL
+
+from .analytics import AnalyticsQueue
+
+
+def test_batches_and_retries():
+    async def run() -> tuple[list[list[str]], list[dict[str, Any]]]:
+        batches = []
+        failures = 1
+
+        async def batch(request: web.Request) -> web.Response:
+            nonlocal failures
+            if failures:
+                failures -= 1
+                return web.Response(status=503)
+            batches.append([event["event"] for event in (await request.json())["batch"]])
+            return web.json_response({})
+
+        app = web.Application()
+        app.router.add_post("/v1/batch", batch)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+
+        queue = AnalyticsQueue()
+        queue.configure(
+            URL(f"http://127.0.0.1:{port}/v1/batch"),
+            "token",
+            batch_size=2,
+            flush_interval=60,
+            max_queue=4,
+        )
+        try:
+            for i in range(4):
+                queue.track("@user:example.com", f"event-{i}", {})
+            # The first attempt fails and is retried after a second, and the flush sends
+            # everything that was queued in the meantime.
+            await asyncio.sleep(1.5)
+            queue.track("@user:example.com", "event-4", {})
+            await queue.stop()
+            queue.track("@user:example.com", "after-stop", {})
+        finally:
+            await runner.cleanup()
+        return batches, queue._queue
+
+    batches, remaining = asyncio.run(run())
+    assert batches == [["event-0", "event-1"], ["event-2", "event-3"], ["event-4"]]
+    assert remaining == []
+
+
+def test_overflow_drops_new_events():
+    async def run() -> list[str]:
+        queue = AnalyticsQueue()
+        queue.configure(
+            URL("http://127.0.0.1:9/v1/batch"), "token", flush_interval=60, max_queue=2
+        )
+        for i in range(3):
+            queue.track("@user:example.com", f"event-{i}", {})
+        queued = [event["event"] for event in queue._queue]
+        queue._queue = []
+        await queue.stop()
+        return queued
+
+    assert asyncio.run(run()) == ["event-0", "event-1"]
@@ -0,0 +1,52 @@
+import asyncio
+
+from linkedin_messaging import URN
+from linkedin_messaging.api_objects import Conversation
+from mautrix.bridge import NotificationDisabler
+from mautrix.types import RoomID, UserID
+from mautrix.util.async_db import Database
+
+from .db import init, upgrade_table
+from .portal import Portal
+from .puppet import Puppet
+
+
+class StubUser:
+    mxid = UserID("@user:example.com")
+    li_member_urn = URN("urn:li:fsd_profile:user")
+    client = object()
+
+
+def test_portal_can_be_evicted_after_backfill() -> None:
+    async def run() -> tuple[int, bool]:
+        db = Database.create("sqlite::memory:", upgrade_table=upgrade_table)
+        await db.start()
+        init(db)
+        NotificationDisabler.puppet_cls = Puppet
+        try:
+            portal, other = (
+                Portal(
+                    URN(f"urn:li:msg_conversation:{name}"),
+                    URN("urn:li:fsd_profile:user"),
+                    li_is_group_chat=False,
+                    mxid=RoomID(f"!{name}:example.com"),
+                )
+                for name in ("backfilled", "other")
+            )
+            for cached in (portal, other):
+                Portal.by_li_thread_urn[cached.li_thread_urn, cached.li_receiver_urn] = cached
+                Portal.by_mxid[cached.mxid] = cached
+            Portal.max_cached = 1
+
+            conversation = Conversation(entity_urn=portal.li_thread_urn)
+            await portal._backfill(StubUser(), 0, None, conversation)  # type: ignore[arg-type]
+            return Portal.evict_idle(), portal.mxid in Portal.by_mxid
+        finally:
+            Portal.max_cached = 0
+            Portal.by_li_thread_urn.clear()
+            Portal.by_mxid.clear()
+            await db.stop()
+
+    evicted, still_cached = asyncio.run(run())
+    assert evicted == 1
+    assert not still_cached
@@ -3,7 +3,11 @@ from __future__ import annotations
 from typing import TYPE_CHECKING, AsyncGenerator, AsyncIterable, Awaitable, Optional, cast
 from asyncio.futures import Future
 from datetime import datetime
+from functools import partial
+from pathlib import Path
 import asyncio
+import json
+import re
 import sys
 import time
 
@@ -26,7 +30,16 @@ from mautrix.util.simple_lock import SimpleLock
 
 from . import portal as po, puppet as pu
 from .config import Config
-from .db import Cookie, HttpHeader, User as DBUser
+from .db import Cookie, HttpHeader, OutboxMessage as DBOutboxMessage, User as DBUser
+from .util import (
+    LINKEDIN_TO_MATRIX,
+    EventJournal,
+    LagTrace,
+    current_trace,
+    lag_stage,
+    set_trace,
+    task_registry,
+)
 
 if TYPE_CHECKING:
     from .__main__ import LinkedInBridge
@@ -35,6 +48,10 @@ METRIC_CONNECTED = Gauge("bridge_connected", "Bridge users connected to LinkedIn
 METRIC_LOGGED_IN = Gauge("bridge_logged_in", "Users logged into the bridge")
 METRIC_SYNC_THREADS = Summary("bridge_sync_threads", "calls to sync_threads")
 
+# The thread ID inside event and conversation URNs, used to key journal entries by chat.
+JOURNAL_THREAD_RE = re.compile(r'urn:li:fs_(?:event|conversation):\(?([^,)"]+)')
+DECORATED_EVENT_KEY = "com.linkedin.realtimefrontend.DecoratedEvent"
+
 
 class User(DBUser, BaseUser):
     shutdown: bool = False
@@ -57,6 +74,8 @@ class User(DBUser, BaseUser):
     is_admin: bool
 
     client: LinkedInMessaging | None = None
+    journal: EventJournal | None
+    _journal_offset: int | None
 
     def __init__(
         self,
@@ -91,6 +110,8 @@ class User(DBUser, BaseUser):
         self.log = self.log.getChild(self.mxid)
 
         self.listen_task = None
+        self.journal = None
+        self._journal_offset = None
 
     @classmethod
     def init_cls(cls, bridge: LinkedInBridge) -> AsyncIterable[Awaitable[bool]]:
@@ -186,6 +207,14 @@ class User(DBUser, BaseUser):
 
     # region Session Management
 
+    @staticmethod
+    def _create_client(
+        cookies: dict[str, str], headers: Optional[dict[str, str]]
+    ) -> LinkedInMessaging:
+        client = LinkedInMessaging.from_cookies_and_headers(cookies, headers)
+        client.task_factory = partial(task_registry.create, "heartbeat")
+        return client
+
     async def load_session(self, is_startup: bool = False) -> bool:
         if self._is_logged_in and is_startup:
             return True
@@ -195,7 +224,7 @@ class User(DBUser, BaseUser):
             await self.push_bridge_state(BridgeStateEvent.BAD_CREDENTIALS, error="logged-out")
             return False
 
-        self.client = LinkedInMessaging.from_cookies_and_headers(
+        self.client = self._create_client(
             {c.name: c.value for c in cookies},
             {h.name: h.value for h in await HttpHeader.get_for_mxid(self.mxid)},
         )
@@ -211,7 +240,7 @@ class User(DBUser, BaseUser):
                 return False
             except Exception as e:
                 self.log.exception("Failed to get user profile")
-                time.sleep(backoff)
+                await asyncio.sleep(backoff)
                 backoff *= 2
                 if backoff > 64:
                     # If we can't get the user profile and it's not due to the session being
@@ -232,7 +261,7 @@ class User(DBUser, BaseUser):
         self._is_logged_in = True
         self.is_connected = None
         self.stop_listen()
-        asyncio.create_task(self.post_login())
+        task_registry.create("post_login", self.post_login())
         return True
 
     async def reconnect(self):
@@ -263,7 +292,7 @@ class User(DBUser, BaseUser):
         await Cookie.bulk_upsert(self.mxid, cookies)
         if headers:
             await HttpHeader.bulk_upsert(self.mxid, headers)
-        self.client = LinkedInMessaging.from_cookies_and_headers(cookies, headers)
+        self.client = self._create_client(cookies, headers)
         self.listener_event_handlers_created = False
         self.user_profile_cache = await self.client.get_user_profile()
         if (mp := self.user_profile_cache.mini_profile) and mp.entity_urn:
@@ -292,6 +321,15 @@ class User(DBUser, BaseUser):
         await self._create_or_update_space()
         await self.sync_threads()
         self.start_listen()
+        await self._resume_outbox()
+
+    async def _resume_outbox(self):
+        if not po.Portal.outbox_enabled:
+            return
+        for room_id in await DBOutboxMessage.get_rooms_by_sender(self.mxid):
+            portal = await po.Portal.get_by_mxid(room_id)
+            if portal:
+                portal.wake_outbox()
 
     async def logout(self):
         self.log.info("Logging out")
@@ -531,7 +569,9 @@ class User(DBUser, BaseUser):
             ):
                 self._track_metric(METRIC_CONNECTED, False)
                 self.log.warn("Logged out, but not by a logout call, sending bad credentials.")
-                asyncio.create_task(self.push_bridge_state(BridgeStateEvent.BAD_CREDENTIALS))
+                task_registry.create(
+                    "bridge_state", self.push_bridge_state(BridgeStateEvent.BAD_CREDENTIALS)
+                )
             future.cancel()
 
     listener_event_handlers_created: bool = False
@@ -559,7 +599,12 @@ class User(DBUser, BaseUser):
             self.client.add_event_listener("reactionAdded", self.handle_linkedin_reaction_added)
             self.client.add_event_listener("action", self.handle_linkedin_action)
             self.client.add_event_listener("fromEntity", self.handle_linkedin_from_entity)
+            self.client.add_event_listener(
+                "ALL_EVENTS_PROCESSED", self.handle_linkedin_stream_event_processed
+            )
             self.listener_event_handlers_created = True
+        if self.config["bridge.event_journal.enabled"] and not self.journal:
+            await self._open_journal()
         try:
             await self.client.start_listener(self.li_member_urn)
             # Make sure all of the cookies are up-to-date
@@ -594,10 +639,57 @@ class User(DBUser, BaseUser):
         else:
             self.log.trace("Event received on event stream, but not sending CONNECTED")
 
-    async def handle_linkedin_stream_event(self, _):
+    async def handle_linkedin_stream_event(self, data: dict):
         self._track_metric(METRIC_CONNECTED, True)
+        # Listeners run in the listener task, so the trace is current until the event has been
+        # processed.
+        set_trace(LagTrace(LINKEDIN_TO_MATRIX, "realtime"))
+        if self.journal and DECORATED_EVENT_KEY in data:
+            raw = json.dumps(data)
+            match = JOURNAL_THREAD_RE.search(raw)
+            self._journal_offset = await self.journal.append(
+                raw.encode("utf-8"), key=match.group(1) if match else ""
+            )
         await self._push_connected_state()
 
+    async def handle_linkedin_stream_event_processed(self, _):
+        set_trace(None)
+        if self.journal and self._journal_offset is not None:
+            self.journal.ack(self._journal_offset)
+            self._journal_offset = None
+
+    async def _open_journal(self):
+        directory = Path(self.config["bridge.event_journal.directory"]) / re.sub(
+            r"[^A-Za-z0-9_.-]", "_", self.mxid
+        )
+        try:
+            self.journal = EventJournal(
+                directory,
+                segment_size=self.config["bridge.event_journal.segment_size"],
+                fsync=self.config["bridge.event_journal.fsync"],
+            )
+        except OSError:
+            self.log.exception(f"Failed to open event journal in {directory}")
+            return
+        # Events that were received but not fully handled before the bridge stopped are handled
+        # now. Handlers ignore events that were already bridged, so replaying is safe.
+        replayed = 0
+        for record in self.journal.replay():
+            try:
+                await self.client.replay_event(json.loads(record.payload))
+            except Exception:
+                self.log.exception(f"Failed to replay journal entry {record.offset}")
+            self.journal.ack(record.offset)
+            replayed += 1
+        if replayed:
+            self.log.info(f"Replayed {replayed} events from the event journal")
+            self.journal.checkpoint()
+
+    def close_journal(self):
+        if self.journal:
+            self.journal.close()
+            self.journal = None
+
     async def handle_linkedin_event(self, event: RealTimeEventStreamEvent):
         assert self.client
         assert isinstance(event.event, ConversationEvent)
@@ -615,9 +707,13 @@ class User(DBUser, BaseUser):
         else:
             raise Exception("Invalid sender: no entity_urn found!", event)
 
-        portal = await po.Portal.get_by_li_thread_urn(
-            thread_urn, li_receiver_urn=self.li_member_urn, create=False
-        )
+        if trace := current_trace():
+            trace.add("deserialize", time.monotonic() - trace.started)
+
+        with lag_stage("portal_lookup"):
+            portal = await po.Portal.get_by_li_thread_urn(
+                thread_urn, li_receiver_urn=self.li_member_urn, create=False
+            )
         if not portal:
             conversations = await self.client.get_conversations()
             for conversation in conversations.elements:
@@ -629,7 +725,8 @@ class User(DBUser, BaseUser):
             # in.
             return
 
-        puppet = await pu.Puppet.get_by_li_member_urn(sender_urn)
+        with lag_stage("portal_lookup"):
+            puppet = await pu.Puppet.get_by_li_member_urn(sender_urn)
 
         await portal.backfill_lock.wait(message_urn)
         await portal.handle_linkedin_message(self, puppet, event.event)
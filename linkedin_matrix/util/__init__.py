@@ -0,0 +1,54 @@
+from .coalesce import Debouncer, LatestValueCoalescer
+from .identity_map import IdentityMap, approximate_size
+from .image_size import get_image_size
+from .journal import EventJournal, JournalRecord, read_journal
+from .lag import (
+    LINKEDIN_TO_MATRIX,
+    MATRIX_TO_LINKEDIN,
+    LagTrace,
+    current_trace,
+    lag_stage,
+    set_trace,
+    traced,
+)
+from .media_stream import AttachmentDecryptor, decrypt_stream, iter_media
+from .offload import Offloader, monitor_loop_lag, offloader
+from .resources import get_peak_rss, get_rss
+from .sampled_log import LogSampler
+from .tasks import TaskRegistry, task_registry
+from .thumbnail import Thumbnail, Thumbnailer, content_hash, thumbnailer
+from .watchdog import LoopWatchdog
+
+__all__ = (
+    "LINKEDIN_TO_MATRIX",
+    "MATRIX_TO_LINKEDIN",
+    "AttachmentDecryptor",
+    "Debouncer",
+    "EventJournal",
+    "IdentityMap",
+    "JournalRecord",
+    "LagTrace",
+    "LatestValueCoalescer",
+    "LogSampler",
+    "LoopWatchdog",
+    "Offloader",
+    "TaskRegistry",
+    "Thumbnail",
+    "Thumbnailer",
+    "approximate_size",
+    "content_hash",
+    "current_trace",
+    "decrypt_stream",
+    "get_image_size",
+    "get_peak_rss",
+    "get_rss",
+    "iter_media",
+    "lag_stage",
+    "monitor_loop_lag",
+    "offloader",
+    "read_journal",
+    "set_trace",
+    "task_registry",
+    "thumbnailer",
+    "traced",
+)
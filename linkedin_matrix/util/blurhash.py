@@ -0,0 +1,88 @@
+from __future__ import annotations
+
+from typing import Sequence
+import math
+
+_CHARACTERS = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz#$%*+,-.:;=?@[]^_{|}~"
+
+
+def _encode83(value: int, length: int) -> str:
+    return "".join(_CHARACTERS[(value // 83 ** (length - i - 1)) % 83] for i in range(length))
+
+
+def _srgb_to_linear(value: int) -> float:
+    v = value / 255
+    return v / 12.92 if v <= 0.04045 else ((v + 0.055) / 1.055) ** 2.4
+
+
+def _linear_to_srgb(value: float) -> int:
+    v = max(0.0, min(1.0, value))
+    if v <= 0.0031308:
+        return int(v * 12.92 * 255 + 0.5)
+    return int((1.055 * v ** (1 / 2.4) - 0.055) * 255 + 0.5)
+
+
+def _sign_pow(value: float, exp: float) -> float:
+    return math.copysign(abs(value) ** exp, value)
+
+
+def encode_blurhash(
+    pixels: Sequence[tuple[int, int, int]],
+    width: int,
+    height: int,
+    x_components: int = 4,
+    y_components: int = 3,
+) -> str:
+    """
+    Encode an image as a `BlurHash <https://blurha.sh>`_ string.
+
+    :param pixels: The RGB pixels of the image in row-major order. This is O(pixels *
+                   components), so the image should be scaled down to something like 32x32
+                   first.
+    """
+    if not 1 <= x_components <= 9 or not 1 <= y_components <= 9:
+        raise ValueError("Blurhash components must be between 1 and 9")
+    if len(pixels) != width * height:
+        raise ValueError("Pixel count doesn't match the image size")
+
+    linear = [tuple(_srgb_to_linear(c) for c in pixel) for pixel in pixels]
+    cos_x = [
+        [math.cos(math.pi * i * x / width) for x in range(width)] for i in range(x_components)
+    ]
+    cos_y = [
+        [math.cos(math.pi * j * y / height) for y in range(height)] for j in range(y_components)
+    ]
+    factors = []
+    for j in range(y_components):
+        for i in range(x_components):
+            normalisation = 1 if i == 0 and j == 0 else 2
+            r = g = b = 0.0
+            for y in range(height):
+                row = y * width
+                for x in range(width):
+                    basis = cos_x[i][x] * cos_y[j][y]
+                    pr, pg, pb = linear[row + x]
+                    r += basis * pr
+                    g += basis * pg
+                    b += basis * pb
+            scale = normalisation / (width * height)
+            factors.append((r * scale, g * scale, b * scale))
+
+    dc, ac = factors[0], factors[1:]
+    result = _encode83((x_components - 1) + (y_components - 1) * 9, 1)
+    if ac:
+        actual_max = max(abs(c) for factor in ac for c in factor)
+        quantised_max = max(0, min(82, int(actual_max * 166 - 0.5)))
+        maximum = (quantised_max + 1) / 166
+        result += _encode83(quantised_max, 1)
+    else:
+        maximum = 1
+        result += _encode83(0, 1)
+    r, g, b = (_linear_to_srgb(c) for c in dc)
+    result += _encode83((r << 16) + (g << 8) + b, 4)
+    for factor in ac:
+        qr, qg, qb = (
+            max(0, min(18, int(math.floor(_sign_pow(c / maximum, 0.5) * 9 + 9.5)))) for c in factor
+        )
+        result += _encode83(qr * 19 * 19 + qg * 19 + qb, 2)
+    return result
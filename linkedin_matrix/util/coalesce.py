@@ -0,0 +1,107 @@
+from __future__ import annotations
+
+from typing import Awaitable, Callable, Generic, Hashable, TypeVar
+import asyncio
+import logging
+import time
+
+from mautrix.util import background_task
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class Debouncer(Generic[K]):
+    """
+    Suppresses repeated notifications for the same key within a time window.
+
+    This is used for typing notifications: the first notification for a key is forwarded, and
+    repeats are dropped until ``window`` seconds have passed.
+    """
+
+    window: float
+    max_size: int
+    _last_sent: dict[K, float]
+
+    def __init__(self, window: float, max_size: int = 10000):
+        self.window = window
+        self.max_size = max_size
+        self._last_sent = {}
+
+    def should_send(self, key: K) -> bool:
+        if self.window <= 0:
+            return True
+        now = time.monotonic()
+        last_sent = self._last_sent.get(key)
+        if last_sent is not None and now - last_sent < self.window:
+            return False
+        if len(self._last_sent) >= self.max_size:
+            self._last_sent = {
+                k: sent for k, sent in self._last_sent.items() if now - sent < self.window
+            }
+        self._last_sent[key] = now
+        return True
+
+    def reset(self, key: K):
+        self._last_sent.pop(key, None)
+
+
+class LatestValueCoalescer(Generic[K, V]):
+    """
+    Delays calls to ``callback`` by ``delay`` seconds per key, and only calls it with the most
+    recent value that was submitted for the key during that time.
+    """
+
+    delay: float
+    callback: Callable[[K, V], Awaitable[None]]
+    log: logging.Logger
+    _pending: dict[K, V]
+    _tasks: dict[K, asyncio.Task]
+
+    def __init__(
+        self,
+        delay: float,
+        callback: Callable[[K, V], Awaitable[None]],
+        log: logging.Logger,
+    ):
+        self.delay = delay
+        self.callback = callback
+        self.log = log
+        self._pending = {}
+        self._tasks = {}
+
+    async def submit(self, key: K, value: V):
+        if self.delay <= 0:
+            await self.callback(key, value)
+            return
+        self._pending[key] = value
+        if key not in self._tasks:
+            coro = self._send_later(key)
+            task = self._tasks[key] = background_task.create(coro)
+            # flush() may cancel the task before it starts, which would leave the coroutine
+            # unawaited
+            task.add_done_callback(lambda _: coro.close())
+
+    async def _send_later(self, key: K):
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            self._tasks.pop(key, None)
+        await self._send(key)
+
+    async def _send(self, key: K):
+        try:
+            value = self._pending.pop(key)
+        except KeyError:
+            return
+        try:
+            await self.callback(key, value)
+        except Exception:
+            self.log.exception(f"Failed to send coalesced value for {key}")
+
+    async def flush(self):
+        for task in self._tasks.values():
+            task.cancel()
+        self._tasks.clear()
+        for key in list(self._pending.keys()):
+            await self._send(key)
@@ -0,0 +1,67 @@
+from __future__ import annotations
+
+from typing import Any, Callable, Hashable, Iterable, TypeVar
+from collections import OrderedDict
+import sys
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class IdentityMap(OrderedDict[K, V]):
+    """
+    A cache dict that keeps its entries in least recently used order. Reading an entry with
+    ``[]`` or :meth:`get` marks it as used, iterating over the map doesn't.
+    """
+
+    def __getitem__(self, key: K) -> V:
+        value = super().__getitem__(key)
+        self.move_to_end(key)
+        return value
+
+    def get(self, key: K, default: Any = None) -> Any:
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def touch(self, key: K):
+        if key in self:
+            self.move_to_end(key)
+
+    def evict(self, max_size: int, can_evict: Callable[[V], bool]) -> list[V]:
+        """
+        Remove least recently used entries until at most ``max_size`` are left, skipping entries
+        for which ``can_evict`` returns ``False``.
+
+        :returns: the removed values.
+        """
+        excess = len(self) - max_size
+        if max_size <= 0 or excess <= 0:
+            return []
+        evicted: list[tuple[K, V]] = []
+        for key, value in self.items():
+            if len(evicted) >= excess:
+                break
+            if can_evict(value):
+                evicted.append((key, value))
+        for key, _ in evicted:
+            del self[key]
+        return [value for _, value in evicted]
+
+
+def approximate_size(objects: Iterable[Any], sample_size: int = 100) -> int:
+    """
+    Estimate the memory used by ``objects`` from the shallow size of a sample of them and of
+    their attributes.
+    """
+    objects = list(objects)
+    if not objects:
+        return 0
+    sample = objects[:: max(len(objects) // sample_size, 1)][:sample_size]
+    total = 0
+    for obj in sample:
+        total += sys.getsizeof(obj)
+        attrs = getattr(obj, "__dict__", {})
+        total += sys.getsizeof(attrs) + sum(sys.getsizeof(value) for value in attrs.values())
+    return total * len(objects) // len(sample)
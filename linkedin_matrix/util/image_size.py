@@ -0,0 +1,84 @@
+from __future__ import annotations
+
+import struct
+
+# Start of frame markers, which carry the image dimensions. 0xC4 (DHT), 0xC8 (JPG) and 0xCC
+# (DAC) are in the same range but aren't frames.
+_JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def _png_size(data: bytes) -> tuple[int, int] | None:
+    # The IHDR chunk is always first: 8 byte signature, 4 byte length, 4 byte type, then the
+    # width and height as big-endian 32-bit integers.
+    if len(data) < 24 or data[12:16] != b"IHDR":
+        return None
+    return struct.unpack(">II", data[16:24])
+
+
+def _gif_size(data: bytes) -> tuple[int, int] | None:
+    if len(data) < 10:
+        return None
+    return struct.unpack("<HH", data[6:10])
+
+
+def _jpeg_size(data: bytes) -> tuple[int, int] | None:
+    i = 2
+    while i + 9 <= len(data):
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF:
+            # Fill byte
+            i += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD9:
+            # Standalone markers without a length
+            i += 2
+            continue
+        (length,) = struct.unpack(">H", data[i + 2 : i + 4])
+        if marker in _JPEG_SOF_MARKERS:
+            height, width = struct.unpack(">HH", data[i + 5 : i + 9])
+            return width, height
+        i += 2 + length
+    return None
+
+
+def _webp_size(data: bytes) -> tuple[int, int] | None:
+    chunk = data[12:16]
+    if chunk == b"VP8 " and len(data) >= 30 and data[23:26] == b"\x9d\x01\x2a":
+        width, height = struct.unpack("<HH", data[26:30])
+        return width & 0x3FFF, height & 0x3FFF
+    elif chunk == b"VP8L" and len(data) >= 25 and data[20] == 0x2F:
+        (bits,) = struct.unpack("<I", data[21:25])
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    elif chunk == b"VP8X" and len(data) >= 30:
+        width = int.from_bytes(data[24:27], "little") + 1
+        height = int.from_bytes(data[27:30], "little") + 1
+        return width, height
+    return None
+
+
+def get_image_size(data: bytes) -> tuple[int, int] | None:
+    """
+    Get the width and height of a PNG, JPEG, GIF or WebP image by reading its header, without
+    decoding the image.
+
+    :returns: ``(width, height)``, or ``None`` if the format isn't supported or the header is
+              malformed.
+    """
+    try:
+        if data.startswith(b"\x89PNG\r\n\x1a\n"):
+            size = _png_size(data)
+        elif data.startswith(b"\xff\xd8"):
+            size = _jpeg_size(data)
+        elif data[:6] in (b"GIF87a", b"GIF89a"):
+            size = _gif_size(data)
+        elif data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+            size = _webp_size(data)
+        else:
+            return None
+    except struct.error:
+        return None
+    if not size or not size[0] or not size[1]:
+        return None
+    return size
@@ -0,0 +1,282 @@
+from __future__ import annotations
+
+from typing import Iterator, NamedTuple
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+import asyncio
+import json
+import logging
+import mmap
+import os
+import struct
+import zlib
+
+# Each record is: payload length, CRC32 of key + payload, offset, key length, key, payload.
+_HEADER = struct.Struct("<IIQH")
+_SEGMENT_SUFFIX = ".log"
+_CHECKPOINT_FILE = "checkpoint.json"
+
+
+class JournalRecord(NamedTuple):
+    offset: int
+    key: str
+    payload: bytes
+
+
+def _segment_path(directory: Path, first_offset: int) -> Path:
+    return directory / f"{first_offset:020d}{_SEGMENT_SUFFIX}"
+
+
+def _list_segments(directory: Path) -> list[tuple[int, Path]]:
+    segments = []
+    for path in directory.glob(f"*{_SEGMENT_SUFFIX}"):
+        try:
+            segments.append((int(path.stem), path))
+        except ValueError:
+            continue
+    return sorted(segments)
+
+
+def _read_segment(path: Path) -> Iterator[tuple[int, JournalRecord]]:
+    """Yield the valid records of a segment with their end positions, stopping at a torn tail."""
+    with path.open("rb") as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            pos = 0
+            while pos + _HEADER.size <= len(data):
+                length, crc, offset, key_length = _HEADER.unpack_from(data, pos)
+                start = pos + _HEADER.size
+                end = start + key_length + length
+                if end > len(data):
+                    return
+                body = data[start:end]
+                if zlib.crc32(body) != crc:
+                    return
+                yield end, JournalRecord(
+                    offset, body[:key_length].decode("utf-8"), bytes(body[key_length:])
+                )
+                pos = end
+
+
+def read_journal(directory: str | Path) -> Iterator[JournalRecord]:
+    """
+    Read every record in a journal directory in order, whether it has been acknowledged or not.
+    This can be used to replay recorded event streams, for example in benchmarks.
+    """
+    for _, path in _list_segments(Path(directory)):
+        for _, record in _read_segment(path):
+            yield record
+
+
+class EventJournal:
+    """
+    An append-only journal of raw events, stored in numbered segment files.
+
+    Every record gets an increasing offset and a key (the chat it belongs to). Once a record has
+    been processed, it's acknowledged with :meth:`ack`. Records with the same key must be
+    acknowledged in order, but different keys may be processed concurrently. The journal
+    remembers the highest acknowledged offset per key and the offset below which everything has
+    been acknowledged, and deletes segments that only contain acknowledged records. After a
+    crash, :meth:`replay` returns the records that weren't acknowledged yet.
+
+    The acknowledgement checkpoint is only written every ``checkpoint_interval`` acks, so some
+    records may be replayed twice after a crash. Consumers need to ignore duplicates.
+
+    All file I/O after opening happens in a single writer thread, in the order it was requested,
+    so that writes and fsyncs don't block the event loop. Records that are appended while a write
+    is in progress are written together with one fsync.
+    """
+
+    log: logging.Logger = logging.getLogger("mau.journal")
+
+    def __init__(
+        self,
+        directory: str | Path,
+        segment_size: int = 16 * 1024 * 1024,
+        fsync: bool = False,
+        checkpoint_interval: int = 100,
+    ):
+        self.directory = Path(directory)
+        self.segment_size = segment_size
+        self.fsync = fsync
+        self.checkpoint_interval = max(checkpoint_interval, 1)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+        self._acked_below = 0
+        self._acked_keys: dict[str, int] = {}
+        self._load_checkpoint()
+        self._in_flight: dict[int, str] = {}
+        self._acks_since_checkpoint = 0
+
+        self._segments = _list_segments(self.directory)
+        self._next_offset = self._acked_below + 1
+        self._fd: int | None = None
+        self._segment_bytes = 0
+        if self._segments:
+            self._recover_tail(self._segments[-1][1])
+
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="journal")
+        self._pending: list[tuple[int, bytes]] = []
+        self._pending_written: asyncio.Future[None] | None = None
+        self._write_task: asyncio.Task | None = None
+        self._closed = False
+
+    def _load_checkpoint(self):
+        try:
+            with (self.directory / _CHECKPOINT_FILE).open() as file:
+                checkpoint = json.load(file)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError):
+            self.log.warning("Failed to read journal checkpoint, replaying everything")
+            return
+        self._acked_below = checkpoint.get("acked_below", 0)
+        self._acked_keys = checkpoint.get("keys", {})
+
+    def _recover_tail(self, path: Path):
+        # A crash in the middle of a write leaves a partial record at the end of the last
+        # segment. Cut it off so that new records are appended after the last valid one.
+        valid_end = 0
+        for valid_end, record in _read_segment(path):
+            self._next_offset = max(self._next_offset, record.offset + 1)
+        if valid_end != path.stat().st_size:
+            self.log.warning(f"Truncating torn write at the end of {path.name}")
+            os.truncate(path, valid_end)
+        self._fd = os.open(path, os.O_WRONLY | os.O_APPEND)
+        self._segment_bytes = valid_end
+
+    def _roll(self, first_offset: int):
+        if self._fd is not None:
+            os.close(self._fd)
+        path = _segment_path(self.directory, first_offset)
+        self._fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+        self._segments.append((first_offset, path))
+        self._segment_bytes = 0
+
+    def _write(self, records: list[tuple[int, bytes]]):
+        # Runs in the writer thread. A segment is only rolled between batches, so a large batch
+        # can make it grow past segment_size, like a single large record could.
+        if self._fd is None or self._segment_bytes >= self.segment_size:
+            self._roll(records[0][0])
+        data = b"".join(record for _, record in records)
+        os.write(self._fd, data)
+        if self.fsync:
+            os.fsync(self._fd)
+        self._segment_bytes += len(data)
+
+    async def append(self, payload: bytes, key: str = "") -> int:
+        """
+        Write a record to the journal and return its offset once it has been written (and
+        synced, if ``fsync`` is enabled).
+        """
+        offset = self._next_offset
+        self._next_offset += 1
+        key_bytes = key.encode("utf-8")
+        body = key_bytes + payload
+        record = _HEADER.pack(len(payload), zlib.crc32(body), offset, len(key_bytes)) + body
+        self._in_flight[offset] = key
+
+        if self._pending_written is None:
+            self._pending_written = asyncio.get_running_loop().create_future()
+        written = self._pending_written
+        self._pending.append((offset, record))
+        if not self._write_task or self._write_task.done():
+            self._write_task = asyncio.create_task(self._write_pending())
+        await asyncio.shield(written)
+        return offset
+
+    def _take_pending(self) -> tuple[list[tuple[int, bytes]], asyncio.Future[None] | None]:
+        records, written = self._pending, self._pending_written
+        self._pending, self._pending_written = [], None
+        return records, written
+
+    async def _write_pending(self):
+        loop = asyncio.get_running_loop()
+        while self._pending:
+            records, written = self._take_pending()
+            try:
+                await loop.run_in_executor(self._writer, self._write, records)
+            except Exception as e:
+                if written and not written.done():
+                    written.set_exception(e)
+            else:
+                if written and not written.done():
+                    written.set_result(None)
+
+    def ack(self, offset: int):
+        """Mark a record as processed."""
+        key = self._in_flight.pop(offset, None)
+        if key is None:
+            return
+        if offset > self._acked_keys.get(key, 0):
+            self._acked_keys[key] = offset
+        self._acked_below = min(self._in_flight) - 1 if self._in_flight else self._next_offset - 1
+        self._acks_since_checkpoint += 1
+        if self._acks_since_checkpoint >= self.checkpoint_interval:
+            self.checkpoint()
+
+    def checkpoint(self) -> Future[None]:
+        """
+        Save the acknowledged offsets and delete segments that are no longer needed. This happens
+        in the writer thread; the returned future completes once it's done.
+        """
+        self._acks_since_checkpoint = 0
+        # Keys at or below the global watermark don't need to be remembered separately.
+        self._acked_keys = {
+            key: offset for key, offset in self._acked_keys.items() if offset > self._acked_below
+        }
+        checkpoint = {"acked_below": self._acked_below, "keys": dict(self._acked_keys)}
+        return self._writer.submit(self._write_checkpoint, checkpoint)
+
+    def _write_checkpoint(self, checkpoint: dict):
+        tmp_path = self.directory / f"{_CHECKPOINT_FILE}.tmp"
+        with tmp_path.open("w") as file:
+            json.dump(checkpoint, file)
+            if self.fsync:
+                file.flush()
+                os.fsync(file.fileno())
+        os.replace(tmp_path, self.directory / _CHECKPOINT_FILE)
+        self._compact(checkpoint["acked_below"])
+
+    def _compact(self, acked_below: int):
+        # A segment can be deleted once the next segment starts at or below the watermark + 1.
+        while len(self._segments) > 1 and self._segments[1][0] <= acked_below + 1:
+            _, path = self._segments.pop(0)
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+
+    def replay(self) -> Iterator[JournalRecord]:
+        """
+        Yield the records that haven't been acknowledged, in order. They're tracked as in flight
+        again, so they must be acknowledged with :meth:`ack` once they've been processed.
+        """
+        for _, path in list(self._segments):
+            for _, record in _read_segment(path):
+                if record.offset <= self._acked_below:
+                    continue
+                if record.offset <= self._acked_keys.get(record.key, 0):
+                    continue
+                self._in_flight[record.offset] = record.key
+                yield record
+
+    def close(self):
+        """
+        Write the records that are still queued and a final checkpoint, and wait for the writer
+        thread to finish.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        records, written = self._take_pending()
+        if records:
+            self._writer.submit(self._write, records)
+        self.checkpoint()
+        self._writer.shutdown(wait=True)
+        if written and not written.done():
+            written.set_result(None)
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
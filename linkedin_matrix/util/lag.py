@@ -0,0 +1,106 @@
+from __future__ import annotations
+
+from typing import Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+import time
+
+from mautrix.util.opt_prometheus import Histogram
+
+LINKEDIN_TO_MATRIX = "linkedin_to_matrix"
+MATRIX_TO_LINKEDIN = "matrix_to_linkedin"
+
+METRIC_MESSAGE_LAG = Histogram(
+    "bridge_message_lag_seconds",
+    "Time from a message being sent on one side to the bridge finishing sending it to the other",
+    ["direction", "source"],
+    buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 1800, 3600),
+)
+METRIC_MESSAGE_STAGE = Histogram(
+    "bridge_message_stage_seconds",
+    "Time spent in each stage of bridging a message",
+    ["direction", "source", "stage"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+
+_current_trace: ContextVar[LagTrace | None] = ContextVar("lag_trace", default=None)
+
+
+class LagTrace:
+    """
+    Timings of a single message on its way through the bridge.
+
+    ``origin_ts`` is when the message was sent on the other side (the LinkedIn ``createdAt`` or
+    the Matrix ``origin_server_ts``), in seconds since the epoch. It may be set after the trace
+    was started, since LinkedIn events have to be deserialized first. The time between it and
+    the creation of the trace is recorded as the ``receive`` stage.
+    """
+
+    def __init__(self, direction: str, source: str, origin_ts: float | None = None):
+        self.direction = direction
+        self.source = source
+        self.origin_ts = origin_ts
+        self.received_at = time.time()
+        self.started = time.monotonic()
+        self.stages: dict[str, float] = {}
+        self.delivered_at: float | None = None
+
+    def add(self, stage: str, duration: float):
+        self.stages[stage] = self.stages.get(stage, 0) + duration
+
+    @contextmanager
+    def stage(self, stage: str) -> Iterator[None]:
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.add(stage, time.monotonic() - start)
+
+    def delivered(self):
+        """Mark the message as sent to the other side."""
+        self.delivered_at = time.time()
+
+    def finish(self):
+        """Record the end-to-end lag and the stage timings, if the message was delivered."""
+        if self.delivered_at is None:
+            return
+        if self.origin_ts is not None:
+            METRIC_MESSAGE_LAG.labels(self.direction, self.source).observe(
+                max(self.delivered_at - self.origin_ts, 0)
+            )
+            self.add("receive", max(self.received_at - self.origin_ts, 0))
+        for stage, duration in self.stages.items():
+            METRIC_MESSAGE_STAGE.labels(self.direction, self.source, stage).observe(duration)
+
+
+def current_trace() -> LagTrace | None:
+    return _current_trace.get()
+
+
+def set_trace(trace: LagTrace | None):
+    """
+    Make a trace current for the rest of this task, for code paths that don't fit in a ``with``
+    block, like separate event stream listeners. Pass ``None`` to end it.
+    """
+    _current_trace.set(trace)
+
+
+@contextmanager
+def traced(trace: LagTrace) -> Iterator[LagTrace]:
+    """Make a trace current inside the ``with`` block."""
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+
+
+@contextmanager
+def lag_stage(stage: str) -> Iterator[None]:
+    """Add the time spent in the ``with`` block to a stage of the current trace, if any."""
+    trace = _current_trace.get()
+    if not trace:
+        yield
+        return
+    with trace.stage(stage):
+        yield
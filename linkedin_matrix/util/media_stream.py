@@ -0,0 +1,108 @@
+from __future__ import annotations
+
+from typing import Any, AsyncIterable, AsyncIterator
+import base64
+import binascii
+import hashlib
+import struct
+import time
+
+from mautrix.appservice import IntentAPI
+from mautrix.errors import DecryptionError
+from mautrix.types import ContentURI, SpecVersions
+
+try:
+    from Crypto.Cipher import AES
+    from Crypto.Util import Counter
+except ImportError:
+    try:
+        from Cryptodome.Cipher import AES
+        from Cryptodome.Util import Counter
+    except ImportError:
+        AES = Counter = None
+
+CHUNK_SIZE = 64 * 1024
+
+
+def _decode_base64(value: str) -> bytes:
+    # Matrix uses unpadded base64, and the JWK key is in the URL-safe alphabet.
+    value = value.replace("-", "+").replace("_", "/")
+    return base64.b64decode(value + "=" * (-len(value) % 4), validate=True)
+
+
+class AttachmentDecryptor:
+    """
+    Incrementally decrypts an encrypted Matrix attachment (AES-256-CTR). The SHA-256 hash of the
+    ciphertext can only be checked once everything has been decrypted, so callers must call
+    :meth:`verify` at the end and discard the output if it fails.
+    """
+
+    def __init__(self, key: str, sha256: str, iv: str):
+        if not AES:
+            raise DecryptionError("pycryptodome is not installed")
+        try:
+            self._expected_hash = _decode_base64(sha256)
+            byte_key = _decode_base64(key)
+            byte_iv = _decode_base64(iv)
+        except (binascii.Error, TypeError) as e:
+            raise DecryptionError("Error decoding key, IV or hash") from e
+        if len(byte_iv) != 16:
+            raise DecryptionError("Invalid IV length")
+        # A non-zero IV counter is not spec-compliant, but some clients still do it.
+        (initial_value,) = struct.unpack(">Q", byte_iv[8:])
+        counter = Counter.new(64, prefix=byte_iv[:8], initial_value=initial_value)
+        try:
+            self._cipher = AES.new(byte_key, AES.MODE_CTR, counter=counter)
+        except ValueError as e:
+            raise DecryptionError("Failed to create AES cipher") from e
+        self._hash = hashlib.sha256()
+
+    def decrypt(self, chunk: bytes) -> bytes:
+        self._hash.update(chunk)
+        return self._cipher.decrypt(chunk)
+
+    def verify(self):
+        if self._hash.digest() != self._expected_hash:
+            raise DecryptionError("Mismatched SHA-256 digest")
+
+
+async def iter_media(
+    intent: IntentAPI, url: ContentURI, chunk_size: int = CHUNK_SIZE
+) -> AsyncIterator[bytes]:
+    """
+    Download a file from the homeserver media repository in chunks, like
+    :meth:`IntentAPI.download_media` but without reading the whole file into memory.
+    """
+    authenticated = (await intent.versions()).supports(SpecVersions.V111)
+    download_url = intent.api.get_download_url(url, authenticated=authenticated)
+    query_params: dict[str, Any] = {"allow_redirect": "true"}
+    headers: dict[str, str] = {}
+    if authenticated:
+        headers["Authorization"] = f"Bearer {intent.api.token}"
+        if intent.api.as_user_id:
+            query_params["user_id"] = intent.api.as_user_id
+    req_id = intent.api.log_download_request(download_url, query_params)
+    start = time.monotonic()
+    async with intent.api.session.get(
+        download_url, params=query_params, headers=headers
+    ) as response:
+        try:
+            response.raise_for_status()
+            async for chunk in response.content.iter_chunked(chunk_size):
+                yield chunk
+        finally:
+            intent.api.log_download_request_done(
+                download_url, req_id, time.monotonic() - start, response.status
+            )
+
+
+async def decrypt_stream(
+    stream: AsyncIterable[bytes], decryptor: AttachmentDecryptor
+) -> AsyncIterator[bytes]:
+    """
+    Decrypt a stream of ciphertext chunks. The hash is verified after the last chunk, so a
+    corrupted file raises :class:`DecryptionError` at the end of the stream.
+    """
+    async for chunk in stream:
+        yield decryptor.decrypt(chunk)
+    decryptor.verify()
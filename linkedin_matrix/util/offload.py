@@ -0,0 +1,100 @@
+from __future__ import annotations
+
+from typing import Any, Callable, TypeVar
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+import asyncio
+import logging
+import time
+
+from mautrix.util.opt_prometheus import Histogram
+
+T = TypeVar("T")
+
+METRIC_OFFLOAD_TIME = Histogram(
+    "bridge_offloaded_work_seconds",
+    "Time taken by CPU-bound work that was moved off the event loop, including queueing",
+    ["function"],
+)
+METRIC_LOOP_LAG = Histogram(
+    "bridge_event_loop_lag_seconds",
+    "How much later than scheduled the event loop woke up a periodic timer",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+
+
+class Offloader:
+    """
+    Runs blocking, CPU-bound functions (hashing, encryption, file type sniffing) in a thread or
+    process pool so that they don't stall the event loop. Work on inputs smaller than
+    ``inline_threshold`` bytes is cheap enough that the executor round trip would cost more than
+    it saves, so it's run inline.
+
+    In ``process`` mode, the function and its arguments must be picklable, which means it must
+    be a module-level function.
+    """
+
+    log: logging.Logger = logging.getLogger("mau.offload")
+
+    mode: str
+    max_workers: int | None
+    inline_threshold: int
+    _executor: Executor | None
+
+    def __init__(self):
+        self.mode = "inline"
+        self.max_workers = None
+        self.inline_threshold = 0
+        self._executor = None
+
+    def configure(self, mode: str, max_workers: int, inline_threshold: int):
+        if mode not in ("inline", "thread", "process"):
+            raise ValueError(f"Unknown offload mode {mode!r}")
+        self.shutdown()
+        self.mode = mode
+        self.max_workers = max_workers or None
+        self.inline_threshold = max(inline_threshold, 0)
+
+    def _get_executor(self) -> Executor:
+        if not self._executor:
+            if self.mode == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            else:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix="offload"
+                )
+        return self._executor
+
+    async def run(self, size: int, func: Callable[..., T], *args: Any) -> T:
+        """
+        Call ``func(*args)``, in the executor if ``size`` (the number of bytes it processes) is
+        at least ``inline_threshold``.
+        """
+        if self.mode == "inline" or size < self.inline_threshold:
+            return func(*args)
+        start = time.monotonic()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                self._get_executor(), func, *args
+            )
+        finally:
+            METRIC_OFFLOAD_TIME.labels(function=func.__name__).observe(time.monotonic() - start)
+
+    def shutdown(self):
+        if self._executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+offloader = Offloader()
+
+
+async def monitor_loop_lag(interval: float = 1):
+    """
+    Sleep for ``interval`` seconds in a loop and record how late each wakeup was. Anything that
+    blocks the event loop shows up as lag.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        METRIC_LOOP_LAG.observe(max(loop.time() - start - interval, 0))
@@ -0,0 +1,33 @@
+from __future__ import annotations
+
+import os
+import resource
+import sys
+
+
+def get_rss() -> int | None:
+    """
+    Get the current resident set size of this process in bytes, or ``None`` if it can't be
+    determined on this platform.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        # There's no /proc on macOS. This is the peak RSS rather than the current one, but it's
+        # in bytes there, and is better than nothing.
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    except (OSError, ValueError):
+        return None
+
+
+def get_peak_rss() -> int | None:
+    """Get the highest resident set size this process has had so far in bytes."""
+    try:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    except (OSError, ValueError):
+        return None
+    # Linux reports kilobytes, macOS bytes.
+    return peak if sys.platform == "darwin" else peak * 1024
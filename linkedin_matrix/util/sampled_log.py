@@ -0,0 +1,42 @@
+from __future__ import annotations
+
+from typing import Any
+from collections import defaultdict
+import logging
+import time
+
+
+class LogSampler:
+    """
+    Rate limits log messages that are written for every event on a hot path, like typing
+    notifications. At most one message per category is logged every ``interval`` seconds, and
+    it includes the number of messages that were skipped since the previous one.
+
+    Arguments are formatted lazily, so nothing is formatted if the level is disabled or the
+    message is skipped.
+    """
+
+    interval: float
+    _last: dict[str, float]
+    _skipped: defaultdict[str, int]
+
+    def __init__(self, interval: float = 10):
+        self.interval = interval
+        self._last = {}
+        self._skipped = defaultdict(int)
+
+    def log(self, logger: logging.Logger, level: int, category: str, msg: str, *args: Any) -> bool:
+        """Log a message unless its category was logged recently. Returns whether it was."""
+        if not logger.isEnabledFor(level):
+            return False
+        now = time.monotonic()
+        last = self._last.get(category)
+        if last is not None and now - last < self.interval:
+            self._skipped[category] += 1
+            return False
+        self._last[category] = now
+        if skipped := self._skipped.pop(category, 0):
+            msg += " (%d similar messages skipped)"
+            args = (*args, skipped)
+        logger.log(level, msg, *args)
+        return True
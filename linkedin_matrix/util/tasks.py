@@ -0,0 +1,130 @@
+from __future__ import annotations
+
+from typing import Any, Coroutine
+import asyncio
+import logging
+import time
+
+from mautrix.util.opt_prometheus import Counter, Gauge
+
+METRIC_TASKS_RUNNING = Gauge(
+    "bridge_background_tasks", "Number of running background tasks", ["group"]
+)
+METRIC_TASKS_WAITING = Gauge(
+    "bridge_background_tasks_waiting",
+    "Number of background tasks waiting for their group to be below its concurrency limit",
+    ["group"],
+)
+METRIC_TASKS_STARTED = Counter(
+    "bridge_background_tasks_started", "Number of background tasks started", ["group"]
+)
+
+
+class TaskGroup:
+    name: str
+    limit: int
+    tasks: set[asyncio.Task]
+    _semaphore: asyncio.Semaphore | None
+
+    def __init__(self, name: str, limit: int = 0):
+        self.name = name
+        self.tasks = set()
+        self.set_limit(limit)
+
+    def set_limit(self, limit: int):
+        self.limit = max(limit, 0)
+        self._semaphore = asyncio.Semaphore(self.limit) if self.limit else None
+
+
+class TaskRegistry:
+    """
+    Keeps track of fire-and-forget tasks in named groups. Like
+    :func:`mautrix.util.background_task.create`, it keeps references to the tasks and logs their
+    errors. On top of that, it exports the number of running and waiting tasks per group, can
+    limit how many tasks of a group run at once, and can wait for all tasks on shutdown.
+
+    Long-running loops that are stopped by their owners don't belong here, since :meth:`drain`
+    would wait for them until the deadline.
+    """
+
+    log: logging.Logger = logging.getLogger("mau.tasks")
+
+    groups: dict[str, TaskGroup]
+    _limits: dict[str, int]
+
+    def __init__(self):
+        self.groups = {}
+        self._limits = {}
+
+    def configure(self, limits: dict[str, int]):
+        """Set the concurrency limits per group. Groups without a limit (or 0) are unlimited."""
+        self._limits = dict(limits)
+        for group in self.groups.values():
+            group.set_limit(self._limits.get(group.name, 0))
+
+    def _get_group(self, name: str) -> TaskGroup:
+        try:
+            return self.groups[name]
+        except KeyError:
+            group = self.groups[name] = TaskGroup(name, self._limits.get(name, 0))
+            return group
+
+    def create(
+        self, group: str, coro: Coroutine[Any, Any, Any], *, name: str | None = None
+    ) -> asyncio.Task:
+        """Run a coroutine in the background as part of the given group."""
+        task_group = self._get_group(group)
+        task = asyncio.create_task(self._run(task_group, coro), name=name)
+        task_group.tasks.add(task)
+        task.add_done_callback(task_group.tasks.discard)
+        # Tasks that are cancelled before they start would otherwise leave the coroutine unawaited
+        task.add_done_callback(lambda _: coro.close())
+        METRIC_TASKS_STARTED.labels(group).inc()
+        return task
+
+    async def _run(self, group: TaskGroup, coro: Coroutine[Any, Any, Any]) -> Any:
+        # The limit may be changed while the task is waiting, so stick to the same semaphore.
+        semaphore = group._semaphore
+        if semaphore:
+            METRIC_TASKS_WAITING.labels(group.name).inc()
+            try:
+                await semaphore.acquire()
+            finally:
+                METRIC_TASKS_WAITING.labels(group.name).dec()
+        METRIC_TASKS_RUNNING.labels(group.name).inc()
+        try:
+            return await coro
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self.log.exception(f"Uncaught error in background task in group {group.name}")
+        finally:
+            METRIC_TASKS_RUNNING.labels(group.name).dec()
+            if semaphore:
+                semaphore.release()
+
+    def counts(self) -> dict[str, int]:
+        return {name: len(group.tasks) for name, group in self.groups.items() if group.tasks}
+
+    async def drain(self, timeout: float) -> bool:
+        """
+        Wait up to ``timeout`` seconds for all tasks, including ones started while waiting, and
+        cancel the ones that are still running after that. Returns whether everything finished.
+        """
+        deadline = time.monotonic() + timeout
+        while tasks := {task for group in self.groups.values() for task in group.tasks}:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self.log.warning(
+                    f"Cancelling background tasks that didn't finish: {self.counts()}"
+                )
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                return False
+            self.log.debug(f"Waiting for background tasks: {self.counts()}")
+            await asyncio.wait(tasks, timeout=remaining)
+        return True
+
+
+task_registry = TaskRegistry()
@@ -0,0 +1,16 @@
+from .blurhash import encode_blurhash
+
+
+def test_solid_color():
+    assert encode_blurhash([(200, 30, 90)] * 64, 8, 8) == "LNM^#v|zfQ|z|zsVfQsVfQfQfQfQ"
+
+
+def test_gradient_matches_reference_encoder():
+    width, height = 12, 8
+    pixels = [
+        ((x * 21) % 256, (y * 31) % 256, ((x + y) * 9) % 256)
+        for y in range(height)
+        for x in range(width)
+    ]
+    assert encode_blurhash(pixels, width, height) == "LnG8*{2+sTt6u:R-jujGf5fRfQfQ"
+    assert encode_blurhash(pixels, width, height, 3, 2) == "BnG8*{2+sTu:R-ju"
@@ -0,0 +1,52 @@
+import asyncio
+import logging
+
+from .coalesce import Debouncer, LatestValueCoalescer
+
+
+def test_debouncer_suppresses_repeats_within_window():
+    debouncer = Debouncer(window=60)
+    assert debouncer.should_send("a")
+    assert not debouncer.should_send("a")
+    assert debouncer.should_send("b")
+    debouncer.reset("a")
+    assert debouncer.should_send("a")
+
+
+def test_debouncer_disabled():
+    debouncer = Debouncer(window=0)
+    assert debouncer.should_send("a")
+    assert debouncer.should_send("a")
+
+
+def test_coalescer_sends_latest_value_once():
+    sent = []
+
+    async def callback(key: str, value: int | str) -> None:
+        sent.append((key, value))
+
+    async def run():
+        coalescer = LatestValueCoalescer(0.01, callback, logging.getLogger("test"))
+        for i in range(5):
+            await coalescer.submit("room", i)
+        await coalescer.submit("other", "x")
+        await asyncio.sleep(0.05)
+
+    asyncio.run(run())
+    assert sorted(sent) == [("other", "x"), ("room", 4)]
+
+
+def test_coalescer_flush_sends_pending():
+    sent = []
+
+    async def callback(key: str, value: int | str) -> None:
+        sent.append((key, value))
+
+    async def run():
+        coalescer = LatestValueCoalescer(60, callback, logging.getLogger("test"))
+        await coalescer.submit("room", 1)
+        await coalescer.submit("room", 2)
+        await coalescer.flush()
+
+    asyncio.run(run())
+    assert sent == [("room", 2)]
@@ -0,0 +1,32 @@
+from .identity_map import IdentityMap, approximate_size
+
+
+def test_reads_mark_entries_as_used():
+    cache: IdentityMap[str, int] = IdentityMap(a=1, b=2, c=3)
+    assert cache["a"] == 1
+    assert cache.get("b") == 2
+    assert cache.get("missing") is None
+    assert list(cache) == ["c", "a", "b"]
+
+
+def test_evict_least_recently_used():
+    cache: IdentityMap[str, int] = IdentityMap(a=1, b=2, c=3, d=4)
+    cache.touch("a")
+    assert cache.evict(2, lambda _: True) == [2, 3]
+    assert list(cache) == ["d", "a"]
+
+
+def test_evict_skips_busy_entries():
+    cache: IdentityMap[str, int] = IdentityMap(a=1, b=2, c=3, d=4)
+    assert cache.evict(2, lambda value: value != 1) == [2, 3]
+    assert list(cache) == ["a", "d"]
+    assert cache.evict(0, lambda _: True) == []
+
+
+def test_approximate_size():
+    class Obj:
+        def __init__(self):
+            self.value = "x" * 100
+
+    assert approximate_size([]) == 0
+    assert approximate_size([Obj() for _ in range(10)]) > 10 * 100
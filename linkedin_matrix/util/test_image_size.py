@@ -0,0 +1,39 @@
+import struct
+
+from .image_size import get_image_size
+
+
+def test_png():
+    header = b"\x89PNG\r\n\x1a\n" + struct.pack(">I", 13) + b"IHDR" + struct.pack(">II", 640, 480)
+    assert get_image_size(header + b"\x08\x06\x00\x00\x00") == (640, 480)
+
+
+def test_gif():
+    assert get_image_size(b"GIF89a" + struct.pack("<HH", 320, 200) + b"\x00") == (320, 200)
+
+
+def test_jpeg_skips_segments_before_frame():
+    app0 = b"\xff\xe0" + struct.pack(">H", 16) + b"JFIF\x00" + b"\x00" * 9
+    sof2 = b"\xff\xc2" + struct.pack(">HBHH", 17, 8, 1080, 1920) + b"\x03" + b"\x00" * 9
+    assert get_image_size(b"\xff\xd8" + app0 + sof2) == (1920, 1080)
+
+
+def test_webp_variants():
+    def riff(chunk: bytes, payload: bytes) -> bytes:
+        return b"RIFF" + struct.pack("<I", 4 + len(payload)) + b"WEBP" + chunk + payload
+
+    lossy = riff(b"VP8 ", b"\x00" * 7 + b"\x9d\x01\x2a" + struct.pack("<HH", 800, 600))
+    bits = (100 - 1) | ((50 - 1) << 14)
+    lossless = riff(b"VP8L", b"\x00" * 4 + b"\x2f" + struct.pack("<I", bits))
+    extended = riff(
+        b"VP8X", b"\x00" * 8 + (1023).to_bytes(3, "little") + (767).to_bytes(3, "little")
+    )
+    assert get_image_size(lossy) == (800, 600)
+    assert get_image_size(lossless) == (100, 50)
+    assert get_image_size(extended) == (1024, 768)
+
+
+def test_unknown_or_truncated():
+    assert get_image_size(b"BM\x00\x00") is None
+    assert get_image_size(b"\x89PNG\r\n\x1a\n\x00") is None
+    assert get_image_size(b"\xff\xd8\xff\xe0\x00") is None
@@ -0,0 +1,69 @@
+from pathlib import Path
+import asyncio
+
+from .journal import EventJournal, read_journal
+
+
+def test_replays_unacknowledged_records_after_reopen(tmp_path: Path):
+    async def run() -> tuple[list[bytes], int, int]:
+        journal = EventJournal(tmp_path)
+        offsets = [
+            await journal.append(f"event {i}".encode(), key=f"thread{i % 2}") for i in range(5)
+        ]
+        for offset in (offsets[0], offsets[1], offsets[3]):
+            journal.ack(offset)
+        journal.checkpoint().result()
+
+        reopened = EventJournal(tmp_path)
+        replayed = [r.payload for r in reopened.replay()]
+        # New records continue after the existing ones.
+        return replayed, await reopened.append(b"event 5"), offsets[-1]
+
+    replayed, next_offset, last_offset = asyncio.run(run())
+    assert replayed == [b"event 2", b"event 4"]
+    assert next_offset == last_offset + 1
+
+
+def test_torn_write_is_truncated(tmp_path: Path):
+    async def run() -> list[bytes]:
+        journal = EventJournal(tmp_path)
+        await journal.append(b"complete")
+        await journal.append(b"torn")
+        segment = next(tmp_path.glob("*.log"))
+        segment.write_bytes(segment.read_bytes()[:-2])
+
+        reopened = EventJournal(tmp_path)
+        replayed = [r.payload for r in reopened.replay()]
+        await reopened.append(b"after")
+        return replayed
+
+    assert asyncio.run(run()) == [b"complete"]
+    assert [r.payload for r in read_journal(tmp_path)] == [b"complete", b"after"]
+
+
+def test_acknowledged_segments_are_deleted(tmp_path: Path):
+    async def run() -> list[int]:
+        journal = EventJournal(tmp_path, segment_size=1)
+        offsets = [await journal.append(b"x") for _ in range(4)]
+        assert len(list(tmp_path.glob("*.log"))) == 4
+        for offset in offsets[:3]:
+            journal.ack(offset)
+        journal.checkpoint().result()
+        return offsets
+
+    offsets = asyncio.run(run())
+    assert len(list(tmp_path.glob("*.log"))) == 1
+    assert [r.offset for r in read_journal(tmp_path)] == [offsets[3]]
+
+
+def test_concurrent_appends_are_written_together(tmp_path: Path):
+    async def run() -> list[int]:
+        journal = EventJournal(tmp_path, segment_size=1)
+        offsets = await asyncio.gather(*(journal.append(f"{i}".encode()) for i in range(5)))
+        journal.close()
+        return offsets
+
+    assert asyncio.run(run()) == [1, 2, 3, 4, 5]
+    # All of them were queued before the writer ran, so they share a write and a segment.
+    assert len(list(tmp_path.glob("*.log"))) == 1
+    assert [r.payload for r in read_journal(tmp_path)] == [b"0", b"1", b"2", b"3", b"4"]
@@ -0,0 +1,51 @@
+import asyncio
+import time
+
+import pytest
+
+from .lag import LINKEDIN_TO_MATRIX, LagTrace, current_trace, lag_stage, set_trace, traced
+
+
+def test_stages_only_recorded_inside_trace():
+    with lag_stage("convert"):
+        pass
+    assert current_trace() is None
+
+    trace = LagTrace(LINKEDIN_TO_MATRIX, "test")
+    with traced(trace):
+        with lag_stage("convert"):
+            time.sleep(0.01)
+        with lag_stage("convert"):
+            pass
+    assert current_trace() is None
+    assert trace.stages["convert"] >= 0.01
+
+
+def test_trace_follows_listener_task():
+    async def listener() -> LagTrace | None:
+        set_trace(LagTrace(LINKEDIN_TO_MATRIX, "test"))
+        await asyncio.sleep(0)
+        trace = current_trace()
+        set_trace(None)
+        return trace
+
+    assert asyncio.run(listener()).source == "test"
+    assert current_trace() is None
+
+
+def test_finish_records_lag():
+    prometheus_client = pytest.importorskip("prometheus_client")
+
+    def sample(name: str, **labels: str) -> float:
+        return prometheus_client.REGISTRY.get_sample_value(name, labels) or 0
+
+    labels = {"direction": LINKEDIN_TO_MATRIX, "source": "test-finish"}
+    trace = LagTrace(LINKEDIN_TO_MATRIX, "test-finish", origin_ts=time.time() - 2)
+    trace.finish()
+    assert sample("bridge_message_lag_seconds_count", **labels) == 0
+
+    trace.delivered()
+    trace.finish()
+    assert sample("bridge_message_lag_seconds_count", **labels) == 1
+    assert sample("bridge_message_lag_seconds_sum", **labels) >= 2
+    assert sample("bridge_message_stage_seconds_sum", stage="receive", **labels) >= 2
@@ -0,0 +1,33 @@
+import base64
+import hashlib
+import os
+
+import pytest
+
+from mautrix.errors import DecryptionError
+
+from .media_stream import AttachmentDecryptor
+
+AES = pytest.importorskip("Crypto.Cipher.AES")
+Counter = pytest.importorskip("Crypto.Util.Counter")
+
+
+def _b64(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+
+def test_decrypts_in_chunks_and_verifies_hash():
+    plaintext = os.urandom(100_000)
+    key, iv = os.urandom(32), os.urandom(8) + bytes(8)
+    counter = Counter.new(64, prefix=iv[:8], initial_value=0)
+    ciphertext = AES.new(key, AES.MODE_CTR, counter=counter).encrypt(plaintext)
+
+    decryptor = AttachmentDecryptor(_b64(key), _b64(hashlib.sha256(ciphertext).digest()), _b64(iv))
+    chunks = [decryptor.decrypt(ciphertext[i : i + 4096]) for i in range(0, len(ciphertext), 4096)]
+    decryptor.verify()
+    assert b"".join(chunks) == plaintext
+
+    decryptor = AttachmentDecryptor(_b64(key), _b64(hashlib.sha256(b"").digest()), _b64(iv))
+    decryptor.decrypt(ciphertext)
+    with pytest.raises(DecryptionError):
+        decryptor.verify()
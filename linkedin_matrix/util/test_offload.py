@@ -0,0 +1,25 @@
+import asyncio
+import threading
+
+from .offload import Offloader
+
+
+def _thread_name(data: bytes) -> str:
+    return threading.current_thread().name
+
+
+def test_offloader_runs_small_inputs_inline():
+    async def run() -> tuple[str, str]:
+        offloader = Offloader()
+        offloader.configure("thread", max_workers=1, inline_threshold=100)
+        try:
+            return (
+                await offloader.run(10, _thread_name, b"x" * 10),
+                await offloader.run(100, _thread_name, b"x" * 100),
+            )
+        finally:
+            offloader.shutdown()
+
+    small, large = asyncio.run(run())
+    assert small == "MainThread"
+    assert large.startswith("offload")
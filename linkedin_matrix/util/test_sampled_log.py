@@ -0,0 +1,35 @@
+import logging
+
+import pytest
+
+from .sampled_log import LogSampler
+
+
+class _Unformattable:
+    def __str__(self) -> str:
+        raise AssertionError("formatted a message that wasn't logged")
+
+
+def test_sampler_rate_limits_per_category(caplog: pytest.LogCaptureFixture):
+    sampler = LogSampler(interval=60)
+    log = logging.getLogger("mau.test_sampled_log")
+    with caplog.at_level(logging.DEBUG, logger=log.name):
+        assert sampler.log(log, logging.DEBUG, "typing", "typing in %s", "!a")
+        assert not sampler.log(log, logging.DEBUG, "typing", "typing in %s", _Unformattable())
+        assert sampler.log(log, logging.DEBUG, "presence", "%s is present", "@b")
+        sampler._last["typing"] -= 60
+        assert sampler.log(log, logging.DEBUG, "typing", "typing in %s", "!c")
+    assert [record.getMessage() for record in caplog.records] == [
+        "typing in !a",
+        "@b is present",
+        "typing in !c (1 similar messages skipped)",
+    ]
+
+
+def test_sampler_skips_disabled_levels(caplog: pytest.LogCaptureFixture):
+    sampler = LogSampler()
+    log = logging.getLogger("mau.test_sampled_log")
+    with caplog.at_level(logging.INFO, logger=log.name):
+        assert not sampler.log(log, logging.DEBUG, "typing", "%s", _Unformattable())
+    assert not caplog.records
+    assert not sampler._skipped
@@ -0,0 +1,44 @@
+import asyncio
+
+from .tasks import TaskRegistry
+
+
+def test_group_limit_and_drain():
+    async def run() -> int:
+        registry = TaskRegistry()
+        registry.configure({"limited": 2})
+        running = 0
+        max_running = 0
+
+        async def work():
+            nonlocal running, max_running
+            running += 1
+            max_running = max(max_running, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+
+        async def fail():
+            raise ValueError("logged, not raised")
+
+        for _ in range(6):
+            registry.create("limited", work())
+        failing = registry.create("failing", fail())
+        assert registry.counts() == {"limited": 6, "failing": 1}
+        assert await registry.drain(timeout=5)
+        assert registry.counts() == {}
+        assert failing.exception() is None
+        return max_running
+
+    assert asyncio.run(run()) == 2
+
+
+def test_drain_cancels_after_deadline():
+    async def run() -> tuple[bool, bool, dict[str, int]]:
+        registry = TaskRegistry()
+        registry.configure({"stuck": 1})
+        first = registry.create("stuck", asyncio.sleep(60))
+        waiting = registry.create("stuck", asyncio.sleep(60))
+        assert not await registry.drain(timeout=0.05)
+        return first.cancelled(), waiting.cancelled(), registry.counts()
+
+    assert asyncio.run(run()) == (True, True, {})
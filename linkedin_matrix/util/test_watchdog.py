@@ -0,0 +1,35 @@
+import asyncio
+import logging
+import re
+import time
+
+import pytest
+
+from .watchdog import LoopWatchdog
+
+
+def _block_the_loop():
+    time.sleep(0.4)
+
+
+def test_watchdog_logs_blocking_stack(caplog: pytest.LogCaptureFixture):
+    async def blocking_task():
+        _block_the_loop()
+
+    async def run():
+        watchdog = LoopWatchdog(threshold=0.1)
+        watchdog.start()
+        try:
+            await asyncio.sleep(0.1)
+            await asyncio.create_task(blocking_task(), name="blocker")
+            await asyncio.sleep(0.1)
+        finally:
+            watchdog.stop()
+
+    with caplog.at_level(logging.WARNING, logger="mau.watchdog"):
+        asyncio.run(run())
+    messages = [record.getMessage() for record in caplog.records]
+    assert len(messages) == 2
+    assert "task blocker (test_watchdog_logs_blocking_stack.<locals>.blocking_task)" in messages[0]
+    assert "_block_the_loop" in messages[0]
+    assert float(re.search(r"blocked for ([\d.]+) seconds in total", messages[1]).group(1)) >= 0.3
@@ -0,0 +1,171 @@
+from __future__ import annotations
+
+from typing import NamedTuple
+from io import BytesIO
+import asyncio
+import hashlib
+import logging
+
+from mautrix.util import background_task
+from mautrix.util.opt_prometheus import Counter
+
+from .blurhash import encode_blurhash
+from .offload import offloader
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+METRIC_THUMBNAILS = Counter(
+    "bridge_thumbnails", "Number of thumbnails requested, by outcome", ["result"]
+)
+
+# The blurhash is computed from a copy of the image scaled down to fit in this many pixels.
+BLURHASH_SOURCE_SIZE = 32
+
+
+class Thumbnail(NamedTuple):
+    data: bytes
+    mimetype: str
+    width: int
+    height: int
+    blurhash: str | None
+
+
+def make_thumbnail(
+    data: bytes, max_size: int, image_format: str, quality: int, blurhash: bool
+) -> Thumbnail:
+    # This is a module-level function so that it can be run in a process pool.
+    with Image.open(BytesIO(data)) as img:
+        # Decode at a reduced size where the format supports it (JPEG), which is much faster.
+        img.draft("RGB", (max_size, max_size))
+        img = img.convert("RGB")
+    img.thumbnail((max_size, max_size))
+    output = BytesIO()
+    img.save(output, format=image_format.upper(), quality=quality)
+    blurhash_str = None
+    if blurhash:
+        small = img.copy()
+        small.thumbnail((BLURHASH_SOURCE_SIZE, BLURHASH_SOURCE_SIZE))
+        pixels = [small.getpixel((x, y)) for y in range(small.height) for x in range(small.width)]
+        blurhash_str = encode_blurhash(pixels, small.width, small.height)
+    return Thumbnail(
+        data=output.getvalue(),
+        mimetype=f"image/{image_format.lower()}",
+        width=img.width,
+        height=img.height,
+        blurhash=blurhash_str,
+    )
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+class Thumbnailer:
+    """
+    Generates thumbnails for bridged images using a fixed number of workers. Requests are put
+    in a bounded queue; when the queue is full the thumbnail is skipped rather than delaying the
+    message, since thumbnails are only an optimization for clients.
+    """
+
+    log: logging.Logger = logging.getLogger("mau.thumbnail")
+
+    enabled: bool
+    max_size: int
+    image_format: str
+    quality: int
+    blurhash: bool
+    workers: int
+    _queue: asyncio.Queue[tuple[bytes, asyncio.Future]] | None
+    _worker_tasks: list[asyncio.Task]
+
+    def __init__(self):
+        self.enabled = False
+        self.max_size = 800
+        self.image_format = "jpeg"
+        self.quality = 80
+        self.blurhash = True
+        self.workers = 1
+        self._queue = None
+        self._worker_tasks = []
+
+    def configure(
+        self,
+        enabled: bool,
+        max_size: int,
+        image_format: str,
+        quality: int,
+        blurhash: bool,
+        max_queue: int,
+        workers: int,
+    ):
+        self.stop()
+        if enabled and not Image:
+            self.log.warning("Thumbnails are enabled, but Pillow is not installed")
+            enabled = False
+        self.enabled = enabled
+        self.max_size = max_size
+        self.image_format = image_format
+        self.quality = quality
+        self.blurhash = blurhash
+        self.workers = max(workers, 1)
+        self._queue = asyncio.Queue(maxsize=max(max_queue, 1))
+
+    async def generate(self, data: bytes) -> Thumbnail | None:
+        """
+        Generate a thumbnail for the given image. Returns ``None`` if thumbnails are disabled,
+        the queue is full, or the image couldn't be read.
+        """
+        if not self.enabled or not self._queue:
+            return None
+        if not self._worker_tasks:
+            self._worker_tasks = [
+                background_task.create(self._worker()) for _ in range(self.workers)
+            ]
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self._queue.put_nowait((data, future))
+        except asyncio.QueueFull:
+            METRIC_THUMBNAILS.labels(result="skipped").inc()
+            self.log.debug("Thumbnail queue is full, skipping thumbnail")
+            return None
+        return await future
+
+    async def _worker(self):
+        while True:
+            data, future = await self._queue.get()
+            thumbnail = None
+            try:
+                thumbnail = await offloader.run(
+                    len(data),
+                    make_thumbnail,
+                    data,
+                    self.max_size,
+                    self.image_format,
+                    self.quality,
+                    self.blurhash,
+                )
+            except Exception:
+                METRIC_THUMBNAILS.labels(result="failed").inc()
+                self.log.warning("Failed to generate thumbnail", exc_info=True)
+            else:
+                METRIC_THUMBNAILS.labels(result="generated").inc()
+            finally:
+                if not future.done():
+                    future.set_result(thumbnail)
+                self._queue.task_done()
+
+    def stop(self):
+        for task in self._worker_tasks:
+            task.cancel()
+        self._worker_tasks = []
+        if self._queue:
+            while not self._queue.empty():
+                _, future = self._queue.get_nowait()
+                if not future.done():
+                    future.set_result(None)
+
+
+thumbnailer = Thumbnailer()
@@ -0,0 +1,108 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+
+from mautrix.util import background_task
+from mautrix.util.opt_prometheus import Counter
+
+METRIC_SLOW_CALLBACKS = Counter(
+    "bridge_slow_callbacks",
+    "Number of times a single callback blocked the event loop for longer than the threshold",
+)
+
+
+class LoopWatchdog:
+    """
+    Reports callbacks that block the event loop for longer than ``threshold`` seconds.
+
+    A task on the loop records a heartbeat every ``threshold / 2`` seconds, and a background
+    thread checks that it keeps doing so. When the heartbeat is late, the thread logs the stack
+    of the loop thread and the task that is running, while the blocking code is still on the
+    stack. Once the loop runs again, the total time it was blocked is logged too. The overhead
+    is two wakeups per ``threshold`` seconds, so this can stay on in production.
+    """
+
+    log: logging.Logger = logging.getLogger("mau.watchdog")
+
+    threshold: float
+    interval: float
+    _loop: asyncio.AbstractEventLoop | None
+    _loop_thread_id: int | None
+    _last_tick: float
+    _reported_tick: float | None
+    _tick_task: asyncio.Task | None
+    _thread: threading.Thread | None
+    _stop: threading.Event
+
+    def __init__(self, threshold: float):
+        self.threshold = threshold
+        self.interval = threshold / 2
+        self._loop = None
+        self._loop_thread_id = None
+        self._last_tick = time.monotonic()
+        self._reported_tick = None
+        self._tick_task = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    def start(self):
+        """Start watching the running event loop. Must be called from the loop thread."""
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._last_tick = time.monotonic()
+        self._stop.clear()
+        self._tick_task = background_task.create(self._tick())
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._tick_task:
+            self._tick_task.cancel()
+            self._tick_task = None
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    async def _tick(self):
+        while True:
+            now = time.monotonic()
+            if self._reported_tick == self._last_tick:
+                blocked = now - self._last_tick - self.interval
+                self.log.warning(f"Event loop was blocked for {blocked:.3f} seconds in total")
+            self._last_tick = now
+            await asyncio.sleep(self.interval)
+
+    def _watch(self):
+        while not self._stop.wait(self.interval):
+            last_tick = self._last_tick
+            blocked = time.monotonic() - last_tick - self.interval
+            if blocked < self.threshold or self._reported_tick == last_tick:
+                continue
+            self._reported_tick = last_tick
+            METRIC_SLOW_CALLBACKS.inc()
+            self.log.warning(
+                f"Event loop has been blocked for {blocked:.3f} seconds"
+                f" in {self._describe_task()}:\n{self._format_loop_stack()}"
+            )
+
+    def _describe_task(self) -> str:
+        try:
+            task = asyncio.current_task(self._loop)
+        except RuntimeError:
+            task = None
+        if not task:
+            return "a callback outside of any task"
+        coro = task.get_coro()
+        return f"task {task.get_name()} ({getattr(coro, '__qualname__', coro)})"
+
+    def _format_loop_stack(self) -> str:
+        frame = sys._current_frames().get(self._loop_thread_id)
+        if not frame:
+            return "(stack not available)"
+        return "".join(traceback.format_stack(frame)).rstrip()
@@ -1,6 +1,6 @@
 """An unofficial API for interacting with LinkedIn Messaging"""
 
 from .api_objects import URN
-from .linkedin import ChallengeException, LinkedInMessaging
+from .linkedin import ChallengeException, LinkedInMessaging, set_base_url
 
-__all__ = ("ChallengeException", "LinkedInMessaging", "URN")
+__all__ = ("ChallengeException", "LinkedInMessaging", "URN", "set_base_url")
@@ -0,0 +1,120 @@
+"""
+Sends the realtime connectivity heartbeats of all connected clients from a single timer wheel.
+"""
+
+from typing import TYPE_CHECKING, Optional
+import asyncio
+import logging
+import random
+import time
+
+from .api_objects import URN
+from .metrics import HEARTBEATS
+
+if TYPE_CHECKING:
+    from .linkedin import LinkedInMessaging
+
+
+class _Heartbeat:
+    client: "LinkedInMessaging"
+    user_urn: URN
+    slot: int
+    not_before: float
+    is_first: bool
+    task: Optional["asyncio.Task[None]"]
+
+    def __init__(self, client: "LinkedInMessaging", user_urn: URN, slot: int, not_before: float):
+        self.client = client
+        self.user_urn = user_urn
+        self.slot = slot
+        self.not_before = not_before
+        self.is_first = True
+        self.task = None
+
+
+class HeartbeatScheduler:
+    """
+    A timer wheel with ``slots`` slots that turns once every ``interval`` seconds. Each client is
+    put in one of the least used slots, picked at random, so heartbeats are spread evenly over
+    the interval instead of all clients that connected together sending them at the same time.
+
+    A single task turns the wheel while any client is registered. The heartbeats themselves are
+    sent with the client's ``task_factory``, so a slow request doesn't delay the other slots.
+    """
+
+    interval: float
+    slots: int
+    _wheel: list[dict["LinkedInMessaging", _Heartbeat]]
+    _heartbeats: dict["LinkedInMessaging", _Heartbeat]
+    _position: int
+    _task: Optional["asyncio.Task[None]"]
+
+    def __init__(self, interval: float = 60, slots: int = 60):
+        self.interval = interval
+        self.slots = slots
+        self._wheel = [{} for _ in range(slots)]
+        self._heartbeats = {}
+        self._position = 0
+        self._task = None
+
+    def add(self, client: "LinkedInMessaging", user_urn: URN):
+        """
+        Start sending heartbeats for the client. The first one is sent between half an interval
+        and one and a half intervals from now.
+        """
+        self.remove(client)
+        least_used = min(len(slot) for slot in self._wheel)
+        slot = random.choice([i for i, s in enumerate(self._wheel) if len(s) == least_used])
+        heartbeat = _Heartbeat(client, user_urn, slot, time.monotonic() + self.interval / 2)
+        self._wheel[slot][client] = heartbeat
+        self._heartbeats[client] = heartbeat
+        if not self._task or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def remove(self, client: "LinkedInMessaging"):
+        """Stop sending heartbeats for the client and cancel the one that is in flight."""
+        heartbeat = self._heartbeats.pop(client, None)
+        if not heartbeat:
+            return
+        del self._wheel[heartbeat.slot][client]
+        if heartbeat.task and not heartbeat.task.done():
+            heartbeat.task.cancel()
+
+    async def _run(self):
+        tick = self.interval / self.slots
+        next_tick = time.monotonic()
+        while self._heartbeats:
+            next_tick += tick
+            now = time.monotonic()
+            if next_tick < now - tick:
+                # The loop was blocked for a while, don't fire all the missed slots at once.
+                next_tick = now
+            await asyncio.sleep(next_tick - now)
+            self._position = (self._position + 1) % self.slots
+            now = time.monotonic()
+            for heartbeat in list(self._wheel[self._position].values()):
+                if now < heartbeat.not_before or (heartbeat.task and not heartbeat.task.done()):
+                    continue
+                heartbeat.task = heartbeat.client.task_factory(self._send(heartbeat))
+
+    async def _send(self, heartbeat: _Heartbeat):
+        is_first, heartbeat.is_first = heartbeat.is_first, False
+        try:
+            response = await heartbeat.client.send_heartbeat(heartbeat.user_urn, is_first)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            HEARTBEATS.labels("failure").inc()
+            logging.warning("Failed to send heartbeat for %s: %s", heartbeat.user_urn, e)
+            return
+        if response.status >= 400:
+            HEARTBEATS.labels("failure").inc()
+            logging.warning(
+                "Failed to send heartbeat for %s: HTTP %s", heartbeat.user_urn, response.status
+            )
+        else:
+            HEARTBEATS.labels("success").inc()
+            logging.debug("Sent heartbeat for %s", heartbeat.user_urn)
+
+
+heartbeat_scheduler = HeartbeatScheduler()
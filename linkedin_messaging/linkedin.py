@@ -1,9 +1,22 @@
-from typing import Any, AsyncGenerator, Awaitable, Callable, Optional, TypeVar, Union, cast
+from typing import (
+    Any,
+    AsyncGenerator,
+    AsyncIterable,
+    Awaitable,
+    Callable,
+    Coroutine,
+    Optional,
+    TypeVar,
+    Union,
+    cast,
+)
 from collections import defaultdict
 from datetime import datetime
+from functools import cached_property
 import asyncio
 import json
 import logging
+import time
 import uuid
 
 from bs4 import BeautifulSoup
@@ -26,6 +39,8 @@ from .api_objects import (
     UserProfileResponse,
 )
 from .exceptions import TooManyRequestsError
+from .heartbeat import heartbeat_scheduler
+from .metrics import track_error, track_response
 
 LINKEDIN_BASE_URL = "https://www.linkedin.com"
 LOGIN_URL = f"{LINKEDIN_BASE_URL}/checkpoint/lg/login-submit"
@@ -42,10 +57,33 @@ SEED_URL = f"{LINKEDIN_BASE_URL}/login"
 URL to seed all of the auth requests
 """
 
+
+def set_base_url(base_url: str = "https://www.linkedin.com"):
+    """
+    Send all requests to a different server, for example a local stand-in for load tests. This
+    changes the URLs for every :class:`LinkedInMessaging` instance in the process.
+    """
+    global LINKEDIN_BASE_URL, LOGIN_URL, LOGOUT_URL, REALTIME_CONNECT_URL, VERIFY_URL
+    global API_BASE_URL, CONNECTIVITY_TRACKING_URL, SEED_URL
+
+    LINKEDIN_BASE_URL = base_url.rstrip("/")
+    LOGIN_URL = f"{LINKEDIN_BASE_URL}/checkpoint/lg/login-submit"
+    LOGOUT_URL = f"{LINKEDIN_BASE_URL}/uas/logout"
+    REALTIME_CONNECT_URL = f"{LINKEDIN_BASE_URL}/realtime/connect"
+    VERIFY_URL = f"{LINKEDIN_BASE_URL}/checkpoint/challenge/verify"
+    API_BASE_URL = f"{LINKEDIN_BASE_URL}/voyager/api"
+    CONNECTIVITY_TRACKING_URL = (
+        f"{LINKEDIN_BASE_URL}/realtime/realtimeFrontendClientConnectivityTracking"
+    )
+    SEED_URL = f"{LINKEDIN_BASE_URL}/login"
+
+
 T = TypeVar("T", bound=DataClassJsonMixin)
 
 
 async def try_from_json(deserialise_to: T, response: aiohttp.ClientResponse) -> T:
+    if response.status == 429:
+        raise TooManyRequestsError(f"Rate limited while requesting {response.url}")
     if response.status < 200 or 300 <= response.status:
         try:
             error = Error.from_json(await response.text())
@@ -129,6 +167,11 @@ class LinkedInMessaging:
         ],
     ]
     headers: dict[str, str]
+    task_factory: Callable[[Coroutine[Any, Any, Any]], "asyncio.Task[Any]"]
+    """
+    Used to start the client's background tasks, like heartbeat requests. Replace it to keep track
+    of them.
+    """
 
     using_headers_from_user = False
 
@@ -136,7 +179,7 @@ class LinkedInMessaging:
     _realtime_connection_id: Optional[uuid.UUID] = None
 
     def __init__(self):
-        self._heartbeat_task = None
+        self.task_factory = asyncio.create_task
         self.session = aiohttp.ClientSession()
         self.event_listeners = defaultdict(list)
 
@@ -170,20 +213,46 @@ class LinkedInMessaging:
     async def close(self):
         await self.session.close()
 
-    async def _get(self, relative_url: str, **kwargs: Any) -> aiohttp.ClientResponse:
+    async def _request(
+        self, method: str, url: str, endpoint: str, **kwargs: Any
+    ) -> aiohttp.ClientResponse:
+        """
+        Send a request and read the response body, recording metrics for it under the given
+        logical endpoint name. The body stays available through ``text()``, ``json()`` and
+        ``read()`` on the response.
+        """
+        start = time.monotonic()
+        try:
+            response = await self.session.request(method, url, **kwargs)
+            body = await response.read()
+        except Exception:
+            track_error(endpoint, time.monotonic() - start)
+            raise
+        track_response(endpoint, response, time.monotonic() - start, len(body))
+        return response
+
+    async def _get(
+        self, relative_url: str, endpoint: str = "other", **kwargs: Any
+    ) -> aiohttp.ClientResponse:
         headers = kwargs.pop("headers", {})
         headers.update(self.headers)
-        return await self.session.get(
+        return await self._request(
+            "GET",
             API_BASE_URL + relative_url,
+            endpoint,
             headers=headers,
             **kwargs
         )
 
-    async def _post(self, relative_url: str, **kwargs: Any) -> aiohttp.ClientResponse:
+    async def _post(
+        self, relative_url: str, endpoint: str = "other", **kwargs: Any
+    ) -> aiohttp.ClientResponse:
         headers = kwargs.pop("headers", {})
         headers.update(self.headers)
-        return await self.session.post(
+        return await self._request(
+            "POST",
             API_BASE_URL + relative_url,
+            endpoint,
             headers=headers,
             **kwargs
         )
@@ -307,7 +376,7 @@ class LinkedInMessaging:
             "createdBefore": int(last_activity_before.timestamp() * 1000),
         }
 
-        res = await self._get("/messaging/conversations", params=params)
+        res = await self._get("/messaging/conversations", "conversations", params=params)
         return cast(ConversationsResponse, await try_from_json(ConversationsResponse, res))
 
     async def get_all_conversations(self) -> AsyncGenerator[Conversation, None]:
@@ -355,6 +424,7 @@ class LinkedInMessaging:
 
         res = await self._get(
             f"/messaging/conversations/{conversation_urn.id_parts[0]}/events",
+            "events",
             params=params,
         )
         return cast(ConversationResponse, await try_from_json(ConversationResponse, res))
@@ -362,6 +432,7 @@ class LinkedInMessaging:
     async def mark_conversation_as_read(self, conversation_urn: URN) -> bool:
         res = await self._post(
             f"/messaging/conversations/{conversation_urn.id_parts[-1]}",
+            "read",
             json={"patch": {"$set": {"read": True}}},
         )
         return res.status == 200
@@ -370,18 +441,14 @@ class LinkedInMessaging:
 
     # region Messages
 
-    async def upload_media(
-        self,
-        data: bytes,
-        filename: str,
-        media_type: str,
-    ) -> MessageAttachmentCreate:
+    async def _get_upload_url(self, file_size: int, filename: str) -> tuple[str, URN]:
         upload_metadata_response = await self._post(
             "/voyagerMediaUploadMetadata",
+            "upload_metadata",
             params={"action": "upload"},
             json={
                 "mediaUploadType": "MESSAGING_PHOTO_ATTACHMENT",
-                "fileSize": len(data),
+                "fileSize": file_size,
                 "filename": filename,
             },
         )
@@ -392,18 +459,71 @@ class LinkedInMessaging:
         upload_url = upload_metadata_response_json.get("singleUploadUrl")
         if not upload_url:
             raise Exception("No upload URL provided")
+        return upload_url, URN(upload_metadata_response_json.get("urn"))
 
-        upload_response = await self.session.put(upload_url, data=data)
+    async def upload_media(
+        self,
+        data: bytes,
+        filename: str,
+        media_type: str,
+    ) -> MessageAttachmentCreate:
+        upload_url, urn = await self._get_upload_url(len(data), filename)
+
+        upload_response = await self._request("PUT", upload_url, "upload", data=data)
         if upload_response.status != 201:
             # TODO (#2) is there any other data that we get?
             raise Exception("Failed to upload file.")
 
-        return MessageAttachmentCreate(
-            len(data),
-            URN(upload_metadata_response_json.get("urn")),
-            media_type,
-            filename,
-        )
+        return MessageAttachmentCreate(len(data), urn, media_type, filename)
+
+    async def upload_media_stream(
+        self,
+        stream: AsyncIterable[bytes],
+        file_size: int,
+        filename: str,
+        media_type: str,
+    ) -> MessageAttachmentCreate:
+        """
+        Upload a file from an async iterable of chunks without holding the whole file in
+        memory. ``file_size`` must be the exact size of the file, since it's sent to LinkedIn
+        before the upload starts.
+        """
+        upload_url, urn = await self._get_upload_url(file_size, filename)
+
+        stream_error: Optional[Exception] = None
+
+        async def counted() -> AsyncGenerator[bytes, None]:
+            nonlocal stream_error
+            sent = 0
+            try:
+                async for chunk in stream:
+                    sent += len(chunk)
+                    if sent > file_size:
+                        raise ValueError(f"File is larger than the declared {file_size} bytes")
+                    yield chunk
+                if sent != file_size:
+                    raise ValueError(f"File is {sent} bytes, but {file_size} bytes were declared")
+            except Exception as e:
+                stream_error = e
+                raise
+
+        try:
+            upload_response = await self._request(
+                "PUT",
+                upload_url,
+                "upload",
+                data=counted(),
+                headers={"Content-Length": str(file_size)},
+            )
+        except aiohttp.ClientError:
+            # aiohttp wraps errors from the body in a connection error, so re-raise the original
+            if stream_error:
+                raise stream_error
+            raise
+        if upload_response.status != 201:
+            raise Exception("Failed to upload file.")
+
+        return MessageAttachmentCreate(file_size, urn, media_type, filename)
 
     async def send_message(
         self,
@@ -426,6 +546,7 @@ class LinkedInMessaging:
             }
             res = await self._post(
                 "/messaging/conversations",
+                "send",
                 params=params,
                 json=payload,
             )
@@ -433,6 +554,7 @@ class LinkedInMessaging:
             conversation_id = conversation_urn_or_recipients.get_id()
             res = await self._post(
                 f"/messaging/conversations/{conversation_id}/events",
+                "send",
                 params=params,
                 json=message_event,
             )
@@ -444,15 +566,16 @@ class LinkedInMessaging:
             "/messaging/conversations/{}/events/{}".format(
                 conversation_urn, message_urn.id_parts[-1]
             ),
+            "delete",
             params={"action": "recall"},
         )
         return res.status == 204
 
     async def download_linkedin_media(self, url: str) -> bytes:
-        async with self.session.get(url) as media_resp:
-            if not media_resp.ok:
-                raise Exception(f"Failed downloading media. Response code {media_resp.status}")
-            return await media_resp.content.read()
+        media_resp = await self._request("GET", url, "media")
+        if not media_resp.ok:
+            raise Exception(f"Failed downloading media. Response code {media_resp.status}")
+        return await media_resp.read()
 
     # endregion
 
@@ -468,6 +591,7 @@ class LinkedInMessaging:
             "/messaging/conversations/{}/events/{}".format(
                 conversation_urn, message_urn.id_parts[-1]
             ),
+            "react",
             params={"action": "reactWithEmoji"},
             json={"emoji": emoji},
         )
@@ -483,6 +607,7 @@ class LinkedInMessaging:
             "/messaging/conversations/{}/events/{}".format(
                 conversation_urn, message_urn.id_parts[-1]
             ),
+            "react",
             params={"action": "unreactWithEmoji"},
             json={"emoji": emoji},
         )
@@ -495,7 +620,7 @@ class LinkedInMessaging:
             "messageUrn": f"urn:li:fsd_message:{message_urn.id_parts[-1]}",
             "q": "messageAndEmoji",
         }
-        res = await self._get("/voyagerMessagingDashReactors", params=params)
+        res = await self._get("/voyagerMessagingDashReactors", "reactors", params=params)
         return cast(ReactorsResponse, await try_from_json(ReactorsResponse, res))
 
     # endregion
@@ -505,6 +630,7 @@ class LinkedInMessaging:
     async def set_typing(self, conversation_urn: URN):
         await self._post(
             "/messaging/conversations",
+            "typing",
             params={"action": "typing"},
             json={"conversationId": conversation_urn.get_id()},
         )
@@ -514,7 +640,7 @@ class LinkedInMessaging:
     # region Profiles
 
     async def get_user_profile(self) -> UserProfileResponse:
-        res = await self._get("/me")
+        res = await self._get("/me", "profile")
         return cast(UserProfileResponse, await try_from_json(UserProfileResponse, res))
 
     async def download_profile_picture(self, picture: Picture) -> bytes:
@@ -526,10 +652,10 @@ class LinkedInMessaging:
             picture.vector_image.root_url
             + picture.vector_image.artifacts[-1].file_identifying_url_path_segment
         )
-        async with await self.session.get(url) as profile_resp:
-            if not profile_resp.ok:
-                raise Exception(f"Failed downloading media. Response code {profile_resp.status}")
-            return await profile_resp.content.read()
+        profile_resp = await self._request("GET", url, "profile_picture")
+        if not profile_resp.ok:
+            raise Exception(f"Failed downloading media. Response code {profile_resp.status}")
+        return await profile_resp.read()
 
     # endregion
 
@@ -548,6 +674,8 @@ class LinkedInMessaging:
 
         * ``ALL_EVENTS`` - an event fired on every event, and which contains the entirety of the
           raw event payload
+        * ``ALL_EVENTS_PROCESSED`` - like ``ALL_EVENTS``, but fired after all of the other
+          listeners for the event have finished
         """
         self.event_listeners[payload_key].append(fn)
 
@@ -566,12 +694,14 @@ class LinkedInMessaging:
             **self.headers,
         }
 
+        start = time.monotonic()
         async with self.session.get(
             REALTIME_CONNECT_URL,
             headers=headers,
             params={"rc": "1"},
             timeout=aiohttp.ClientTimeout(total=None),
         ) as resp:
+            track_response("realtime", resp, time.monotonic() - start)
             if resp.status != 200:
                 raise TooManyRequestsError(f"Failed to connect. Status {resp.status}.")
 
@@ -584,7 +714,7 @@ class LinkedInMessaging:
                     continue
                 data = json.loads(line.decode("utf-8")[6:])
 
-                logging.debug(f"Got data from event stream {data.keys()}")
+                logging.debug("Got data from event stream %s", data.keys())
 
                 # Special handling for ALL_EVENTS handler.
                 if all_events_handlers := self.event_listeners.get("ALL_EVENTS"):
@@ -598,53 +728,71 @@ class LinkedInMessaging:
                     logging.info(f"Got realtime connection ID: {cc.get('id')}")
                     self._realtime_connection_id = uuid.UUID(cc.get("id"))
 
-                event_payload = data.get("com.linkedin.realtimefrontend.DecoratedEvent", {}).get(
-                    "payload", {}
-                )
+                await self._fire_decorated_event(data)
 
-                if event_payload:
-                    logging.debug(f"Firing events for keys {event_payload.keys()}")
-
-                    for key in self.event_listeners.keys():
-                        if event_payload.get(key) is not None:
-                            await self._fire(key,
-                                             RealTimeEventStreamEvent.from_dict(event_payload))
+                if processed_handlers := self.event_listeners.get("ALL_EVENTS_PROCESSED"):
+                    for handler in processed_handlers:
+                        try:
+                            await handler(data)
+                        except Exception:
+                            logging.exception(f"Handler {handler} failed to handle {type(data)}")
 
         logging.info("Event stream closed")
 
-    async def _send_heartbeat(self, user_urn: URN):
-        is_first = True
-        mp_version = json.loads(self.headers["x-li-track"])["mpVersion"]
+    async def _fire_decorated_event(self, data: dict[str, Any]):
+        event_payload = data.get("com.linkedin.realtimefrontend.DecoratedEvent", {}).get(
+            "payload", {}
+        )
 
-        logging.info(f"Starting heartbeat task with client version {mp_version}")
+        if event_payload:
+            logging.debug("Firing events for keys %s", event_payload.keys())
 
-        while True:
-            await asyncio.sleep(60)
-            logging.info("Sending heartbeat")
-
-            await self._post(
-                CONNECTIVITY_TRACKING_URL,
-                params={"action": "sendHeartbeat"},
-                json={
-                    "isFirstHeartbeat": not is_first,
-                    "isLastHeartbeat": False,
-                    "realtimeSessionId": str(self._realtime_session_id),
-                    "mpName": "voyager-web",
-                    "mpVersion": mp_version,
-                    "clientId": "voyager-web",
-                    "actorUrn": str(user_urn),
-                    "contextUrns": [str(user_urn)],
-                },
-            )
+            for key in self.event_listeners.keys():
+                if event_payload.get(key) is not None:
+                    await self._fire(key,
+                                     RealTimeEventStreamEvent.from_dict(event_payload))
+
+    async def replay_event(self, data: dict[str, Any]):
+        """
+        Fire the listeners for a raw event stream payload that was received earlier, for
+        example one read back from a journal. The ``ALL_EVENTS`` and ``ALL_EVENTS_PROCESSED``
+        listeners are not called.
+        """
+        await self._fire_decorated_event(data)
+
+    @cached_property
+    def mp_version(self) -> str:
+        return json.loads(self.headers["x-li-track"])["mpVersion"]
 
-            is_first = False
+    async def send_heartbeat(self, user_urn: URN, is_first: bool) -> aiohttp.ClientResponse:
+        """
+        Send a connectivity heartbeat for the current realtime session. The heartbeats are
+        scheduled by :data:`heartbeat_scheduler` while the listener is running.
+        """
+        return await self._request(
+            "POST",
+            CONNECTIVITY_TRACKING_URL,
+            "heartbeat",
+            headers=self.headers,
+            params={"action": "sendHeartbeat"},
+            json={
+                "isFirstHeartbeat": not is_first,
+                "isLastHeartbeat": False,
+                "realtimeSessionId": str(self._realtime_session_id),
+                "mpName": "voyager-web",
+                "mpVersion": self.mp_version,
+                "clientId": "voyager-web",
+                "actorUrn": str(user_urn),
+                "contextUrns": [str(user_urn)],
+            },
+        )
 
     async def start_listener(self, user_urn: URN):
         self._realtime_session_id = uuid.uuid4()
         logging.info(f"Created realtime session ID: {self._realtime_session_id}")
         while True:
             try:
-                self._heartbeat_task = asyncio.create_task(self._send_heartbeat(user_urn))
+                heartbeat_scheduler.add(self, user_urn)
                 await self._listen_to_event_stream()
             except asyncio.TimeoutError as te:
                 logging.exception(f"Timeout in listener: {te}")
@@ -653,7 +801,6 @@ class LinkedInMessaging:
                 logging.exception(f"Got exception in listener: {e}")
                 raise
             finally:
-                if not self._heartbeat_task.done():
-                    self._heartbeat_task.cancel()
+                heartbeat_scheduler.remove(self)
 
     # endregion
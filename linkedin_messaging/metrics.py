@@ -0,0 +1,84 @@
+"""
+Prometheus metrics for requests to LinkedIn. The metrics are only collected if
+``prometheus_client`` is installed.
+"""
+
+from typing import Any, Optional
+
+import aiohttp
+
+try:
+    from prometheus_client import Counter, Histogram
+except ImportError:
+    Counter = Histogram = None
+
+
+class _NoopMetric:
+    def labels(self, *args: Any, **kwargs: Any) -> "_NoopMetric":
+        return self
+
+    def observe(self, amount: float):
+        pass
+
+    def inc(self, amount: float = 1):
+        pass
+
+
+def _histogram(name: str, documentation: str, **kwargs: Any) -> Any:
+    if Histogram is None:
+        return _NoopMetric()
+    return Histogram(name, documentation, ["endpoint", "status"], **kwargs)
+
+
+def _counter(name: str, documentation: str, labels: tuple[str, ...] = ("endpoint",)) -> Any:
+    if Counter is None:
+        return _NoopMetric()
+    return Counter(name, documentation, labels)
+
+
+REQUEST_TIME = _histogram(
+    "linkedin_request_time_seconds",
+    "Time from sending a request to LinkedIn until its response body was read",
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60),
+)
+RESPONSE_SIZE = _histogram(
+    "linkedin_response_size_bytes",
+    "Size of response bodies from LinkedIn",
+    buckets=(256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216),
+)
+RATE_LIMITED = _counter("linkedin_rate_limited_total", "Requests rejected with HTTP 429")
+REDIRECTS = _counter("linkedin_redirects_total", "Redirects in responses from LinkedIn")
+HEARTBEATS = _counter(
+    "linkedin_heartbeats_total", "Connectivity heartbeats sent to LinkedIn", ("result",)
+)
+
+
+def status_class(status: int) -> str:
+    """Return the class of an HTTP status code, like ``2xx``."""
+    return f"{status // 100}xx"
+
+
+def track_response(
+    endpoint: str,
+    response: aiohttp.ClientResponse,
+    duration: float,
+    size: Optional[int] = None,
+):
+    """
+    Record a response to a request for the given logical endpoint. ``size`` is the length of the
+    body, or ``None`` if it's not read (e.g. for streams).
+    """
+    status = status_class(response.status)
+    REQUEST_TIME.labels(endpoint, status).observe(duration)
+    if size is not None:
+        RESPONSE_SIZE.labels(endpoint, status).observe(size)
+    if response.status == 429:
+        RATE_LIMITED.labels(endpoint).inc()
+    redirects = len(response.history) + (300 <= response.status < 400)
+    if redirects:
+        REDIRECTS.labels(endpoint).inc(redirects)
+
+
+def track_error(endpoint: str, duration: float):
+    """Record a request that failed without a response, e.g. because of a connection error."""
+    REQUEST_TIME.labels(endpoint, "error").observe(duration)
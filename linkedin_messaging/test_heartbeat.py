@@ -0,0 +1,66 @@
+from typing import Callable
+import asyncio
+import time
+
+from .api_objects import URN
+from .heartbeat import HeartbeatScheduler
+
+
+class FakeResponse:
+    status = 200
+
+
+class FakeClient:
+    def __init__(self, scheduler: HeartbeatScheduler, order: list[int]):
+        self.scheduler = scheduler
+        self.order = order
+        self.sent: list[tuple[float, int, bool]] = []
+        self.task_factory = asyncio.create_task
+
+    async def send_heartbeat(self, user_urn: URN, is_first: bool) -> FakeResponse:
+        position = self.scheduler._position
+        self.sent.append((time.monotonic(), position, is_first))
+        self.order.append(position)
+        return FakeResponse()
+
+
+async def _until(condition: Callable[[], bool], timeout: float = 10) -> None:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        await asyncio.sleep(0.01)
+
+
+def test_heartbeats_are_spread_over_the_interval():
+    async def run() -> tuple[list[FakeClient], dict[FakeClient, int], list[int]]:
+        scheduler = HeartbeatScheduler(interval=0.4, slots=4)
+        order: list[int] = []
+        clients = [FakeClient(scheduler, order) for _ in range(4)]
+        for i, client in enumerate(clients):
+            scheduler.add(client, URN(f"urn:li:fsd_profile:{i}"))
+        slots = {client: heartbeat.slot for client, heartbeat in scheduler._heartbeats.items()}
+        await _until(lambda: all(len(client.sent) >= 3 for client in clients))
+        scheduler.remove(clients[0])
+        order_before_removal = list(order)
+        await _until(lambda: all(len(client.sent) >= 5 for client in clients[1:]))
+        for client in clients[1:]:
+            scheduler.remove(client)
+        await _until(lambda: scheduler._task.done())
+        return clients, slots, order_before_removal
+
+    clients, slots, order = asyncio.run(run())
+    assert set(slots.values()) == {0, 1, 2, 3}
+    assert order.count(slots[clients[0]]) == len(clients[0].sent)
+    for client in clients:
+        # Every heartbeat of a client is sent when the wheel reaches its slot.
+        assert {position for _, position, _ in client.sent} == {slots[client]}
+        assert [is_first for _, _, is_first in client.sent] == [True] + [False] * (
+            len(client.sent) - 1
+        )
+        # Heartbeats can be late if the loop is busy, but never early.
+        for (previous, _, _), (current, _, _) in zip(client.sent, client.sent[1:]):
+            assert current - previous > 0.4 * 0.9
+
+    # Once every client has sent its first heartbeat, the slots take turns in wheel order.
+    steady = order[max(order.index(slot) for slot in slots.values()) :]
+    assert len(steady) > 4 and all((b - a) % 4 == 1 for a, b in zip(steady, steady[1:]))